@@ -0,0 +1,427 @@
+from __future__ import division
+
+import argparse
+import array
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import time
+
+import codec
+import lighting
+import world
+from heightcache import HeightCache
+from region import RegionStore
+from world import World
+
+
+def _world(args):
+    start = time.perf_counter()
+    model = World(args.size, args.step, args.seed)
+    print("generated %d blocks in %d sectors in %.1f s" % (
+        len(model.world), len(model.sectors), time.perf_counter() - start))
+    return model
+
+
+def bench_codec(args):
+    """ Sector encode / decode throughput and compression ratio.
+    """
+    model = _world(args)
+    sectors = sorted(model.sectors)
+    blocks = len(model.world)
+    # What sending the world as it is stored costs: a pickled dict of
+    # position -> block name per sector.
+    baseline = sum(len(pickle.dumps(dict((p, model.world[p]) for p in model.sectors[sector])))
+                   for sector in sectors)
+    print("%-8s %12s %12s %12s %10s %10s" % (
+        "mode", "bytes", "bytes/block", "encode/s", "decode/s", "ratio"))
+    print("%-8s %12d %12.2f %12s %10s %10.1f" % (
+        "pickle", baseline, baseline / blocks, "-", "-", 1.0))
+    for name, compress in (("rle", False), ("rle+zlib", True)):
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            encoded = [codec.encode_sector(model, sector, compress) for sector in sectors]
+        encode = (time.perf_counter() - start) / args.repeat
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            decoded = [codec.decode_sector(data) for data in encoded]
+        decode = (time.perf_counter() - start) / args.repeat
+        assert sum(len(b) for _, b in decoded) == blocks
+        size = sum(len(data) for data in encoded)
+        print("%-8s %12d %12.2f %12.0f %10.0f %10.1f" % (
+            name, size, size / blocks, blocks / encode, blocks / decode,
+            baseline / size))
+    print("(encode/s and decode/s are blocks per second)")
+
+
+def _size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def bench_save(args):
+    """ Size and time of "full" and "delta" saves of a lightly edited world,
+    and the time to open and load each back.
+    """
+    print("%-6s %12s %10s %10s %10s" % ("mode", "bytes", "save s", "open s", "load s"))
+    for mode in ("full", "delta"):
+        path = tempfile.mkdtemp()
+        try:
+            store = RegionStore(path, mode)
+            model = World(args.size, args.step, args.seed, store)
+            sectors = sorted(model.sectors)
+            for sector in sectors:
+                model.load_sector(sector)
+            rng = random.Random(args.seed)
+            positions = list(model.world)
+            for _ in range(args.edits):
+                position = rng.choice(positions)
+                if position in model.world:
+                    model.remove_block(position, immediate=False)
+                else:
+                    model.add_block(position, "glass", immediate=False)
+            start = time.perf_counter()
+            model.save()
+            save = time.perf_counter() - start
+            store.close()
+            expected = dict(model.world)
+
+            start = time.perf_counter()
+            store = RegionStore(path)
+            model = World(store=store)
+            opened = time.perf_counter() - start
+            start = time.perf_counter()
+            for sector in sectors:
+                model.load_sector(sector)
+            load = time.perf_counter() - start
+            store.close()
+            assert model.world == expected
+            print("%-6s %12d %10.2f %10.2f %10.2f" % (mode, _size(path), save, opened, load))
+        finally:
+            shutil.rmtree(path)
+    print("(%d edits; open includes regenerating the terrain in delta mode)" % args.edits)
+
+
+def bench_generate(args):
+    """ World generation time without the height cache, with a cold cache
+    and with a warm one.
+    """
+    path = tempfile.mkdtemp()
+    try:
+        print("%-8s %10s %8s %8s" % ("cache", "seconds", "hits", "misses"))
+        for name in ("none", "cold", "warm"):
+            heights = None if name == "none" else HeightCache(path)
+            start = time.perf_counter()
+            World(args.size, args.step, args.seed, heights=heights)
+            elapsed = time.perf_counter() - start
+            if heights is None:
+                print("%-8s %10.2f %8s %8s" % (name, elapsed, "-", "-"))
+            else:
+                print("%-8s %10.2f %8d %8d" % (name, elapsed, heights.hits, heights.misses))
+                heights.close()
+    finally:
+        shutil.rmtree(path)
+
+
+class _CountingWorld(World):
+    """ A world counting the blocks a renderer would be asked to draw and
+    remove, and the sections it would have to rebuild.
+    """
+
+    def __init__(self, *args):
+        self.draws = 0
+        self.remeshed = set()
+        super(_CountingWorld, self).__init__(*args)
+
+    def _show_block_typed(self, position, bid):
+        self.draws += 1
+        self.remeshed.add(world.sectionize(position))
+
+    def _hide_block(self, position):
+        self.draws += 1
+        self.remeshed.add(world.sectionize(position))
+
+
+def bench_bulk(args):
+    """ Carving a cube out of the terrain and filling it back in, block by
+    block and inside `World.bulk()`.
+    """
+    model = _CountingWorld(args.size, args.step, args.seed)
+    for sector in list(model.sectors):
+        model.show_sector(sector)
+    model.process_entire_queue()
+    cx = cz = args.size // 2
+    cy = max(y for x, y, z in model.world if (x, z) == (cx, cz))
+    cube = [(cx + dx, cy + dy, cz + dz) for dx in range(-8, 8)
+            for dy in range(-8, 8) for dz in range(-8, 8)]
+    print("%-6s %-6s %10s %10s %10s" % ("edit", "mode", "ms", "draws", "sections"))
+    for name, edit in (
+            ("carve", lambda p: p in model.world and model.remove_block(p)),
+            ("fill", lambda p: p not in model.world and model.add_block(p, "stone"))):
+        before = dict((p, (model.world[p], model.rots[p])) for p in cube if p in model.world)
+        results = []
+        for mode in ("block", "bulk"):
+            # Start each run from the same blocks.
+            with model.bulk():
+                for position in cube:
+                    if position in model.world:
+                        model.remove_block(position)
+                for position in cube:
+                    if position in before:
+                        bid, turn = before[position]
+                        model.add_block(position, bid, turn=turn)
+            model.draws = 0
+            model.remeshed = set()
+            start = time.perf_counter()
+            if mode == "bulk":
+                with model.bulk():
+                    for position in cube:
+                        edit(position)
+            else:
+                for position in cube:
+                    edit(position)
+            elapsed = time.perf_counter() - start
+            results.append((dict(model.world), dict(model.shown)))
+            print("%-6s %-6s %10.1f %10d %10d" % (
+                name, mode, elapsed * 1000, model.draws, len(model.remeshed)))
+        assert results[0] == results[1]
+    print("(draws are blocks shown or hidden; sections are meshes to rebuild)")
+
+
+def bench_explode(args):
+    """ A lattice of TNT on the surface, set off by priming its centre and
+    run tick by tick on the game's budget.
+    """
+    model = World(args.size, args.step, args.seed)
+    cx = cz = args.size // 2
+    cy = max(y for x, y, z in model.world if (x, z) == (cx, cz))
+    lattice = [(cx + dx, cy + dy, cz + dz) for dx in range(-12, 13, 3)
+               for dy in range(0, 7, 3) for dz in range(-12, 13, 3)]
+    with model.bulk():
+        for position in lattice:
+            model.add_block(position, "tnt", immediate=False)
+    explosions = model.explosions
+    explosions.prime(lattice[len(lattice) // 2])
+    start = time.perf_counter()
+    longest = longest_cpu = 0
+    ticks = 0
+    while explosions.primed or explosions.current is not None:
+        tick = time.perf_counter()
+        cpu = time.process_time()
+        explosions.tick(0.25 / world.TICKS_PER_SEC)
+        longest = max(longest, time.perf_counter() - tick)
+        # The budget is in CPU time, as in `World.process_queue()`.
+        longest_cpu = max(longest_cpu, time.process_time() - cpu)
+        ticks += 1
+    elapsed = time.perf_counter() - start
+    print("%d tnt, %d detonations over %d ticks" % (
+        len(lattice), explosions.detonations, ticks))
+    print("%d blocks destroyed in %.2f s: %.0f blocks/s, %.1f ms/detonation" % (
+        explosions.destroyed, elapsed, explosions.destroyed / elapsed,
+        elapsed / explosions.detonations * 1000))
+    print("longest tick %.1f ms, %.1f ms of cpu (budget %.1f ms)" % (
+        longest * 1000, longest_cpu * 1000, 0.25 / world.TICKS_PER_SEC * 1000))
+
+
+def bench_flow(args):
+    """ Water running from a lake down a trench dug from its shore, then a
+    sponge soaking up the lake where the trench starts.
+    """
+    model = World(args.size, args.step, args.seed)
+    lake = sum(1 for bid in model.world.values() if bid == "water")
+    shore = sorted(p for p, bid in model.world.items() if bid == "water" and p[1] == 30
+                   and model.world.get((p[0] + 1, 30, p[2])) not in (None, "water"))
+    x, y, z = shore[len(shore) // 2]
+    with model.bulk():
+        for dx in range(1, 25):
+            for dy in (0, -1):
+                if (x + dx, y + dy, z) in model.world:
+                    model.remove_block((x + dx, y + dy, z))
+    print("%-8s %8s %8s %8s %12s" % ("", "ticks", "steps", "updates", "ms/tick max"))
+    for name, action in (("trench", None),
+                         ("sponge", lambda: model.place_block((x + 1, y - 1, z), (x + 1, y, z), "sponge"))):
+        if action is not None:
+            action()
+        updates = model.updates
+        steps, count = model.fluids.steps, updates.updates
+        ticks = 0
+        longest = 0
+        while updates.scheduled:
+            start = time.perf_counter()
+            model.tick(0.25 / world.TICKS_PER_SEC)
+            longest = max(longest, time.perf_counter() - start)
+            ticks += 1
+        print("%-8s %8d %8d %8d %12.2f" % (
+            name, ticks, model.fluids.steps - steps, updates.updates - count, longest * 1000))
+    flowing = sum(1 for bid in model.world.values() if bid == "flowing_water")
+    print("(%d water sources in the world, %d flowing blocks at the end)" % (lake, flowing))
+
+
+def bench_light(args):
+    """ Computing the light of the sectors around the centre, then the cost
+    of single edits there: a roof over the ground, lava and digging down.
+    """
+    model = World(args.size, args.step, args.seed)
+    light = model.light
+    cx = cz = args.size // 2
+    center = world.sectorize((cx, 0, cz))
+    sectors = [(center[0] + dx, 0, center[2] + dz) for dx in (-1, 0, 1) for dz in (-1, 0, 1)]
+    start = time.perf_counter()
+    for sector in sectors:
+        light.get((sector[0] * model.mask.size, 0, sector[2] * model.mask.size), lighting.SKY)
+    elapsed = time.perf_counter() - start
+    print("computed %d sectors in %.1f ms: %.1f ms/sector" % (
+        len(sectors), elapsed * 1000, elapsed / len(sectors) * 1000))
+    cy = max(y for x, y, z in model.world if (x, z) == (cx, cz))
+    roof = [(cx + dx, cy + 6, cz + dz) for dx in range(-5, 6) for dz in range(-5, 6)]
+    top = max(y for x, y, z in model.world if (x, z) == (cx + 8, cz + 8))
+    pit = [(cx + 8, y, cz + 8) for y in range(top, top - 10, -1)]
+    print("%-8s %8s %8s %12s %12s" % ("", "edits", "relit", "ms/edit", "ms/edit max"))
+    for name, edits in (("roof", [(p, "stone") for p in roof]),
+                        ("lava", [((cx, cy + 1, cz), "lava"), ((cx, cy + 1, cz), None)]),
+                        ("dig", [(p, None) for p in pit if p in model.world])):
+        relit = light.relit
+        longest = 0
+        start = time.perf_counter()
+        for position, bid in edits:
+            edit = time.perf_counter()
+            if bid is None:
+                model.remove_block(position, immediate=False)
+            else:
+                model.add_block(position, bid, immediate=False)
+            longest = max(longest, time.perf_counter() - edit)
+        elapsed = time.perf_counter() - start
+        print("%-8s %8d %8d %12.2f %12.2f" % (
+            name, len(edits), light.relit - relit, elapsed / len(edits) * 1000, longest * 1000))
+
+
+def bench_mesh(args):
+    """ Time to build the vertex data of every exposed block, with flat
+    shading and with ambient occlusion, without drawing.
+    """
+    # Imported here so the other benchmarks don't need pyglet.
+    import minecraft
+    model = minecraft.Model(args.size, args.step, args.seed)
+    exposed = [(position, bid) for position, bid in model.world.items()
+               if model.exposed(position)]
+    for position, bid in exposed:
+        # Compute the light first so it is not timed.
+        model.light.brightness(position)
+    print("%d exposed blocks" % len(exposed))
+    times = {}
+    for occlusion in (False, True):
+        model.occlusion = occlusion
+        best = None
+        for _ in range(args.repeat):
+            model._faces.clear()
+            start = time.perf_counter()
+            for position, bid in exposed:
+                model._show_block_typed(position, bid)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times[occlusion] = best
+        print("%-10s %8.1f ms %8.2f us/block" % (
+            "occlusion" if occlusion else "flat", best * 1000, best / len(exposed) * 1e6))
+    print("ambient occlusion adds %.0f%% to meshing" % ((times[True] / times[False] - 1) * 100))
+
+
+def bench_sort(args):
+    """ Cost of sorting translucent geometry back to front: the sections
+    when the eye enters another section, and the faces of the eye's section
+    when it moves to another block.
+    """
+    import minecraft
+    model = minecraft.Model(args.size, args.step, args.seed)
+    for sector in list(model.sectors):
+        model.show_sector(sector)
+    model.process_entire_queue()
+    sections = {}
+    for section, faces in model._faces.items():
+        late = [face for face in faces.values() if face[0]]
+        if late:
+            sections[section] = [array.array(kind, (v for face in late for v in face[index]))
+                                 for index, kind in ((1, "h"), (2, "B"))]
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        sorted(sections, reverse=True, key=lambda other: sum(c ** 2 for c in other))
+    print("%d translucent sections sorted in %.3f ms" % (
+        len(sections), (time.perf_counter() - start) / args.repeat * 1000))
+    print("%-12s %8s %12s" % ("section", "quads", "ms/sort"))
+    for section, (corners, packed) in sorted(sections.items()):
+        size = model.mask.size
+        eye = tuple((c + 0.5) * size for c in section)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            minecraft.sort_quads(corners, packed, eye)
+        print("%-12s %8d %12.2f" % (
+            section, len(corners) // 8, (time.perf_counter() - start) / args.repeat * 1000))
+
+
+def bench_cull(args):
+    """ Sections drawn with and without walking the visibility graph, from
+    above the ground at the centre of the world and from inside its terrain.
+    """
+    import minecraft
+    model = minecraft.Model(args.size, args.step, args.seed)
+    for sector in list(model.sectors):
+        model.show_sector(sector)
+    model.process_entire_queue()
+    cx = cz = args.size // 2
+    cy = max(y for x, y, z in model.world if (x, z) == (cx, cz))
+    shown = set(model._faces)
+    print("%-10s %10s %10s %10s %12s" % ("eye", "meshes", "visible", "drawn", "ms/walk"))
+    for name, eye in (("above", (cx, cy + 2, cz)), ("surface", (cx, cy + 1, cz)),
+                      ("buried", (cx, cy - 30, cz))):
+        section = world.sectionize(eye)
+        x, _, z = section
+        radius = model.detail_radius() + 1
+        meshes = [s for s in shown if (s[0] - x) ** 2 + (s[2] - z) ** 2 <= radius ** 2]
+        model.visibility.connections.clear()
+        model.visibility.open.clear()
+        visible = model.visibility.visible(section, radius)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            model.visibility.visible(section, radius)
+        elapsed = (time.perf_counter() - start) / args.repeat
+        drawn = len(shown.intersection(visible))
+        print("%-10s %10d %10d %10d %12.2f" % (name, len(meshes), len(visible), drawn, elapsed * 1000))
+    print("(meshes are sections with shown blocks in range; drawn are those visible)")
+
+
+BENCHMARKS = {
+    "bulk": bench_bulk,
+    "cull": bench_cull,
+    "explode": bench_explode,
+    "flow": bench_flow,
+    "light": bench_light,
+    "mesh": bench_mesh,
+    "codec": bench_codec,
+    "generate": bench_generate,
+    "save": bench_save,
+    "sort": bench_sort,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run CPU benchmarks headless.")
+    parser.add_argument("name", choices=sorted(BENCHMARKS))
+    parser.add_argument("--size", type=int, default=128,
+                        help="world size in blocks (default: 128)")
+    parser.add_argument("--step", type=int, default=1,
+                        help="generation step size (default: 1)")
+    parser.add_argument("--seed", type=int, default=88960,
+                        help="world seed (default: 88960)")
+    parser.add_argument("--sector-size", type=int, default=world.SECTOR_SIZE,
+                        help="sector size (default: %d)" % world.SECTOR_SIZE)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed repetitions (default: 3)")
+    parser.add_argument("--edits", type=int, default=100,
+                        help="block edits before saving (default: 100)")
+    args = parser.parse_args()
+    world.SECTOR_SIZE = args.sector_size
+    BENCHMARKS[args.name](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+#block properties
+#since blocks are defined by texture only,
+#i decided to use lists of block id's attributed
+#to properties, instead of the other way round
+
+#blocks do not cull other blocks
+SEETHR = [
+    "tall_grass",
+    "oak_plank_slab",
+    "birch_plank_slab",
+    "spruce_plank_slab",
+    "jungle_plank_slab",
+    "acacia_plank_slab",
+    "doak_plank_slab",
+    "cobble_slab",
+    "mossy_cobble_slab",
+    "brick_slab",
+    "stone_slab",
+    "sandstone_slab",
+    "smooth_sandstone_slab",
+    "stone_brick_slab",
+    "cracked_stone_brick_slab",
+    "mossy_stone_brick_slab",
+    "smooth_stone_slab",
+    "dandelion",
+    "poppy",
+    "azure",
+    "orchid",
+    "allium",
+    "cornflower",
+    "fern",
+]
+
+#blocks only cull blocks of the same type
+GROUPCULL = [
+    "water",
+    "lava",
+    "flowing_water",
+    "flowing_lava",
+    "oak_leaves",
+    "birch_leaves",
+    "spruce_leaves",
+    "jungle_leaves",
+    "acacia_leaves",
+    "doak_leaves",
+    "glass",
+]
+
+#blocks use a cross shape
+PLANTB = [
+    "tall_grass",
+    "dandelion",
+    "poppy",
+    "azure",
+    "orchid",
+    "allium",
+    "cornflower",
+    "fern",
+]
+
+#blocks can have plants placed on them
+PLANTER = [
+    "grass",
+    "dirt",
+    "podzol",
+]
+
+#blocks are plants and can only be placed on planter blocks
+PLANTEE = [
+    "tall_grass",
+    "dandelion",
+    "poppy",
+    "azure",
+    "orchid",
+    "allium",
+    "cornflower",
+    "fern",
+]
+
+#blocks are fluids, mapped to their source block; fluids of the same
+#source cull each other
+FLUID = {
+    "water": "water",
+    "flowing_water": "water",
+    "lava": "lava",
+    "flowing_lava": "lava",
+}
+
+#blocks give off light, from 1 to 15
+LIGHT = {
+    "lava": 15,
+    "flowing_lava": 15,
+}
+
+#blocks use the water block model
+WATERB = [
+    "water",
+    "lava",
+    "flowing_water",
+    "flowing_lava",
+]
+
+#blocks do not collide with the player
+THRU = [
+    "tall_grass",
+    "water",
+    "lava",
+    "flowing_water",
+    "flowing_lava",
+    "dandelion",
+    "poppy",
+    "azure",
+    "orchid",
+    "allium",
+    "cornflower",
+    "fern",
+]
+
+#blocks do not get hit by punches
+# !NOT IMPLEMENTED!
+PUNCHTHRU = [
+    "water",
+    "lava",
+    "flowing_water",
+    "flowing_lava",
+]
+
+#blocks you can swim in
+# !NOT IMPLEMENTED!
+SWIM = [
+    "water",
+    "lava",
+    "flowing_water",
+    "flowing_lava",
+]
+
+#blocks will be overwritten when blocks are placed on it
+REPLACE = [
+    "tall_grass",
+    "fern",
+]
+
+#blocks blended after the rest, farthest first
+RENDERLATE = [
+    "water",
+    "lava",
+    "flowing_water",
+    "flowing_lava",
+]
+
+#blocks use the slab model
+SLAB = [
+    "oak_plank_slab",
+    "birch_plank_slab",
+    "spruce_plank_slab",
+    "jungle_plank_slab",
+    "acacia_plank_slab",
+    "doak_plank_slab",
+    "cobble_slab",
+    "mossy_cobble_slab",
+    "brick_slab",
+    "stone_slab",
+    "sandstone_slab",
+    "smooth_sandstone_slab",
+    "stone_brick_slab",
+    "cracked_stone_brick_slab",
+    "mossy_stone_brick_slab",
+    "smooth_stone_slab",
+]
+
+#blocks that rotate around y when placed
+YROT = [
+    "furnace",
+]
+
+#blocks that rotate randomly around y when when placed
+RYROT = [
+    "cobblestone",
+    "grass",
+    "dirt",
+    "podzol",
+    "coal_ore",
+    "iron_ore",
+    "gold_ore",
+    "diamond_ore",
+    "emerald_ore",
+    "sand",
+    "mossy_cobble",
+    "sandstone",
+]
+
+#resistance of blocks to explosions; slabs and their "_inv" and "_full"
+#forms resist like the block they are made of
+BLAST_RESISTANCE = {
+    "stone": 6.0,
+    "stone_slab": 6.0,
+    "bedrock": 3600000.0,
+    "cobble": 6.0,
+    "cobble_slab": 6.0,
+    "mossy_cobble": 6.0,
+    "mossy_cobble_slab": 6.0,
+    "coal_ore": 3.0,
+    "iron_ore": 3.0,
+    "gold_ore": 3.0,
+    "diamond_ore": 3.0,
+    "emerald_ore": 3.0,
+    "sand": 0.5,
+    "sandstone": 0.8,
+    "sandstone_slab": 0.8,
+    "smooth_sandstone": 6.0,
+    "smooth_sandstone_slab": 6.0,
+    "glass": 0.3,
+    "obsidian": 1200.0,
+    "dirt": 0.5,
+    "grass": 0.6,
+    "podzol": 0.5,
+    "tall_grass": 0.0,
+    "dandelion": 0.0,
+    "poppy": 0.0,
+    "azure": 0.0,
+    "orchid": 0.0,
+    "allium": 0.0,
+    "cornflower": 0.0,
+    "fern": 0.0,
+    "pumpkin": 1.0,
+    "oak_log": 2.0,
+    "oak_leaves": 0.2,
+    "oak_planks": 3.0,
+    "oak_plank_slab": 3.0,
+    "birch_log": 2.0,
+    "birch_leaves": 0.2,
+    "birch_planks": 3.0,
+    "birch_plank_slab": 3.0,
+    "spruce_log": 2.0,
+    "spruce_leaves": 0.2,
+    "spruce_planks": 3.0,
+    "spruce_plank_slab": 3.0,
+    "jungle_log": 2.0,
+    "jungle_leaves": 0.2,
+    "jungle_planks": 3.0,
+    "jungle_plank_slab": 3.0,
+    "acacia_log": 2.0,
+    "acacia_leaves": 0.2,
+    "acacia_planks": 3.0,
+    "acacia_plank_slab": 3.0,
+    "doak_log": 2.0,
+    "doak_leaves": 0.2,
+    "doak_planks": 3.0,
+    "doak_plank_slab": 3.0,
+    "bricks": 6.0,
+    "brick_slab": 6.0,
+    "stone_brick": 6.0,
+    "stone_brick_slab": 6.0,
+    "cracked_stone_brick": 6.0,
+    "cracked_stone_brick_slab": 6.0,
+    "mossy_stone_brick": 6.0,
+    "mossy_stone_brick_slab": 6.0,
+    "smooth_stone": 6.0,
+    "smooth_stone_slab": 6.0,
+    "furnace": 3.5,
+    "water": 100.0,
+    "lava": 100.0,
+    "flowing_water": 100.0,
+    "flowing_lava": 100.0,
+    "tnt": 0.0,
+    "sponge": 0.6,
+    "wet_sponge": 0.6,
+}
+
+#resistance of blocks missing from BLAST_RESISTANCE
+DEFAULT_BLAST_RESISTANCE = 1.0
+
+#every block, leaving out the "_inv" and "_full" forms of slabs, which
+#placing a slab makes; BLAST_RESISTANCE has an entry for each
+BLOCKS = frozenset(BLAST_RESISTANCE)
@@ -0,0 +1,172 @@
+import asyncio
+import threading
+
+from collections import deque
+
+import codec
+import net
+from world import sectorize
+
+
+class GameClient(object):
+    """ Connection to a `server.GameServer`. The asyncio loop runs on a
+    background thread; the game thread sends clicks with `place()` and
+    `dig()` and applies the server's block changes with `apply()` once per
+    frame.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+        # (n, s, seed, sector_size) of the server's world, set by `connect()`.
+        self.hello = None
+
+        # Changes received and not yet applied: (position, bid, turn) block
+        # changes, with bid None for removed blocks, and (sector, blocks)
+        # whole sectors as decoded by `codec.decode_sector()`.
+        self.deltas = deque()
+
+        # Mapping from sector to the changes received for it before the
+        # model had generated it and the sectors around it, applied in order
+        # once it has.
+        self.held = {}
+
+        # Mapping from the one-byte block ids bound by the server to names.
+        self.palette = {}
+
+        # The exception that ended the connection, if any.
+        self.error = None
+
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+        self._loop = None
+        self._writer = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def connect(self, timeout=30.0):
+        """ Connect to the server and wait for its world parameters.
+        Returns (n, s, seed, sector_size).
+        """
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout):
+            raise ConnectionError("timed out connecting to %s:%d" % (
+                self.host, self.port))
+        if self.hello is None:
+            raise ConnectionError("could not connect to %s:%d: %s" % (
+                self.host, self.port, self.error))
+        return self.hello
+
+    def _run(self):
+        asyncio.run(self._main())
+
+    async def _main(self):
+        try:
+            reader, self._writer = await asyncio.open_connection(
+                self.host, self.port)
+            self._loop = asyncio.get_running_loop()
+            payload = await self._read(reader)
+            if payload[0] != net.HELLO:
+                raise net.ProtocolError("expected HELLO")
+            self.hello = net.decode_hello(payload)
+            self._ready.set()
+            while True:
+                self._receive(await self._read(reader))
+        except (OSError, asyncio.IncompleteReadError, net.ProtocolError) as e:
+            self.error = e
+        finally:
+            self._ready.set()
+            if self._writer is not None:
+                self._writer.close()
+
+    async def _read(self, reader):
+        payload = await net.read_frame(reader)
+        self.bytes_received += len(payload) + 2
+        return payload
+
+    def _receive(self, payload):
+        kind = payload[0]
+        if kind == net.PALETTE:
+            index, bid = net.decode_palette(payload)
+            self.palette[index] = bid
+        elif kind == net.DELTA:
+            for x, y, z, index, turn in net.decode_deltas(payload):
+                bid = None if index == net.REMOVED else self.palette[index]
+                self.deltas.append(((x, y, z), bid, turn))
+        elif kind == net.SECTOR:
+            try:
+                self.deltas.append(codec.decode_sector(net.decode_sector(payload)))
+            except (ValueError, IndexError):
+                raise net.ProtocolError("malformed SECTOR message")
+        else:
+            raise net.ProtocolError("unexpected message type %r" % kind)
+
+    def _send(self, data):
+        if self._loop is None or self.error is not None:
+            return
+        self.bytes_sent += len(data)
+        self._loop.call_soon_threadsafe(self._writer.write, data)
+
+    def place(self, block, previous, bid, rotation):
+        """ Ask the server to right click `block` with `bid` in hand.
+        """
+        if block is not None:
+            self._send(net.encode_place(block, previous, bid, rotation))
+
+    def dig(self, block):
+        """ Ask the server to left click `block`.
+        """
+        if block is not None:
+            self._send(net.encode_break(block))
+
+    def apply(self, model):
+        """ Apply the block changes received so far to `model`, which should
+        not be `simulated`, so that it changes only as the server says.
+        Changes to sectors `model` is still generating wait until they are
+        generated, so generation doesn't undo them.
+        """
+        with model.bulk():
+            for sector in [sector for sector in self.held if model.generated_around(sector)]:
+                for change in self.held.pop(sector):
+                    self._apply(model, change)
+            while self.deltas:
+                change = self.deltas.popleft()
+                sector = change[0] if len(change) == 2 else sectorize(change[0])
+                if sector in self.held or not model.generated_around(sector):
+                    self.held.setdefault(sector, []).append(change)
+                else:
+                    self._apply(model, change)
+
+    def _apply(self, model, change):
+        if len(change) == 2:
+            self._apply_sector(model, *change)
+            return
+        position, bid, turn = change
+        if bid is None:
+            if position in model.world:
+                model.remove_block(position)
+        elif model.world.get(position) != bid or model.rots.get(position) != turn:
+            model.add_block(position, bid, turn=turn)
+
+    def _apply_sector(self, model, sector, blocks):
+        """ Make `sector` of `model` hold exactly `blocks`, touching only the
+        positions that differ.
+        """
+        wanted = dict((position, (bid, turn)) for position, bid, turn in blocks)
+        for position in list(model.sectors.get(sector, ())):
+            if position not in wanted:
+                model.remove_block(position)
+        # Bottom up, so plants find the blocks they stand on.
+        for position in sorted(wanted, key=lambda p: p[1]):
+            bid, turn = wanted[position]
+            if model.world.get(position) != bid or model.rots.get(position) != turn:
+                model.add_block(position, bid, turn=turn)
+
+    def close(self):
+        """ Close the connection.
+        """
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._writer.close)
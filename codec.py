@@ -0,0 +1,131 @@
+import struct
+import zlib
+
+from itertools import groupby
+
+import world
+
+# Binary encoding of one sector, used for network transfer and on disk.
+#
+#   header   magic "PSEC", version, flags, sector x, sector z, sector size,
+#            lowest y, number of layers
+#   body     palette: count, then length-prefixed block names
+#            runs: (run length, cell) varint pairs covering every cell
+#
+# Cells are ordered y, z, x (x fastest), so whole layers of stone or air
+# collapse into single runs. A cell is 0 for air, otherwise
+# (palette index + 1) * 4 + turn. With FLAG_ZLIB the body is deflated.
+
+MAGIC = b"PSEC"
+VERSION = 1
+FLAG_ZLIB = 1
+
+_HEADER = struct.Struct("!4sBBiiHiH")
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def encode_blocks(sector, blocks, compress=True, size=None):
+    """ Encode `blocks`, an iterable of (position, bid, turn) inside
+    `sector`, and return the bytes.
+    """
+    if size is None:
+        size = world.SECTOR_SIZE
+    sx, _, sz = sector
+    ox, oz = sx * size, sz * size
+    blocks = list(blocks)
+    if blocks:
+        ys = [position[1] for position, _, _ in blocks]
+        low, layers = min(ys), max(ys) - min(ys) + 1
+    else:
+        low, layers = 0, 0
+    palette = {}
+    cells = [0] * (size * size * layers)
+    for (x, y, z), bid, turn in blocks:
+        index = palette.get(bid)
+        if index is None:
+            index = palette[bid] = len(palette)
+        cells[((y - low) * size + z - oz) * size + x - ox] = (index + 1) * 4 + turn % 4
+    body = bytearray()
+    _write_varint(body, len(palette))
+    for bid in palette:
+        name = bid.encode("ascii")
+        _write_varint(body, len(name))
+        body += name
+    for cell, run in groupby(cells):
+        _write_varint(body, sum(1 for _ in run))
+        _write_varint(body, cell)
+    flags = 0
+    if compress:
+        body = zlib.compress(bytes(body))
+        flags |= FLAG_ZLIB
+    return _HEADER.pack(MAGIC, VERSION, flags, sx, sz, size, low, layers) + bytes(body)
+
+
+def encode_sector(model, sector, compress=True):
+    """ Encode the blocks of `model` in `sector` and return the bytes.
+    """
+    world_ = model.world
+    rots = model.rots
+    blocks = [(position, world_[position], rots.get(position, 0))
+              for position in model.sectors.get(sector, ())]
+    return encode_blocks(sector, blocks, compress)
+
+
+def decode_sector(data):
+    """ Decode bytes produced by `encode_sector()`. Returns (sector, blocks)
+    with blocks a list of (position, bid, turn).
+    """
+    try:
+        magic, version, flags, sx, sz, size, low, layers = _HEADER.unpack_from(data)
+    except struct.error:
+        raise ValueError("truncated sector header")
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a version %d sector" % VERSION)
+    body = data[_HEADER.size:]
+    if flags & FLAG_ZLIB:
+        try:
+            body = zlib.decompress(body)
+        except zlib.error as e:
+            raise ValueError("corrupt sector body: %s" % e)
+    count, offset = _read_varint(body, 0)
+    palette = []
+    for _ in range(count):
+        length, offset = _read_varint(body, offset)
+        palette.append(body[offset:offset + length].decode("ascii"))
+        offset += length
+    ox, oz = sx * size, sz * size
+    area = size * size
+    blocks = []
+    append = blocks.append
+    index = 0
+    end = len(body)
+    while offset < end:
+        run, offset = _read_varint(body, offset)
+        cell, offset = _read_varint(body, offset)
+        if cell:
+            bid = palette[(cell >> 2) - 1]
+            turn = cell & 3
+            for i in range(index, index + run):
+                y, rest = divmod(i, area)
+                z, x = divmod(rest, size)
+                append(((ox + x, low + y, oz + z), bid, turn))
+        index += run
+    return (sx, 0, sz), blocks
@@ -0,0 +1,205 @@
+from __future__ import division
+
+import heapq
+import math
+import random
+import time
+
+from blocks import BLAST_RESISTANCE, DEFAULT_BLAST_RESISTANCE
+
+# Explosions cast rays from the centre of the blast towards every cell on
+# the surface of a RAY_GRID^3 cube. A ray starts with the power of the
+# explosion, randomised by +-30%, and moves STEP blocks at a time, losing
+# STEP * 0.75 per step and (resistance + 0.3) * STEP per step spent inside a
+# block. Blocks reached while it still has power left are destroyed, so
+# strong blocks shield what is behind them.
+#
+# The steps of every ray are computed once per power and stored as runs of
+# (block offset, steps inside it), so an explosion only looks up the blocks
+# its rays cross.
+#
+# Explosions set off by `Explosions.tick()` cast their rays and remove the
+# blocks they destroyed a few at a time, so a large blast can be spread over
+# several ticks instead of overrunning its budget.
+
+RAY_GRID = 16
+STEP = 0.3
+
+# Power of a block of TNT.
+TNT_POWER = 4.0
+
+# Rays cast, and blocks removed, between checks of the time budget.
+RAY_BATCH = 16
+REMOVE_BATCH = 8
+
+# Range of ticks, at `world.TICKS_PER_SEC`, before TNT caught in a blast
+# goes off in turn.
+CHAIN_FUSE = (30, 90)
+
+# Mapping from power to the rays of an explosion of that power.
+_RAYS = {}
+
+
+def resistance(bid):
+    """ Returns the blast resistance of block `bid`.
+    """
+    bid = bid.replace("_inv", "").replace("_full", "")
+    return BLAST_RESISTANCE.get(bid, DEFAULT_BLAST_RESISTANCE)
+
+
+def rays(power):
+    """ Returns the rays of an explosion of `power`, each a tuple of
+    (offset, steps) runs in the order the ray crosses the blocks.
+    """
+    cached = _RAYS.get(power)
+    if cached is not None:
+        return cached
+    # Enough steps for the strongest ray to run out in empty space.
+    steps = int(math.ceil(power * 1.3 / (STEP * 0.75)))
+    last = RAY_GRID - 1
+    result = []
+    for i in range(RAY_GRID):
+        for j in range(RAY_GRID):
+            for k in range(RAY_GRID):
+                if i not in (0, last) and j not in (0, last) and k not in (0, last):
+                    continue
+                dx, dy, dz = (2 * c / last - 1 for c in (i, j, k))
+                length = math.sqrt(dx * dx + dy * dy + dz * dz)
+                dx, dy, dz = (STEP * c / length for c in (dx, dy, dz))
+                runs = []
+                for n in range(steps):
+                    offset = (int(round(dx * n)), int(round(dy * n)), int(round(dz * n)))
+                    if runs and runs[-1][0] == offset:
+                        runs[-1][1] += 1
+                    else:
+                        runs.append([offset, 1])
+                result.append(tuple((offset, count) for offset, count in runs))
+    cached = _RAYS[power] = tuple(result)
+    return cached
+
+
+def blast(world, center, power, rng=random):
+    """ Returns the set of positions in `world`, a mapping from position to
+    block, destroyed by an explosion of `power` at `center`.
+    """
+    destroyed = set()
+    for _ in cast(world, center, power, destroyed, rng):
+        pass
+    return destroyed
+
+
+def cast(world, center, power, destroyed, rng=random):
+    """ Generator adding the positions in `world` destroyed by an explosion
+    of `power` at `center` to the set `destroyed`, pausing after every
+    RAY_BATCH rays.
+    """
+    cx, cy, cz = center
+    get = world.get
+    resist = {}
+    for i, ray in enumerate(rays(power)):
+        if i and not i % RAY_BATCH:
+            yield
+        intensity = power * (0.7 + 0.6 * rng.random())
+        for (dx, dy, dz), count in ray:
+            position = (cx + dx, cy + dy, cz + dz)
+            bid = get(position)
+            if bid is None:
+                intensity -= count * STEP * 0.75
+            else:
+                r = resist.get(bid)
+                if r is None:
+                    r = resist[bid] = (resistance(bid) + 0.3) * STEP
+                if intensity > r:
+                    destroyed.add(position)
+                intensity -= count * (r + STEP * 0.75)
+            if intensity <= 0:
+                break
+
+
+class Explosions(object):
+    """ The explosions of a `world.World`. `detonate()` sets off TNT at once
+    and `prime()` from `tick()`;
+    TNT caught in the blast is removed and primed to go off a few ticks later
+    from `tick()`, which stops after its time budget, even in the middle of
+    an explosion, so long chains are spread over several frames.
+    """
+
+    def __init__(self, model, power=TNT_POWER, seed=None):
+        self.model = model
+        self.power = power
+        self.rng = random.Random(seed)
+
+        # Cast the rays now rather than during the first explosion.
+        rays(power)
+
+        # Heap of (tick, order, position) of primed TNT.
+        self.primed = []
+
+        # The explosion `tick()` is in the middle of, or None.
+        self.current = None
+        self.ticks = 0
+        self._order = 0
+
+        self.detonations = 0
+        self.destroyed = 0
+
+    def prime(self, position, fuse=0):
+        """ Set off the TNT at `position` after `fuse` ticks.
+        """
+        self._order += 1
+        heapq.heappush(self.primed, (self.ticks + fuse, self._order, position))
+
+    def detonate(self, position):
+        """ Explode at `position`, removing the TNT there if it has not been
+        already, and return the number of blocks destroyed.
+        """
+        destroyed = self.destroyed
+        for _ in self._explode(position):
+            pass
+        return self.destroyed - destroyed
+
+    def _explode(self, position):
+        """ Generator exploding at `position`, pausing between batches of
+        rays and of blocks removed. Blocks changed in the meantime are
+        removed only if they are still there.
+        """
+        model = self.model
+        world = model.world
+        if world.get(position) == "tnt":
+            model.remove_block(position)
+        destroyed = set()
+        for _ in cast(world, position, self.power, destroyed, self.rng):
+            yield
+        destroyed = list(destroyed)
+        count = 0
+        for i in range(0, len(destroyed), REMOVE_BATCH):
+            if i:
+                yield
+            with model.bulk():
+                for block in destroyed[i:i + REMOVE_BATCH]:
+                    bid = world.get(block)
+                    if bid is None:
+                        continue
+                    if bid == "tnt":
+                        self.prime(block, self.rng.randint(*CHAIN_FUSE))
+                    model.remove_block(block)
+                    count += 1
+        self.detonations += 1
+        self.destroyed += count
+
+    def tick(self, budget=None):
+        """ Advance one tick and set off the TNT whose fuse has run out,
+        leaving the rest, and the rest of an explosion, for the next tick
+        after `budget` seconds, if given.
+        """
+        self.ticks += 1
+        start = time.process_time()
+        while True:
+            if self.current is None:
+                if not self.primed or self.primed[0][0] > self.ticks:
+                    return
+                self.current = self._explode(heapq.heappop(self.primed)[2])
+            for _ in self.current:
+                if budget is not None and time.process_time() - start > budget:
+                    return
+            self.current = None
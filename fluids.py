@@ -0,0 +1,217 @@
+from __future__ import division
+
+from collections import deque
+
+from blocks import FLUID, PLANTEE, REPLACE
+
+# Water and lava flow, one step per block update, so only blocks next to a
+# change do any work and still lakes cost nothing.
+#
+# Source blocks ("water", "lava") never move. Flowing blocks have a level:
+# 1 next to a source or under falling fluid, one more for every block
+# further sideways, up to SPREAD levels. When a fluid block is updated it
+# re-derives its level from its neighbours, drying up if nothing feeds it,
+# then falls into the block below if it can, or else spreads sideways one
+# level further. A level that rises updates the flowing blocks around it
+# again, so flow cut off from its source feeds itself ever more weakly
+# until its levels pass SPREAD and it dries up. Lava touching water hardens
+# into obsidian, or cobble if it was flowing.
+#
+# Levels are kept per sector in bytearrays laid out like the
+# `world.OccupancyMask` bits, one byte per block, 0 meaning unknown. They
+# are not saved: a level that is not known is derived again from the
+# neighbours when the block is next updated.
+
+# Mapping from source block to its flowing block.
+FLOWING = {
+    "water": "flowing_water",
+    "lava": "flowing_lava",
+}
+
+# Levels a fluid spreads sideways from its source.
+SPREAD = {
+    "water": 7,
+    "lava": 3,
+}
+
+# Ticks, at `world.TICKS_PER_SEC`, between the flow steps of a fluid.
+FLOW_DELAY = {
+    "water": 15,
+    "lava": 90,
+}
+
+# Reach and number of blocks of water a sponge soaks up.
+SPONGE_REACH = 7
+SPONGE_LIMIT = 65
+
+_SIDES = ((-1, 0, 0), (1, 0, 0), (0, 0, -1), (0, 0, 1))
+_FACES = _SIDES + ((0, 1, 0), (0, -1, 0))
+
+
+class Fluids(object):
+    """ The flowing water and lava of a `world.World`. `update()` is called
+    by the world's `ticks.Scheduler` for fluid blocks, which it schedules
+    `FLOW_DELAY` ticks after a change next to them.
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+        # Mapping from sector to the bytearray of the levels in it.
+        self.levels = {}
+
+        # Flow steps taken.
+        self.steps = 0
+
+    def _cell(self, position):
+        mask = self.model.mask
+        x, y, z = position
+        if not 0 <= y < mask.height:
+            return None, 0
+        size = mask.size
+        return (x // size, 0, z // size), (y * size + z % size) * size + x % size
+
+    def _stored(self, position):
+        sector, i = self._cell(position)
+        levels = self.levels.get(sector)
+        return levels[i] if levels is not None else 0
+
+    def _store(self, position, level):
+        sector, i = self._cell(position)
+        if sector is None:
+            return
+        levels = self.levels.get(sector)
+        if levels is None:
+            mask = self.model.mask
+            levels = self.levels[sector] = bytearray(mask.size * mask.size * mask.height)
+        levels[i] = level
+
+    def level(self, position):
+        """ Returns the level of the fluid at `position`: 0 for a source,
+        otherwise its distance from the source, as far as it is known.
+        """
+        bid = self.model.world.get(position)
+        source = FLUID.get(bid)
+        if source is None or bid == source:
+            return 0
+        return self._stored(position) or SPREAD[source]
+
+    def drop(self, position):
+        """ Returns how far below a source's surface the surface of the fluid
+        at `position` is, as a fraction of a block.
+        """
+        source = FLUID.get(self.model.world.get(position))
+        if source is None:
+            return 0.0
+        return self.level(position) / (SPREAD[source] + 1)
+
+    def _set_level(self, position, level):
+        self._store(position, level)
+        if position in self.model.shown:
+            # Redraw it at its new height.
+            self.model.hide_block(position)
+            self.model.show_block(position)
+
+    def _support(self, position, source):
+        """ Returns the level the flowing block at `position` is fed at, or
+        None if nothing feeds it.
+        """
+        world = self.model.world
+        x, y, z = position
+        if FLUID.get(world.get((x, y + 1, z))) == source:
+            return 1
+        best = None
+        for dx, dy, dz in _SIDES:
+            other = (x + dx, y, z + dz)
+            if FLUID.get(world.get(other)) != source:
+                continue
+            level = self.level(other) + 1
+            if best is None or level < best:
+                best = level
+        if best is None or best > SPREAD[source]:
+            return None
+        return best
+
+    def _open(self, position):
+        if not self.model.contains(position):
+            # Fluids stay inside the world.
+            return False
+        bid = self.model.world.get(position)
+        return bid is None or bid in REPLACE or bid in PLANTEE
+
+    def _flow(self, position, flowing, level):
+        self._store(position, level)
+        self.model.add_block(position, flowing)
+
+    def update(self, position):
+        """ Take one flow step of the fluid at `position`.
+        """
+        model = self.model
+        world = model.world
+        bid = world[position]
+        source = FLUID[bid]
+        flowing = FLOWING[source]
+        x, y, z = position
+        if source == "lava":
+            for dx, dy, dz in _FACES:
+                if FLUID.get(world.get((x + dx, y + dy, z + dz))) == "water":
+                    model.add_block(position, "obsidian" if bid == source else "cobble")
+                    return
+        level = 0
+        if bid == flowing:
+            level = self._support(position, source)
+            if level is None:
+                self._store(position, 0)
+                model.remove_block(position)
+                return
+            stored = self._stored(position)
+            if level != stored:
+                self._set_level(position, level)
+                if not stored or level > stored:
+                    # Weaker, or not known to be stronger: what it fed may
+                    # now be fed too weakly, or only by itself.
+                    for dx, dy, dz in _FACES:
+                        other = (x + dx, y + dy, z + dz)
+                        if world.get(other) == flowing:
+                            model.updates.schedule(other, FLOW_DELAY[source])
+        self.steps += 1
+        below = (x, y - 1, z)
+        if self._open(below):
+            self._flow(below, flowing, 1)
+            return
+        if FLUID.get(world.get(below)) == source or level >= SPREAD[source]:
+            return
+        for dx, dy, dz in _SIDES:
+            other = (x + dx, y, z + dz)
+            if self._open(other):
+                self._flow(other, flowing, level + 1)
+            elif world.get(other) == flowing and self.level(other) > level + 1:
+                self._set_level(other, level + 1)
+                model.updates.schedule(other, FLOW_DELAY[source])
+
+    def absorb(self, position, reach=SPONGE_REACH, limit=SPONGE_LIMIT):
+        """ Remove the water connected to `position`, nearest first, up to
+        `reach` blocks away and `limit` blocks in all. Returns the number of
+        blocks removed.
+        """
+        model = self.model
+        world = model.world
+        seen = set([position])
+        frontier = deque([(position, 0)])
+        removed = 0
+        with model.bulk():
+            while frontier and removed < limit:
+                (x, y, z), distance = frontier.popleft()
+                if distance == reach:
+                    continue
+                for dx, dy, dz in _FACES:
+                    other = (x + dx, y + dy, z + dz)
+                    if other in seen or FLUID.get(world.get(other)) != "water":
+                        continue
+                    seen.add(other)
+                    model.remove_block(other)
+                    removed += 1
+                    if removed == limit:
+                        break
+                    frontier.append((other, distance + 1))
+        return removed
@@ -0,0 +1,50 @@
+from __future__ import division
+
+# Render distance governor: raises or lowers the render distance so that
+# the work of a frame, the time spent updating and drawing it but not
+# waiting for the next one, stays under a target.
+#
+# Frame costs are averaged over INTERVAL seconds. An average over the
+# target lowers the distance by a sector; one under HEADROOM of the target
+# raises it by a sector. Each change starts a new interval, so the frames
+# spent showing or hiding sectors after it are measured before the next.
+
+INTERVAL = 2.0
+HEADROOM = 0.6
+
+
+class Governor(object):
+    """ Chooses changes of render distance to hold frames to `target`
+    seconds of work.
+    """
+
+    def __init__(self, target, interval=INTERVAL, headroom=HEADROOM):
+        self.target = target
+        self.interval = interval
+        self.headroom = headroom
+
+        # Time, work and frames since the interval started.
+        self._elapsed = 0.0
+        self._cost = 0.0
+        self._frames = 0
+
+        # Average work per frame over the last interval, or None.
+        self.average = None
+
+    def sample(self, dt, cost):
+        """ Record a frame that took `dt` seconds, `cost` of them working.
+        Returns the change of render distance to make: -1, 0 or 1.
+        """
+        self._elapsed += dt
+        self._cost += cost
+        self._frames += 1
+        if self._elapsed < self.interval:
+            return 0
+        self.average = self._cost / self._frames
+        self._elapsed = self._cost = 0.0
+        self._frames = 0
+        if self.average > self.target:
+            return -1
+        if self.average < self.target * self.headroom:
+            return 1
+        return 0
@@ -0,0 +1,155 @@
+from __future__ import division
+
+import argparse
+import random
+import sys
+import time
+
+import world
+from player import Player, PLAYER_HEIGHT, SPAWN
+from world import TICKS_PER_SEC, World, sectorize
+
+if sys.version_info[0] >= 3:
+    xrange = range
+
+
+class HeadlessEngine(object):
+    """ Runs the world model and the player physics without a window or an
+    OpenGL context. `update()` mirrors `Window.update()`, so servers, bots
+    and benchmarks exercise the same code paths as the game.
+    """
+
+    def __init__(self, n=512, s=1, seed=88960, position=SPAWN):
+
+        # The world, generated on construction.
+        self.model = World(n, s, seed)
+
+        # The player moving through the world.
+        self.player = Player(self.model, position)
+
+        # Which sector the player is currently in.
+        self.sector = None
+
+    def update(self, dt):
+        """ Advance the engine by `dt` seconds of frame time.
+        """
+        self.model.process_queue(dt)
+        sector = sectorize(self.player.position)
+        if sector != self.sector:
+            self.model.change_sectors(self.sector, sector)
+            if self.sector is None:
+                self.model.process_entire_queue()
+            self.sector = sector
+        self.player.update(dt)
+
+    def step(self, ticks=1):
+        """ Advance the engine by exactly `ticks` simulation ticks.
+        """
+        for _ in xrange(ticks):
+            self.update(1.0 / TICKS_PER_SEC)
+
+    def target(self):
+        """ Returns the block under the player's crosshairs and the position
+        in front of it, as `World.hit_test()` does.
+        """
+        vector = self.player.get_sight_vector()
+        return self.model.hit_test(self.player.position, vector)
+
+    def place(self, bid):
+        """ Right click with `bid` in hand.
+        """
+        block, previous = self.target()
+        self.model.place_block(block, previous, bid, self.player.rotation)
+
+    def dig(self):
+        """ Left click.
+        """
+        block, _ = self.target()
+        self.model.break_block(block)
+
+
+def _timed(func, count):
+    """ Call `func` `count` times and return the mean time per call in
+    microseconds.
+    """
+    start = time.perf_counter()
+    for _ in xrange(count):
+        func()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the world and player physics without a window and "
+                    "report CPU timings.")
+    parser.add_argument("--size", type=int, default=128,
+                        help="world size in blocks (default: 128)")
+    parser.add_argument("--step", type=int, default=1,
+                        help="generation step size (default: 1)")
+    parser.add_argument("--seed", type=int, default=88960,
+                        help="world seed (default: 88960)")
+    parser.add_argument("--sector-size", type=int, default=world.SECTOR_SIZE,
+                        help="sector size (default: %d)" % world.SECTOR_SIZE)
+    parser.add_argument("--ticks", type=int, default=600,
+                        help="simulation ticks to run (default: 600)")
+    parser.add_argument("--edits", type=int, default=2000,
+                        help="block edits to time (default: 2000)")
+    args = parser.parse_args()
+
+    world.SECTOR_SIZE = args.sector_size
+    middle = args.size // 2
+
+    start = time.perf_counter()
+    engine = HeadlessEngine(args.size, args.step, args.seed,
+                            position=(middle, 80, middle))
+    print("generate    %10.1f ms  (%d blocks)" % (
+        (time.perf_counter() - start) * 1e3, len(engine.model.world)))
+
+    start = time.perf_counter()
+    engine.step(1)
+    print("first tick  %10.1f ms  (%d shown)" % (
+        (time.perf_counter() - start) * 1e3, len(engine.model.shown)))
+
+    player = engine.player
+    player.strafe = [-1, 0]
+    start = time.perf_counter()
+    engine.step(args.ticks)
+    elapsed = time.perf_counter() - start
+    print("simulate    %10.1f ticks/s  (%.1f us/tick)" % (
+        args.ticks / elapsed, elapsed / args.ticks * 1e6))
+    player.strafe = [0, 0]
+
+    position = player.position
+    print("collide     %10.2f us/call" % _timed(
+        lambda: player.collide(position, PLAYER_HEIGHT), 20000))
+    player.rotation = (0, -45)
+    print("hit_test    %10.2f us/call" % _timed(engine.target, 20000))
+
+    rng = random.Random(args.seed)
+    model = engine.model
+    x, y, z = (int(round(c)) for c in position)
+    edits = [(x + rng.randrange(-8, 9), y + rng.randrange(2, 12),
+              z + rng.randrange(-8, 9)) for _ in xrange(args.edits)]
+    start = time.perf_counter()
+    for p in edits:
+        if p in model.world:
+            model.remove_block(p)
+        else:
+            model.add_block(p, "stone")
+    elapsed = time.perf_counter() - start
+    print("edits       %10.1f edits/s" % (args.edits / elapsed))
+
+    updates = model.updates
+    ticks = 0
+    start = time.perf_counter()
+    while updates.scheduled:
+        model.tick(0.25 / TICKS_PER_SEC)
+        ticks += 1
+    elapsed = time.perf_counter() - start
+    print("updates     %10.1f per tick  (%d updates over %d ticks, %d random, %.1f us/update)" % (
+        updates.updates / ticks, updates.updates, ticks, updates.random_ticks,
+        elapsed / max(1, updates.updates) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import hashlib
+import mmap
+import os
+import sys
+
+from array import array
+
+import world
+
+# Heightmaps cached on disk, so repeat launches with the same seed and noise
+# parameters skip the noise. Heights are stored in tiles of TILE x TILE
+# columns as raw native int16, x fastest, one file per tile under a
+# directory named after a hash of everything the heights depend on.
+#
+# Only the columns inside the world are filled; the rest of a tile on its
+# edge holds MISSING, and the tile is filled again for a larger world.
+
+TILE = 32
+
+MISSING = -32768
+
+_TILE_BYTES = TILE * TILE * array("h").itemsize
+
+
+class HeightCache(object):
+    """ Cache of terrain heights in `path`, holding at most `max_bytes` of
+    tiles. When it grows past that, the least recently used tiles are
+    deleted first.
+    """
+
+    def __init__(self, path, max_bytes=64 << 20):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.max_bytes = max_bytes
+
+        # Open memory maps of the tiles in use.
+        self._maps = []
+
+        self.size = sum(os.path.getsize(tile) for tile, _ in self._tiles())
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, gen):
+        """ Returns the name of the directory holding the tiles of `gen`, a
+        `noise_gen.NoiseGen`.
+        """
+        params = gen.noiseParams
+        text = repr((gen.seed, params.octaves, params.amplitude, params.smoothness,
+                     params.roughness, params.heightOffset,
+                     world.GENERATOR_VERSION, sys.byteorder))
+        return hashlib.sha1(text.encode("ascii")).hexdigest()[:16]
+
+    def heights(self, gen, n=None):
+        """ Returns a function height(x, z) equal to int(gen.getHeight(x, z))
+        for 0 <= x, z < `n`, or any x, z if `n` is None, that reads the cache
+        and fills it on a miss.
+        """
+        key = self.key(gen)
+        tiles = {}
+
+        def height(x, z):
+            tx, tz = x // TILE, z // TILE
+            tile = tiles.get((tx, tz))
+            if tile is None:
+                tile = tiles[tx, tz] = self._tile(gen, key, tx, tz, n)
+            return tile[(z - tz * TILE) * TILE + x - tx * TILE]
+
+        return height
+
+    def _tile(self, gen, key, tx, tz, n):
+        # Columns of the tile inside the world.
+        width = TILE if n is None else min(TILE, n - tx * TILE)
+        depth = TILE if n is None else min(TILE, n - tz * TILE)
+        directory = os.path.join(self.path, key)
+        path = os.path.join(directory, "%d.%d.bin" % (tx, tz))
+        if os.path.exists(path) and os.path.getsize(path) == _TILE_BYTES:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            tile = memoryview(data).cast("h")
+            # Filled from the corner at x, z = 0, 0 of the tile.
+            if tile[(depth - 1) * TILE + width - 1] != MISSING:
+                self._maps.append(data)
+                # Mark the tile as recently used for eviction.
+                os.utime(path)
+                self.hits += 1
+                return tile
+            tile.release()
+            data.close()
+            self.size -= _TILE_BYTES
+        self.misses += 1
+        tile = array("h", [MISSING]) * (TILE * TILE)
+        for z in range(depth):
+            row = z * TILE
+            for x in range(width):
+                tile[row + x] = int(gen.getHeight(tx * TILE + x, tz * TILE + z))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path + ".tmp", "wb") as f:
+            tile.tofile(f)
+        os.replace(path + ".tmp", path)
+        self.size += _TILE_BYTES
+        if self.size > self.max_bytes:
+            self.evict()
+        return tile
+
+    def _tiles(self):
+        for key in os.listdir(self.path):
+            directory = os.path.join(self.path, key)
+            if os.path.isdir(directory):
+                for name in os.listdir(directory):
+                    if name.endswith(".bin"):
+                        tile = os.path.join(directory, name)
+                        yield tile, os.path.getmtime(tile)
+
+    def evict(self):
+        """ Delete the least recently used tiles until the cache fits in
+        `max_bytes`.
+        """
+        for tile, _ in sorted(self._tiles(), key=lambda item: item[1]):
+            if self.size <= self.max_bytes:
+                break
+            size = os.path.getsize(tile)
+            try:
+                os.remove(tile)
+            except OSError:
+                # Still mapped, on platforms that don't allow removing it.
+                continue
+            self.size -= size
+            self.evictions += 1
+
+    def close(self):
+        for data in self._maps:
+            try:
+                data.close()
+            except BufferError:
+                # A generator still holds the tile; the map closes with it.
+                pass
+        self._maps = []
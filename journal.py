@@ -0,0 +1,230 @@
+import os
+import struct
+import threading
+
+import codec
+from world import AIR, sectorize
+
+# Append-only log of block edits, kept next to the region files of a saved
+# world.
+#
+#   header   magic "PJNL", version
+#   records  x, y, z, turn, name length, then the block name; a name length
+#            of 0 records a removed block
+#
+# Edits are buffered in memory by the game thread and written and fsynced
+# in batches by a background thread. Once the journal grows past a
+# threshold the game thread folds it into the region store from `update()`,
+# so folding never races `World.save()` or the edits themselves. A crash
+# loses at most the batch that had not been written yet.
+
+MAGIC = b"PJNL"
+VERSION = 1
+
+_HEADER = struct.Struct("!4sB")
+_RECORD = struct.Struct("!iiiBB")
+
+
+def encode_records(edits):
+    """ Encode (position, bid, turn) `edits` as journal records.
+    """
+    out = bytearray()
+    for (x, y, z), bid, turn in edits:
+        name = bid.encode("ascii") if bid is not None else b""
+        out += _RECORD.pack(x, y, z, turn % 4, len(name))
+        out += name
+    return bytes(out)
+
+
+def read_journal(path):
+    """ Returns the (position, bid, turn) edits recorded in the journal at
+    `path`, stopping at the first incomplete record.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:_HEADER.size] != _HEADER.pack(MAGIC, VERSION):
+        raise ValueError("%s is not a version %d journal" % (path, VERSION))
+    edits = []
+    offset = _HEADER.size
+    while offset + _RECORD.size <= len(data):
+        x, y, z, turn, length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        if offset + length > len(data):
+            break
+        bid = data[offset:offset + length].decode("ascii") if length else None
+        offset += length
+        edits.append(((x, y, z), bid, turn))
+    return edits
+
+
+class Journal(object):
+    """ Journal of the edits made to a world saved in a `region.RegionStore`.
+    Create it before the world, `attach()` it to the world to replay the
+    edits of earlier sessions and start recording, and `close()` it on exit.
+    """
+
+    def __init__(self, store, interval=1.0, compact_size=1 << 20):
+        self.store = store
+        self.path = os.path.join(store.path, "journal.log")
+
+        # Seconds between batched writes.
+        self.interval = interval
+
+        # Journal size in bytes above which edits are folded into the store.
+        self.compact_size = compact_size
+
+        # Edits recorded by earlier sessions.
+        self.edits = read_journal(self.path)
+
+        # Edits recorded by the game thread and not written yet.
+        self.pending = []
+        self.lock = threading.Lock()
+
+        # Held while writing the journal file, which both threads do.
+        self._write_lock = threading.Lock()
+
+        # Set by the background thread once the journal has grown past
+        # `compact_size`, for `update()` to compact it.
+        self.compact_due = False
+
+        self.batches = 0
+        self.compactions = 0
+
+        self.model = None
+        self._file = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def attach(self, model):
+        """ Replay the journal into `model`, then record its edits from a
+        background thread.
+        """
+        self.model = model
+        model.replay_edits(self.edits)
+        self._rewrite(self.edits)
+        self.edits = []
+        model.listeners.append(self._on_change)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _on_change(self, position, bid):
+        turn = self.model.rots.get(position, 0) if bid is not None else 0
+        with self.lock:
+            self.pending.append((position, bid, turn))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        """ Write and fsync the pending edits as one batch, and note when the
+        journal has grown past `compact_size`.
+        """
+        with self._write_lock:
+            self._write_pending()
+            if self._file.tell() > self.compact_size:
+                self.compact_due = True
+
+    def _write_pending(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if pending:
+            self._file.write(encode_records(pending))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.batches += 1
+
+    def update(self, dt=0.0):
+        """ Compact the journal if it has grown past `compact_size`. Call it
+        from the game thread, the thread that edits and saves the world.
+        """
+        if self.compact_due:
+            self.compact()
+
+    def compact(self):
+        """ Fold the journaled edits into the store and drop them from the
+        journal. In "full" mode, edits to sectors that were never saved stay in
+        the journal until `World.save()` writes those sectors; in "delta"
+        mode a sector that was never saved is an empty difference.
+
+        Must run on the game thread: the pending edits are written first, so
+        the journal holds every edit since the stored sectors were saved and
+        folding it brings them up to date.
+        """
+        with self._write_lock:
+            self._write_pending()
+            self._compact()
+        self.compact_due = False
+
+    def _compact(self):
+        delta = self.store.mode == "delta"
+        # Go through the model's thread pool when it has one, so sectors it
+        # is still writing are read back as queued.
+        io = self.model.io
+        if io is not None:
+            load, write, flush = io.load, io.write, io.flush
+        else:
+            load, write, flush = self.store.load, self.store.write, self.store.flush
+        edits = read_journal(self.path)
+        by_sector = {}
+        for edit in edits:
+            by_sector.setdefault(sectorize(edit[0]), []).append(edit)
+        folded = set()
+        for sector, sector_edits in by_sector.items():
+            blocks = load(sector)
+            if blocks is None and delta:
+                blocks = []
+            elif blocks is None:
+                continue
+            state = dict((position, (bid, turn)) for position, bid, turn in blocks)
+            for position, bid, turn in sector_edits:
+                if bid is None and delta:
+                    state[position] = (AIR, 0)
+                elif bid is None:
+                    state.pop(position, None)
+                else:
+                    state[position] = (bid, turn)
+            write(sector, codec.encode_blocks(
+                sector, [(p, bid, turn) for p, (bid, turn) in state.items()],
+                size=self.model.mask.size))
+            folded.add(sector)
+        flush()
+        self._rewrite([edit for edit in edits if sectorize(edit[0]) not in folded])
+        self.compactions += 1
+
+    def _rewrite(self, edits):
+        """ Atomically replace the journal with one holding `edits`.
+        """
+        if self._file is not None:
+            self._file.close()
+        with open(self.path + ".tmp", "wb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION))
+            f.write(encode_records(edits))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        self._file = open(self.path, "ab")
+
+    def close(self):
+        """ Stop the background thread and write the remaining edits.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def clear(self):
+        """ Empty the journal, once every edit in it has been saved to the
+        store.
+        """
+        with self.lock:
+            self.pending = []
+        self._rewrite([])
+        self._file.close()
+        self._file = None
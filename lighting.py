@@ -0,0 +1,254 @@
+from __future__ import division
+
+from collections import deque
+
+from blocks import GROUPCULL, LIGHT, SEETHR, THRU
+
+# Sky light and block light, 0 to 15, for every position.
+#
+# Sky light is 15 straight down from the sky to the first opaque block and
+# loses 1 per block sideways or upwards; block light spreads from the
+# blocks in LIGHT the same way in every direction. Both are kept per sector
+# in a bytearray laid out like the `world.OccupancyMask` bits, sky light in
+# the high nibble of each byte and block light in the low one.
+#
+# A sector's light is computed the first time it is asked for: one pass
+# over its columns, then a flood fill from the pockets under overhangs that
+# sky light reaches sideways. Light crossing sector edges is only exact for
+# light changed by edits, which update it incrementally: a removal pass
+# darkens what the changed block lit, then an addition pass relights it
+# from the brightest cells left around it, so an edit costs time in
+# proportion to the area whose light changes.
+
+MAX_LIGHT = 15
+
+SKY = 4
+BLOCK = 0
+
+# Blocks that light passes through.
+CLEAR = frozenset(SEETHR + THRU + GROUPCULL)
+
+_FACES = ((0, 1, 0), (0, -1, 0), (-1, 0, 0), (1, 0, 0), (0, 0, 1), (0, 0, -1))
+
+# Mapping from block to whether light passes through it.
+_CLEAR = {None: True}
+
+
+def clear(bid):
+    """ Returns True if light passes through block `bid`, or no block.
+    """
+    value = _CLEAR.get(bid)
+    if value is None:
+        value = _CLEAR[bid] = bid in CLEAR or bid.replace("_inv", "") in CLEAR
+    return value
+
+
+class Lighting(object):
+    """ The light of a `world.World`, which calls `update()` after every
+    block it adds or removes and `invalidate()` when it places many blocks
+    at once.
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+        # Mapping from sector to its bytearray of light.
+        self.levels = {}
+
+        # Mapping from sector to the height of the highest opaque block of
+        # each of its columns, z major, or -1.
+        self.tops = {}
+
+        # Cells whose light was changed by the last `update()`.
+        self.changed = set()
+
+        self.relit = 0
+
+    def _sector(self, position):
+        size = self.model.mask.size
+        return (position[0] // size, 0, position[2] // size)
+
+    def invalidate(self, sector):
+        """ Forget the light of `sector`, to be computed again from its
+        blocks when next asked for.
+        """
+        self.levels.pop(sector, None)
+        self.tops.pop(sector, None)
+
+    def _tops(self, sector):
+        tops = self.tops.get(sector)
+        if tops is not None:
+            return tops
+        size = self.model.mask.size
+        ox, oz = sector[0] * size, sector[2] * size
+        tops = [-1] * (size * size)
+        world = self.model.world
+        for position in self.model.sectors.get(sector, ()):
+            x, y, z = position
+            i = (z - oz) * size + x - ox
+            if y > tops[i] and not clear(world[position]):
+                tops[i] = y
+        self.tops[sector] = tops
+        return tops
+
+    def _top(self, x, z):
+        size = self.model.mask.size
+        return self._tops((x // size, 0, z // size))[(z % size) * size + x % size]
+
+    def _compute(self, sector):
+        mask = self.model.mask
+        world = self.model.world
+        size, height = mask.size, mask.height
+        area = size * size
+        ox, oz = sector[0] * size, sector[2] * size
+        levels = self.levels[sector] = bytearray(bytes([MAX_LIGHT << SKY]) * (area * height))
+        tops = self._tops(sector)
+        queue = deque()
+        for i, top in enumerate(tops):
+            if top < 0:
+                continue
+            top = min(top, height - 1)
+            # Dark from the highest opaque block down.
+            levels[i:top * area + i + 1:area] = bytes(top + 1)
+            u, v = i % size, i // size
+            x, z = ox + u, oz + v
+            lowest = min(
+                tops[i - 1] if u > 0 else self._top(x - 1, z),
+                tops[i + 1] if u < size - 1 else self._top(x + 1, z),
+                tops[i - size] if v > 0 else self._top(x, z - 1),
+                tops[i + size] if v < size - 1 else self._top(x, z + 1))
+            for y in range(max(lowest + 1, 0), top):
+                if clear(world.get((x, y, z))):
+                    # Lit sideways from a neighbouring column.
+                    levels[y * area + i] = (MAX_LIGHT - 1) << SKY
+                    queue.append((x, y, z))
+        self._spread(queue, SKY, sector)
+        for position in self.model.sectors.get(sector, ()):
+            emitted = LIGHT.get(world[position])
+            if emitted and 0 <= position[1] < height:
+                x, y, z = position
+                i = y * area + (z - oz) * size + x - ox
+                levels[i] = levels[i] & 0xF0 | emitted
+                queue.append(position)
+        self._spread(queue, BLOCK, sector)
+        return levels
+
+    def _cell(self, position):
+        mask = self.model.mask
+        x, y, z = position
+        if not 0 <= y < mask.height:
+            return None, 0
+        size = mask.size
+        sector = (x // size, 0, z // size)
+        levels = self.levels.get(sector)
+        if levels is None:
+            levels = self._compute(sector)
+        return levels, (y * size + z % size) * size + x % size
+
+    def get(self, position, channel):
+        """ Returns the `SKY` or `BLOCK` light at `position`.
+        """
+        levels, i = self._cell(position)
+        if levels is None:
+            return MAX_LIGHT if channel == SKY and position[1] >= 0 else 0
+        return levels[i] >> channel & 0xF
+
+    def brightness(self, position):
+        """ Returns the brighter of the sky and block light at `position`.
+        """
+        levels, i = self._cell(position)
+        if levels is None:
+            return MAX_LIGHT if position[1] >= 0 else 0
+        level = levels[i]
+        return max(level >> SKY, level & 0xF)
+
+    def _set(self, position, channel, value):
+        levels, i = self._cell(position)
+        if levels is not None:
+            levels[i] = levels[i] & (0xF0 >> channel) | value << channel
+            self.changed.add(position)
+
+    def _spread(self, queue, channel, sector=None):
+        """ Flood light outwards from the cells in `queue`, staying inside
+        `sector` if given.
+        """
+        world = self.model.world
+        get, cell = self.get, self._sector
+        while queue:
+            position = queue.popleft()
+            level = get(position, channel)
+            x, y, z = position
+            for dx, dy, dz in _FACES:
+                other = (x + dx, y + dy, z + dz)
+                if sector is not None and cell(other) != sector:
+                    continue
+                if not clear(world.get(other)):
+                    continue
+                if channel == SKY and dy == -1 and level == MAX_LIGHT:
+                    new = MAX_LIGHT
+                else:
+                    new = level - 1
+                if get(other, channel) < new:
+                    self._set(other, channel, new)
+                    queue.append(other)
+
+    def _source(self, position, channel):
+        """ Returns the light `position` gets from its own block and its
+        neighbours.
+        """
+        bid = self.model.world.get(position)
+        level = LIGHT.get(bid, 0) if channel == BLOCK else 0
+        if not clear(bid):
+            return level
+        x, y, z = position
+        for dx, dy, dz in _FACES:
+            other = self.get((x + dx, y + dy, z + dz), channel)
+            if channel == SKY and dy == 1 and other == MAX_LIGHT:
+                return MAX_LIGHT
+            level = max(level, other - 1)
+        return level
+
+    def _relight(self, position, channel):
+        old = self.get(position, channel)
+        new = self._source(position, channel)
+        if new == old:
+            return
+        queue = deque()
+        if new < old:
+            # Darken everything the old light reached, collecting the cells
+            # lit from elsewhere to spread light back from.
+            self._set(position, channel, 0)
+            removal = deque([(position, old)])
+            while removal:
+                (x, y, z), level = removal.popleft()
+                for dx, dy, dz in _FACES:
+                    other = (x + dx, y + dy, z + dz)
+                    other_level = self.get(other, channel)
+                    if not other_level:
+                        continue
+                    if other_level < level or (channel == SKY and dy == -1 and
+                                               level == other_level == MAX_LIGHT):
+                        self._set(other, channel, 0)
+                        removal.append((other, other_level))
+                    else:
+                        queue.append(other)
+            new = self._source(position, channel)
+        if new:
+            self._set(position, channel, new)
+            queue.append(position)
+        self._spread(queue, channel)
+
+    def update(self, position):
+        """ Update the light after the block at `position` changed. Returns
+        the set of cells whose light changed.
+        """
+        sector = self._sector(position)
+        self.tops.pop(sector, None)
+        self.changed = set()
+        if sector not in self.levels:
+            # Computed from the world when first asked for.
+            return self.changed
+        self._relight(position, SKY)
+        self._relight(position, BLOCK)
+        self.relit += len(self.changed)
+        return self.changed
@@ -0,0 +1,216 @@
+from __future__ import division
+
+import ctypes
+
+# Pooled GPU memory for the meshes the world is drawn from.
+#
+# Meshes are built and dropped all the time: whenever a block changes and
+# whenever the player moves to another sector. Rather than give each its
+# own slice of a buffer that is grown, copied and compacted as they come
+# and go, the pool hands out blocks of vertex memory in size classes, the
+# powers of two from MIN_BLOCK vertices up, from slabs: buffers of a fixed
+# number of vertices that are never resized. A slab starts as one free
+# block, which is halved until a half is the size asked for; a block given
+# back is merged with its other half, its buddy, whenever that is free too,
+# so freed memory is found again in blocks as large as it allows. A mesh
+# takes the smallest free block it fits in, from the fullest slab with one
+# if several are as small, so a section built again usually lands in the
+# block it just left and the blocks of hidden sectors are taken by the next
+# ones shown. Slabs are made when no free block is large enough, and only
+# released when more than SPARE_SLABS are empty. A mesh larger than a slab
+# gets a slab of its own.
+#
+# All the meshes of a slab can be drawn with one call, so the fewer slabs
+# the better: the whole world seen usually fits in one or two.
+#
+# The price is the unused end of every block, less than half of it, and
+# free memory split between blocks too small for the next mesh;
+# `MeshPool.stats()` reports both along with how full the slabs are.
+#
+# As in `shaders`, pyglet.gl is imported only by the code that calls OpenGL,
+# so the module can be imported without a display.
+
+MIN_BLOCK = 256
+SLAB_VERTICES = 1 << 19
+SPARE_SLABS = 1
+
+
+class Slab(object):
+    """ A buffer of `size` vertices of `vertex_bytes` bytes each, a power
+    of two of them. Needs a current OpenGL context.
+    """
+
+    def __init__(self, size, vertex_bytes):
+        from pyglet import gl
+        self.size = size
+
+        # Mapping from block size to the starts of the free blocks of that
+        # size, and the vertices in blocks in use.
+        self.free = {size: set([0])}
+        self.used = 0
+
+        self.buffer = gl.GLuint()
+        gl.glGenBuffers(1, ctypes.byref(self.buffer))
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.buffer)
+        gl.glBufferData(gl.GL_ARRAY_BUFFER, size * vertex_bytes, None, gl.GL_DYNAMIC_DRAW)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+
+    def fit(self, size):
+        """ Returns the size of the smallest free block of at least `size`
+        vertices, or None.
+        """
+        sizes = [block for block, starts in self.free.items() if block >= size and starts]
+        return min(sizes) if sizes else None
+
+    def take(self, size):
+        """ Returns the start of a block of `size` vertices, split from the
+        smallest free block it fits in.
+        """
+        block = self.fit(size)
+        start = self.free[block].pop()
+        while block > size:
+            block //= 2
+            self.free.setdefault(block, set()).add(start + block)
+        self.used += size
+        return start
+
+    def give(self, start, size):
+        """ Free the block of `size` vertices at `start`.
+        """
+        self.used -= size
+        while size < self.size:
+            buddy = start ^ size
+            starts = self.free.get(size)
+            if not starts or buddy not in starts:
+                break
+            starts.remove(buddy)
+            start = min(start, buddy)
+            size *= 2
+        self.free.setdefault(size, set()).add(start)
+
+    def delete(self):
+        from pyglet import gl
+        gl.glDeleteBuffers(1, ctypes.byref(self.buffer))
+
+
+class Mesh(object):
+    """ A mesh in a block of a `MeshPool`: `count` vertices from vertex
+    `start` of the buffer of `slab`, in a block of `size` vertices.
+    """
+
+    def __init__(self, pool, slab, start, size, count):
+        self.pool = pool
+        self.slab = slab
+        self.start = start
+        self.size = size
+        self.count = count
+
+    def write(self, data):
+        """ Replace the vertices with those in array `data`, as many as
+        there are.
+        """
+        from pyglet import gl
+        address, length = data.buffer_info()
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.slab.buffer)
+        gl.glBufferSubData(gl.GL_ARRAY_BUFFER, self.start * self.pool.vertex_bytes,
+                           length * data.itemsize, address)
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+
+    def delete(self):
+        """ Give the block back to the pool.
+        """
+        if self.slab is not None:
+            self.pool._release(self)
+            self.slab = None
+
+
+class MeshPool(object):
+    """ Blocks of GPU memory for meshes of `vertex_bytes` bytes per vertex,
+    from slabs of `slab_vertices` vertices. Slabs are made when first
+    needed, so the pool can be made before there is an OpenGL context.
+    """
+
+    def __init__(self, vertex_bytes, slab_vertices=SLAB_VERTICES, min_block=MIN_BLOCK,
+                 spare_slabs=SPARE_SLABS):
+        self.vertex_bytes = vertex_bytes
+        self.slab_vertices = slab_vertices
+        self.min_block = min_block
+        self.spare_slabs = spare_slabs
+
+        self.slabs = []
+
+        # Meshes and vertices in the pool.
+        self.meshes = 0
+        self.vertices = 0
+
+        # Slabs made and released over the life of the pool.
+        self.created = 0
+        self.released = 0
+
+    def block_size(self, count):
+        """ Returns the size of the blocks a mesh of `count` vertices goes in.
+        """
+        size = self.min_block
+        while size < count:
+            size *= 2
+        return size
+
+    def add(self, data):
+        """ Returns a `Mesh` of the vertices in array `data`.
+        """
+        count = len(data) * data.itemsize // self.vertex_bytes
+        size = self.block_size(count)
+        best = None
+        for slab in self.slabs:
+            block = slab.fit(size)
+            if block is not None and (best is None or (block, -slab.used) < best[0]):
+                best = ((block, -slab.used), slab)
+        if best is not None:
+            slab = best[1]
+        else:
+            slab = Slab(max(size, self.slab_vertices), self.vertex_bytes)
+            self.slabs.append(slab)
+            self.created += 1
+        mesh = Mesh(self, slab, slab.take(size), size, count)
+        self.meshes += 1
+        self.vertices += count
+        mesh.write(data)
+        return mesh
+
+    def _release(self, mesh):
+        slab = mesh.slab
+        slab.give(mesh.start, mesh.size)
+        self.meshes -= 1
+        self.vertices -= mesh.count
+        if slab.used:
+            return
+        empty = sum(1 for other in self.slabs if not other.used)
+        if empty > self.spare_slabs:
+            self.slabs.remove(slab)
+            slab.delete()
+            self.released += 1
+
+    def stats(self):
+        """ Returns a dict of the memory of the pool: the bytes in its slabs,
+        in blocks in use and in vertices; the fraction of the slabs in
+        blocks in use (occupancy), of those blocks left empty at their ends
+        (waste) and of the free memory outside the largest free block
+        (fragmentation); and the slabs and meshes.
+        """
+        reserved = sum(slab.size for slab in self.slabs)
+        allocated = sum(slab.used for slab in self.slabs)
+        free = reserved - allocated
+        largest = max([block for slab in self.slabs
+                       for block, starts in slab.free.items() if starts] or [0])
+        return {
+            "slabs": len(self.slabs),
+            "meshes": self.meshes,
+            "bytes_reserved": reserved * self.vertex_bytes,
+            "bytes_allocated": allocated * self.vertex_bytes,
+            "bytes_used": self.vertices * self.vertex_bytes,
+            "occupancy": allocated / reserved if reserved else 1.0,
+            "waste": 1 - self.vertices / allocated if allocated else 0.0,
+            "fragmentation": 1 - largest / free if free else 0.0,
+            "slabs_created": self.created,
+            "slabs_released": self.released,
+        }
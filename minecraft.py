@@ -1,44 +1,41 @@
 from __future__ import division
 
+import argparse
+import os
 import sys
 import math
 import random
 import time
 
-from collections import deque
+from array import array
+
+import pyglet
+
+# Importing pyglet.gl would otherwise open a hidden window for its context.
+# The game window provides the context, and textures, shaders and vertex
+# lists are only created once it exists, so importing this module stays
+# cheap and headless.
+pyglet.options['shadow_window'] = False
+
 from pyglet import image
 from pyglet.gl import *
 from pyglet.graphics import TextureGroup
 from pyglet.window import key, mouse
 
-from noise_gen import NoiseGen
-
-TICKS_PER_SEC = 60
-
-if len(sys.argv) == 2:
-    SECTOR_SIZE = int(sys.argv[1])
-else:
-    SECTOR_SIZE = 24 # Size of sectors used to ease block loading.
-
-if len(sys.argv) == 3:
-    n = int(sys.argv[2])
-else:
-    n = 512 # size of the world
-
-if len(sys.argv) == 4:
-    s = int(sys.argv[3])
-else:
-    s = 1 # step size
-
-if len(sys.argv) == 5:
-    y = int(sys.argv[4])
-else:
-    y = 50 #initial y height
-
-if len(sys.argv) == 6:
-    y = int(sys.argv[5])
-else:
-    seed = 88960 #world seed
+import world
+from blocks import *
+from client import GameClient
+from governor import Governor
+from player import Player, SPAWN, SPRINT_FOV
+from meshpool import MeshPool
+from shaders import (HEIGHT_STEPS, VERTEX_BYTES, Program, QuadIndices, draw_quads, pack_quads,
+                     pack_shape, place_shape, vertex_data)
+from heightcache import HeightCache
+from journal import Journal
+from region import RegionStore
+from sector_io import SectorIO
+from lighting import clear
+from world import World, normalize, sectionize, sectorize
 
 
 # Square root of amount of textures in the image
@@ -46,29 +43,21 @@ else:
 # be the amount of textures you can fit in a single row or column
 TEXIMGCOUNT = 16
 
-# Movement variables
-WALKING_SPEED = 5
-FLYING_SPEED = 15
-CROUCH_SPEED = 2
-SPRINT_SPEED = 7
-SPRINT_FOV = SPRINT_SPEED / 2
-
-GRAVITY = 20.0
-MAX_JUMP_HEIGHT = 1.0 # About the height of a block.
-# To derive the formula for calculating jump speed, first solve
-#    v_t = v_0 + a * t
-# for the time at which you achieve maximum height, where a is the acceleration
-# due to gravity and v_t = 0. This gives:
-#    t = - v_0 / a
-# Use t and the desired MAX_JUMP_HEIGHT to solve for v_0 (jump speed) in
-#    s = s_0 + v_0 * t + (a * t^2) / 2
-JUMP_SPEED = math.sqrt(2 * GRAVITY * MAX_JUMP_HEIGHT)
-TERMINAL_VELOCITY = 50
-
 # Player variables
-PLAYER_HEIGHT = 2
 PLAYER_FOV = 80.0
 
+# Colour of the sky, which distant blocks fade into.
+SKY_COLOR = (0.5, 0.69, 1.0)
+
+# Fraction of the render distance at which the fog starts.
+FOG_START = 0.6
+
+# Alpha below which texels are not drawn, for cutout textures.
+ALPHA_CUTOFF = 0.1
+
+# Seconds between background saves of a local world.
+AUTOSAVE_INTERVAL = 60
+
 if sys.version_info[0] >= 3:
     xrange = range
 
@@ -107,11 +96,12 @@ def cube_vertices(x, y, z, n, th):
     
     return v
 
-def water_vertices(x, y, z, n, th):
-    """ Return the vertices of the cube at position x, y, z with size 2*n.
+def water_vertices(x, y, z, n, th, drop=0.0):
+    """ Return the vertices of the cube at position x, y, z with size 2*n,
+    its surface lowered by `drop`.
     """
-    a = 0.2
-    b = 0.8
+    a = 0.2 + drop
+    b = 0.8 - drop
 
     v = rot([
         -n,n-a,-n, -n,n-a,n, n,n-a,n, n,n-a,-n,  # top
@@ -262,8 +252,87 @@ def tex_slab(top, bottom, side, up=False):
     
 
 
+# Pairs of indices of the edges of the quads of `cube_vertices()`, to draw
+# them as lines.
+OUTLINE_INDICES = [4 * quad + corner for quad in xrange(6)
+                   for edge in xrange(4) for corner in (edge, (edge + 1) % 4)]
+
+
+def sort_quads(corners, packed, eye):
+    """ Return copies of the arrays of packed vertices of a list of quads,
+    see `shaders.pack_quads()`, reordered farthest quad from `eye` first.
+    """
+    # Corners are at the coordinates + 0.5 and heights in HEIGHT_STEPS.
+    ex, ey, ez = (4 * c + 2 for c in eye)
+    xs, zs = corners[0::2], corners[1::2]
+    ys = [low + (high & 31) * 256 for low, high in zip(packed[0::4], packed[1::4])]
+    distances = []
+    for i in xrange(0, len(xs), 4):
+        # Four times the offset of the quad's centre from the eye.
+        dx = xs[i] + xs[i + 1] + xs[i + 2] + xs[i + 3] - ex
+        dy = (ys[i] + ys[i + 1] + ys[i + 2] + ys[i + 3]) / HEIGHT_STEPS - ey
+        dz = zs[i] + zs[i + 1] + zs[i + 2] + zs[i + 3] - ez
+        distances.append(dx * dx + dy * dy + dz * dz)
+    order = sorted(xrange(len(distances)), key=distances.__getitem__, reverse=True)
+    sorted_corners, sorted_packed = array('h'), array('B')
+    for quad in order:
+        sorted_corners.extend(corners[quad * 8:quad * 8 + 8])
+        sorted_packed.extend(packed[quad * 16:quad * 16 + 16])
+    return sorted_corners, sorted_packed
+
+
 TEXTURE_PATH = 'assets/image/texture.png'
 
+# Mapping from (vertex function, block, turn, arguments) to the packed shape
+# of the block around the origin; see `block_shape()`.
+_SHAPES = {}
+
+
+# Vertex shade of each light level, from 0 to 15.
+LIGHT_SHADES = [int(255 * (0.15 + 0.85 * 0.8 ** (15 - level))) for level in xrange(16)]
+
+# Normals of the faces made by `cube_vertices()`, for each quarter turn.
+FACE_NORMALS = [
+    [(int(round(z * math.sin(th) + x * math.cos(th))), y,
+      int(round(z * math.cos(th) - x * math.sin(th)))) for x, y, z in world.FACES]
+    for th in (degToRad(turn * 90) for turn in xrange(4))]
+
+# Offsets of the blocks around a block, x major, centre included.
+AROUND = [(dx, dy, dz) for dx in xrange(-1, 2) for dy in xrange(-1, 2) for dz in xrange(-1, 2)]
+
+# Factor a vertex colour is darkened by, from 0 to 3 free blocks of the three
+# in front of its face next to its corner.
+OCCLUSION_SHADES = (0.5, 0.65, 0.8, 1.0)
+
+
+def occlusion_corners(turn):
+    """ Return, for each face and vertex of `cube_vertices()` turned `turn`
+    quarter turns, the indices in AROUND of the two blocks beside the
+    vertex corner and the one diagonal to it, in front of the face.
+    """
+    vertices = cube_vertices(0, 0, 0, 0.5, turn * 90)
+    result = []
+    for face, normal in enumerate(FACE_NORMALS[turn]):
+        corners = []
+        for i in xrange(face * 12, face * 12 + 12, 3):
+            corner = [0 if n else int(round(2 * c)) for n, c in zip(normal, vertices[i:i + 3])]
+            sides = []
+            for axis in xrange(3):
+                if corner[axis]:
+                    side = list(normal)
+                    side[axis] = corner[axis]
+                    sides.append(side)
+            sides.append([n + c for n, c in zip(normal, corner)])
+            corners.append(tuple(AROUND.index(tuple(side)) for side in sides))
+        result.append(corners)
+    return result
+
+OCCLUSION_CORNERS = [occlusion_corners(turn) for turn in xrange(4)]
+
+# Indices in AROUND of the blocks each face's corners look at.
+OCCLUSION_AROUND = [[sorted(set(sum(face, ()))) for face in corners]
+                    for corners in OCCLUSION_CORNERS]
+
 #blocks
 
 bids = {
@@ -380,542 +449,260 @@ bids = {
     "furnace": tex_full((10, 0), (10, 0), (11, 0), (11, 0), (12, 0), (11, 0)),
     
     "water": tex_s((0, 2)),
+    "flowing_water": tex_s((0, 2)),
     "lava": tex_s((8, 1)),
+    "flowing_lava": tex_s((8, 1)),
     
     "tnt": tex_coords((2, 4), (0, 4), (1, 4)),
     "sponge": tex_s((0, 5)),
     "wet_sponge": tex_s((1, 5))
 }
 
-#block properties
-#since blocks are defined by texture only,
-#i decided to use lists of block id's attributed
-#to properties, instead of the other way round
-
-#blocks do not cull other blocks
-SEETHR = [
-    "tall_grass",
-    "oak_plank_slab",
-    "birch_plank_slab",
-    "spruce_plank_slab",
-    "jungle_plank_slab",
-    "acacia_plank_slab",
-    "doak_plank_slab",
-    "cobble_slab",
-    "mossy_cobble_slab",
-    "brick_slab",
-    "stone_slab",
-    "sandstone_slab",
-    "smooth_sandstone_slab",
-    "stone_brick_slab",
-    "cracked_stone_brick_slab",
-    "mossy_stone_brick_slab",
-    "smooth_stone_slab",
-    "dandelion",
-    "poppy",
-    "azure",
-    "orchid",
-    "allium",
-    "cornflower",
-    "fern",
-]
-
-#blocks only cull blocks of the same type
-GROUPCULL = [
-    "water",
-    "lava",
-    "oak_leaves",
-    "birch_leaves",
-    "spruce_leaves",
-    "jungle_leaves",
-    "acacia_leaves",
-    "doak_leaves",
-    "glass",
-]
-
-#blocks use a cross shape
-PLANTB = [
-    "tall_grass",
-    "dandelion",
-    "poppy",
-    "azure",
-    "orchid",
-    "allium",
-    "cornflower",
-    "fern",
-]
-
-#blocks can have plants placed on them
-PLANTER = [
-    "grass",
-    "dirt",
-    "podzol",
-]
-
-#blocks are plants and can only be placed on planter blocks
-PLANTEE = [
-    "tall_grass",
-    "dandelion",
-    "poppy",
-    "azure",
-    "orchid",
-    "allium",
-    "cornflower",
-    "fern",
-]
-
-#blocks use the water block model
-WATERB = [
-    "water",
-    "lava",
-]
-
-#blocks do not collide with the player
-THRU = [
-    "tall_grass",
-    "water",
-    "lava",
-    "dandelion",
-    "poppy",
-    "azure",
-    "orchid",
-    "allium",
-    "cornflower",
-    "fern",
-]
-
-#blocks do not get hit by punches
-# !NOT IMPLEMENTED!
-PUNCHTHRU = [
-    "water",
-    "lava",
-]
-
-#blocks you can swim in
-# !NOT IMPLEMENTED!
-SWIM = [
-    "water",
-    "lava",
-]
-
-#blocks will be overwritten when blocks are placed on it
-REPLACE = [
-    "tall_grass",
-    "fern",
-]
-
-#blocks blend in batch2
-RENDERLATE = [
-    "water",
-    "lava",
-]
-
-#blocks use the slab model
-SLAB = [
-    "oak_plank_slab",
-    "birch_plank_slab",
-    "spruce_plank_slab",
-    "jungle_plank_slab",
-    "acacia_plank_slab",
-    "doak_plank_slab",
-    "cobble_slab",
-    "mossy_cobble_slab",
-    "brick_slab",
-    "stone_slab",
-    "sandstone_slab",
-    "smooth_sandstone_slab",
-    "stone_brick_slab",
-    "cracked_stone_brick_slab",
-    "mossy_stone_brick_slab",
-    "smooth_stone_slab",
-]
-
-#blocks that rotate around y when placed
-YROT = [
-    "furnace",
-]
-
-#blocks that rotate randomly around y when when placed
-RYROT = [
-    "cobblestone",
-    "grass",
-    "dirt",
-    "podzol",
-    "coal_ore",
-    "iron_ore",
-    "gold_ore",
-    "diamond_ore",
-    "emerald_ore",
-    "sand",
-    "mossy_cobble",
-    "sandstone",
-]
-
-#blocks are not broken by tnt
-TNTRESIST = [
-    "bedrock",
-    "water",
-    "lava",
-    "obsidian",
-]
-
-
-FACES = [
-    ( 0, 1, 0), #top
-    ( 0,-1, 0), #bottom
-    (-1, 0, 0), #left
-    ( 1, 0, 0), #right
-    ( 0, 0, 1), #front
-    ( 0, 0,-1), #back
-]
-
-
-def normalize(position):
-    """ Accepts `position` of arbitrary precision and returns the block
-    containing that position.
-    Parameters
-    ----------
-    position : tuple of len 3
-    Returns
-    -------
-    block_position : tuple of ints of len 3
-    """
-    x, y, z = position
-    x, y, z = (int(round(x)), int(round(y)), int(round(z)))
-    return (x, y, z)
-
-
-def sectorize(position):
-    """ Returns a tuple representing the sector for the given `position`.
-    Parameters
-    ----------
-    position : tuple of len 3
-    Returns
-    -------
-    sector : tuple of len 3
-    """
-    x, y, z = normalize(position)
-    x, y, z = x // SECTOR_SIZE, y // SECTOR_SIZE, z // SECTOR_SIZE
-    return (x, 0, z)
 
-
-class Model(object):
-
-    def __init__(self):
-
-        # A Batch is a collection of vertex lists for batched rendering.
-        self.batch = pyglet.graphics.Batch()
-        self.batch2 = pyglet.graphics.Batch()
-        
-        # A TextureGroup manages an OpenGL texture.
-        self.group = TextureGroup(image.load(TEXTURE_PATH).get_texture())
-
-        # A mapping from position to the texture of the block at that position.
-        # This defines all the blocks that are currently in the world.
-        self.world = {}
-
-        # Rotation
-        self.rots = {}
-
-        # Same mapping as `world` but only contains blocks that are shown.
-        self.shown = {}
-
-        # Mapping from position to a pyglet `VertextList` for all shown blocks.
-        self._shown = {}
-
-        # Mapping from sector to a list of positions inside that sector.
-        self.sectors = {}
-
-        # Simple function queue implementation. The queue is populated with
-        # _show_block() and _hide_block() calls
-        self.queue = deque()
-
-        self._initialize()
-
-    def _initialize(self):
-        global n
-        global s
-        global y
-        global seed
-        """ Initialize the world by placing all the blocks.
-        """
-
-        gen = NoiseGen(seed)
-        random.seed(seed)
-
-        stonearea = {}
-        podzols = {}
-        
-        #too lazy to do this properly lol
-        heightMap = []
-        for x in xrange(0, n, s):
-            for z in xrange(0, n, s):
-                heightMap.append(0)
-        for x in xrange(0, n, s):
-            for z in xrange(0, n, s):
-                heightMap[z + x * n] = int(gen.getHeight(x, z))
-
-        for x in xrange(0,n,s):
-            for z in xrange(0,n,s):
-                for y in xrange(0, 255, s):
-                    stonearea[(x, y, z)] = False
-                podzols[(x,z)] = False
-                if random.randrange(0,1000) > 998:
-                    for px in xrange(-4,4):
-                        for pz in xrange(-4,4):
-                            podzols[(x+px,z+pz)] = True
-
-        #Generate the world
-        for x in xrange(0, n, s):
-            for z in xrange(0, n, s):
-                h = heightMap[z + x * n]
-                if (h < 33):
-                    #water
-                    for y in range (h, 31):
-                        self.add_block((x, y, z), "water", immediate=False)
-                    #sand
-                    self.add_block((x, h, z), "sand", immediate=False)
-                    for y in xrange(h - 1, 0, -1):
-                        if y > h-random.randrange(2,4):
-                            self.add_block((x, y, z), "sand", immediate=False)
-                        elif y > h-random.randrange(3,7):
-                            self.add_block((x, y, z), "sandstone", immediate=False)
-                        else:
-                            self.add_block((x, y, z), "stone", immediate=False)
-                            stonearea[(x, y, z)] = True
-                    continue
-                #grass
-                if podzols[(x,z)] == True:
-                    self.add_block((x, h, z), "podzol", immediate=False)
-                else:
-                    self.add_block((x, h, z), "grass", immediate=False)
-                for y in xrange(h - 1, 0, -1):
-                    if y > h-random.randrange(2,6):
-                        self.add_block((x, y, z), "dirt", immediate=False)
-                    else:
-                        self.add_block((x, y, z), "stone", immediate=False)
-                        stonearea[(x, y, z)] = True
-                #Maybe add tree at this (x, z)
-                if (h > 20):
-                    #plants
-                    if random.randrange(0, 1000) > 995:
-                        self.add_block((x, h+1, z), "fern", immediate=False)
-                    if random.randrange(0, 1000) > 880:
-                        self.add_block((x, h+1, z), "tall_grass", immediate=False)
-                    if random.randrange(0, 1000) > 950:
-                        self.add_block((x, h+1, z), "dandelion", immediate=False)
-                    if random.randrange(0, 1000) > 950:
-                        flist = ["poppy", "azure", "orchid", "allium", "cornflower"]
-                        self.add_block((x, h+1, z), flist[(x+z)%(len(flist))], immediate=False)
-                    if random.randrange(0, 1000) > 998:
-                        self.add_block((x, h+1, z), "pumpkin", immediate=False)
-                    if random.randrange(0, 1000) > 990:
-                        treeHeight = random.randrange(4, 9)
-                        typs = ["oak","birch","spruce","jungle","acacia","doak"]
-                        typ = typs[random.randrange(0,5)]
-                        #Tree leaves
-                        leafh = h + treeHeight - 2
-                        leaft = 3
-                        leafw = 3
-                        if typ=="acacia":
-                            treeHeight -= 2
-                            leaft = 1
-                            leafw = 4
-                        for lz in xrange(z + 1 - leafw, z + leafw):
-                            for lx in xrange(x + 1 - leafw, x + leafw): 
-                                for ly in xrange(leaft):
-                                    self.add_block((lx, leafh + ly, lz), (typ+"_leaves"), immediate=False)
-                        #Tree trunk
-                        for y in xrange(h + 1, h + treeHeight):
-                            self.add_block((x, y, z), (typ+"_log"), immediate=False)
-        #ores
-        for x in xrange(0,n,s):
-            for z in xrange(0,n,s):
-                #coal
-                ry = random.randrange(1,100)
-                rh = random.randrange(1,8)
-                for gh in xrange(ry, ry+rh, 1):
-                    rpos = x, gh, z
-                    if stonearea[rpos] == True:
-                        self.add_block(rpos, "coal_ore", immediate=False)
-                #iron
-                if random.randrange(0, 1000) > 100:
-                    ry = random.randrange(1,100)
-                    rh = random.randrange(1,8)
-                    for gh in xrange(ry, ry+rh, 1):
-                        rpos = x, gh, z
-                        if stonearea[rpos] == True:
-                            self.add_block(rpos, "iron_ore", immediate=False)
-                #gold
-                if random.randrange(0, 1000) > 990:
-                    ry = random.randrange(1,20)
-                    rpos = x, ry, z
-                    if stonearea[rpos] == True:
-                        self.add_block(rpos, "gold_ore", immediate=False)
-                #diamond
-                if random.randrange(0, 1000) > 997:
-                    ry = random.randrange(1,12)
-                    rh = random.randrange(1,3)
-                    for gh in xrange(ry, ry+rh, 1):
-                        rpos = x, gh, z
-                        if stonearea[rpos] == True:
-                            self.add_block(rpos, "diamond_ore", immediate=False)
-                #emerald
-                if random.randrange(0, 1000) > 998:
-                    ry = random.randrange(1,80)
-                    rpos = x, ry, z
-                    if stonearea[rpos] == True:
-                        self.add_block(rpos, "emerald_ore", immediate=False)
-        #bedrock
-        for x in xrange(0,n,s):
-            for z in xrange(0,n,s):
-                self.add_block((x,0,z), "bedrock", immediate=False)
-                if (x*z)%8<(x+z)%3:
-                    self.add_block((x,1,z), "bedrock", immediate=False)
-                if (x*z)%6<(x+z*2)%5:
-                    self.add_block((x,2,z), "bedrock", immediate=False)
-                    
-
-    def hit_test(self, position, vector, max_distance=8):
-        """ Line of sight search from current position. If a block is
-        intersected it is returned, along with the block previously in the line
-        of sight. If no block is found, return None, None.
-        Parameters
-        ----------
-        position : tuple of len 3
-            The (x, y, z) position to check visibility from.
-        vector : tuple of len 3
-            The line of sight vector.
-        max_distance : int
-            How many blocks away to search for a hit.
+def block_shape(function, bid, th, *args):
+    """ Return the packed shape, see `shaders.pack_shape()`, of block `bid`
+    turned `th` degrees, with the vertices `function` gives around the
+    origin for extra `args`.
+    """
+    key = (function, bid, th) + args
+    shape = _SHAPES.get(key)
+    if shape is None:
+        shape = _SHAPES[key] = pack_shape(function(0, 0, 0, 0.5, th, *args), bids[bid], TEXIMGCOUNT)
+    return shape
+
+
+class Model(World):
+
+    def __init__(self, n=512, s=1, seed=88960, store=None, spawn=None, heights=None):
+
+        # A TextureGroup manages an OpenGL texture. Created with the shader
+        # program and the shared quad indices by `_graphics()` on first use,
+        # so a model can be built before there is an OpenGL context.
+        self.group = None
+        self.program = None
+        self.indices = None
+
+        # GPU memory of the meshes below; see `meshpool`. Translucent
+        # meshes have a pool of their own, so those drawn one after another
+        # are more often in the same buffer.
+        self.pool = MeshPool(VERTEX_BYTES)
+        self.translucent_pool = MeshPool(VERTEX_BYTES)
+
+        # Mapping from section to {position: (late, corners, packed)}, the
+        # packed vertices of the shown blocks in it, see
+        # `shaders.pack_quads()`, and from section to the mesh that draws
+        # its opaque blocks. Sections are drawn one by one, only those that
+        # may be seen; see `visibility`.
+        self._faces = {}
+        self._meshes = {}
+
+        # Mapping from sector to the mesh of its simplified blocks, for the
+        # sectors in `far`.
+        self._far_meshes = {}
+
+        # Mapping from section to (mesh, corners, packed) of its RENDERLATE
+        # blocks, drawn after the opaque ones, farthest section first.
+        self._translucent = {}
+
+        # The translucent sections in drawing order and the section of the
+        # eye they were sorted for, or None to sort them again.
+        self._order = []
+        self._order_section = None
+
+        # The block of the eye the faces of its section's translucent mesh
+        # were last sorted for, and that section.
+        self._sorted = None
+
+        # Seconds taken by the last sort of sections or faces.
+        self.sort_time = 0.0
+
+        # The sections that may be seen from the eye, nearest first, and the
+        # (section, `visibility.version`) they were found for.
+        self._visible = []
+        self._walked = None
+
+        # Meshes drawn by the last `draw()`, and the draw calls it
+        # took; see `shaders.draw_quads()`.
+        self.draws = 0
+        self.calls = 0
+
+        # Sections whose shown blocks changed since their mesh was built,
+        # and sectors in `far` whose simplified mesh is to be built.
+        self._stale = set()
+        self._far_stale = set()
+
+        # Whether cube corners are darkened by the blocks around them.
+        self.occlusion = True
+
+        super(Model, self).__init__(n, s, seed, store, spawn, heights)
+
+    def _graphics(self):
+        """ Load the texture and compile the shaders if not done yet.
         """
-        m = 8
-        x, y, z = position
-        dx, dy, dz = vector
-        previous = None
-        for _ in xrange(max_distance * m):
-            key = normalize((x, y, z))
-            if key != previous and key in self.world:
-                return key, previous
-            previous = key
-            x, y, z = x + dx / m, y + dy / m, z + dz / m
-        return None, None
-
-    def exposed(self, position):
-        """ Returns False is given `position` is surrounded on all 6 sides by
-        blocks, True otherwise.
+        if self.group is None:
+            self.group = TextureGroup(image.load(TEXTURE_PATH).get_texture())
+            self.program = Program()
+            self.indices = QuadIndices()
+
+    def draw(self, eye=None):
+        """ Draw the simplified sectors and the shown blocks of the
+        sections that may be seen from `eye`, blending the RENDERLATE ones
+        last, back to front.
         """
-        x, y, z = position
-        for dx, dy, dz in FACES:
-            key = x + dx, y + dy, z + dz
-            if key not in self.world:
-                return True
-            bid = self.world[key]
-            bid = bid.replace("_inv","")
-            if bid in SEETHR:
-                return True
-            if bid in GROUPCULL:
-                if bid != self.world[position]:
-                    return True
-        return False
-
-    def add_block(self, position, bid, immediate=True, rot=(0,0)):
-        """ Add a block with the given `texture` and `position` to the world.
-        Parameters
-        ----------
-        position : tuple of len 3
-            The (x, y, z) position of the block to add.
-        texture : list of len 3
-            The coordinates of the texture squares. Use `tex_coords()` to
-            generate.
-        immediate : bool
-            Whether or not to draw the block immediately.
+        self._graphics()
+        self.update_meshes()
+        visible = self.visible_sections(eye)
+        meshes = list(self._far_meshes.values())
+        for section in visible:
+            mesh = self._meshes.get(section)
+            if mesh is not None:
+                meshes.append(mesh)
+        program = self.program
+        program.use()
+        distance = self.view_distance()
+        program.uniform('fog_color', *SKY_COLOR)
+        program.uniform('fog_start', FOG_START * distance)
+        program.uniform('fog_end', distance)
+        program.uniform('alpha_cutoff', ALPHA_CUTOFF)
+        program.uniform('tiles', TEXIMGCOUNT)
+        self.group.set_state()
+        self.calls = draw_quads(meshes, self.indices)
+        self.draws = len(meshes) - len(self._far_meshes)
+        if self._translucent:
+            glEnable(GL_BLEND)
+            self._draw_translucent(eye, set(visible))
+            glDisable(GL_BLEND)
+        self.group.unset_state()
+        Program.stop()
+
+    def visible_sections(self, eye):
+        """ Return the sections with shown blocks that may be seen from
+        `eye`, nearest first, or all of them if `eye` is None. The walk is
+        only done again when the eye enters another section or blocks
+        change.
         """
-        x, y, z = position
-
-        rx, ry = rot
-
-        if bid in YROT:
-            self.rots[position] = round(-rx/90)
-        elif bid in RYROT:
-            self.rots[position] = random.randrange(0,3)
-        else:
-            self.rots[position] = 0
-        
-        if not (bid in PLANTEE and (self.world[x, y-1, z] not in PLANTER or (x, y-1, z) not in self.world)):
-            if position in self.world:
-                self.remove_block(position, immediate)
-            self.world[position] = bid
-            self.sectors.setdefault(sectorize(position), []).append(position)
-            if immediate:
-                if self.exposed(position):
-                    self.show_block(position)
-                #if bid not in SEETHR:
-                self.check_neighbors(position)
-
-    def remove_block(self, position, immediate=True):
-        """ Remove the block at the given `position`.
-        Parameters
-        ----------
-        position : tuple of len 3
-            The (x, y, z) position of the block to remove.
-        immediate : bool
-            Whether or not to immediately remove block from canvas.
+        if eye is None:
+            return list(set(self._meshes) | set(self._translucent))
+        visibility = self.visibility
+        section = sectionize(eye)
+        key = (section, visibility.version)
+        if key != self._walked or not visibility.complete:
+            self._visible = visibility.visible(section, self.detail_radius() + 1,
+                                               0.5 / world.TICKS_PER_SEC)
+            self._walked = key
+        return self._visible
+
+    def _draw_translucent(self, eye, visible):
+        """ Draw the translucent sections in `visible` farthest first, with
+        the program and texture set up by `draw()`. Sections are sorted
+        again only when the eye enters another section, and faces only in
+        the eye's own section when it moves to another block.
         """
-        del self.world[position]
-        self.sectors[sectorize(position)].remove(position)
-        if immediate:
-            if position in self.shown:
-                self.hide_block(position)
-            self.check_neighbors(position)
-
-    def check_neighbors(self, position):
-        """ Check all blocks surrounding `position` and ensure their visual
-        state is current. This means hiding blocks that are not exposed and
-        ensuring that all exposed blocks are shown. Usually used after a block
-        is added or removed.
+        section = sectionize(eye) if eye is not None else (0, 0, 0)
+        start = time.perf_counter()
+        sorted_any = False
+        if section != self._order_section:
+            sx, sy, sz = section
+            self._order = sorted(self._translucent, reverse=True,
+                key=lambda other: (other[0] - sx) ** 2 + (other[1] - sy) ** 2 + (other[2] - sz) ** 2)
+            self._order_section = section
+            sorted_any = True
+        mesh = self._translucent.get(section)
+        if eye is not None and mesh is not None and self._sorted != (normalize(eye), section):
+            mesh[0].write(vertex_data(*sort_quads(mesh[1], mesh[2], eye)))
+            self._sorted = (normalize(eye), section)
+            sorted_any = True
+        if sorted_any:
+            self.sort_time = time.perf_counter() - start
+        meshes = [self._translucent[other][0] for other in self._order
+                  if eye is None or other in visible]
+        self.calls += draw_quads(meshes, self.indices, ordered=True)
+        self.draws += len(meshes)
+
+    def update_meshes(self):
+        """ Rebuild the mesh of every section whose shown blocks changed, so
+        any number of edits to a section cost one rebuild, and build the
+        simplified meshes of the sectors shown far away since.
         """
-        
-        x, y, z = position
-        for dx, dy, dz in FACES:
-            key = (x + dx, y + dy, z + dz)
-            if key not in self.world:
+        self._graphics()
+        for section in self._stale:
+            self._mesh(section)
+        self._stale.clear()
+        for sector in self._far_stale:
+            step = self.far.get(sector)
+            if step is not None:
+                self._far_mesh(sector, step)
+        self._far_stale.clear()
+
+    def _mesh(self, section):
+        mesh = self._meshes.pop(section, None)
+        if mesh is not None:
+            mesh.delete()
+        translucent = self._translucent.pop(section, None)
+        if translucent is not None:
+            translucent[0].delete()
+        if self._sorted is not None and self._sorted[1] == section:
+            self._sorted = None
+        faces = self._faces.get(section, {})
+        for late in (False, True):
+            corners = array('h')
+            packed = array('B')
+            for block_late, block_corners, block_packed in faces.values():
+                if block_late == late:
+                    corners.extend(block_corners)
+                    packed.extend(block_packed)
+            if not corners:
                 continue
-            if self.exposed(key):
-                if key not in self.shown:
-                    self.show_block(key)
+            if late:
+                self._translucent[section] = (
+                    self.translucent_pool.add(vertex_data(corners, packed)), corners, packed)
             else:
-                if key in self.shown:
-                    self.hide_block(key)
-
-    def show_block(self, position, immediate=True):
-        """ Show the block at the given `position`. This method assumes the
-        block has already been added with add_block()
-        Parameters
-        ----------
-        position : tuple of len 3
-            The (x, y, z) position of the block to show.
-        immediate : bool
-            Whether or not to show the block immediately.
+                self._meshes[section] = self.pool.add(vertex_data(corners, packed))
+        if (translucent is None) != (section not in self._translucent):
+            # Sort the sections again, with this one added or removed.
+            self._order_section = None
+
+    def _shades(self, position, bid, cube=False):
+        """ Return the vertex shades of the block at `position`, each face
+        lit by the light in front of it, or by the light at `position` for
+        blocks light passes through. The corners of a `cube` are darkened
+        by the blocks around them if `self.occlusion` is set.
         """
-        
-        bid = self.world[position]
-        self.shown[position] = bid
-        
-        if immediate:
-            self._show_block_typed(position, bid)
-        else:
-            self._enqueue(self._show_block_typed, position, bid)
+        brightness = self.light.brightness
+        if clear(bid):
+            return [LIGHT_SHADES[brightness(position)]] * 24
+        x, y, z = position
+        turn = self.rots.get(position, 0) % 4
+        occlusion = cube and self.occlusion
+        if occlusion:
+            get = self.world.get
+            solid = [None] * len(AROUND)
+            corners = OCCLUSION_CORNERS[turn]
+        shades = []
+        for face, (dx, dy, dz) in enumerate(FACE_NORMALS[turn]):
+            front = (x + dx, y + dy, z + dz)
+            shade = LIGHT_SHADES[brightness(front)]
+            if not occlusion or not clear(get(front)):
+                # Flat, or hidden behind the block in front of it.
+                shades.extend([shade] * 4)
+                continue
+            for i in OCCLUSION_AROUND[turn][face]:
+                if solid[i] is None:
+                    ax, ay, az = AROUND[i]
+                    solid[i] = not clear(get((x + ax, y + ay, z + az)))
+            for side1, side2, corner in corners[face]:
+                if solid[side1] and solid[side2]:
+                    free = 0
+                else:
+                    free = 3 - solid[side1] - solid[side2] - solid[corner]
+                shades.append(int(shade * OCCLUSION_SHADES[free]))
+        return shades
 
-    def _show(self, position, bid, vtx, tex):
-        if bid in RENDERLATE:
-            self._shown[position] = self.batch2.add(24, GL_QUADS, self.group,
-                ('v3f/static', vtx),
-                ('t2f/static', tex))
-        else:
-            self._shown[position] = self.batch.add(24, GL_QUADS, self.group,
-                ('v3f/static', vtx),
-                ('t2f/static', tex))
+    def _show(self, position, bid, shape, cube=False):
+        section = sectionize(position)
+        self._faces.setdefault(section, {})[position] = (bid in RENDERLATE,) + place_shape(
+            shape, self._shades(position, bid, cube), position)
+        self._stale.add(section)
 
     def _show_block_typed(self, position, bid):
         if bid in PLANTB:
@@ -940,13 +727,7 @@ class Model(object):
             generate.
         """
         th = self.rots[position]*90
-        
-        x, y, z = position
-        vertex_data = cube_vertices(x, y, z, 0.5, th)
-        texture_data = list(bids[bid])
-        # create vertex list
-        # FIXME Maybe `add_indexed()` should be used instead
-        self._show(position, bid, vertex_data, texture_data)
+        self._show(position, bid, block_shape(cube_vertices, bid, th), cube=True)
 
     def _show_water(self, position, bid):
         """ Private implementation of the `show_block()` method.
@@ -959,23 +740,11 @@ class Model(object):
             generate.
         """
         th = self.rots[position]*90
-        
-        x, y, z = position
-        vertex_data = water_vertices(x, y, z, 0.5, th)
-        texture_data = list(bids[bid])
-        # create vertex list
-        # FIXME Maybe `add_indexed()` should be used instead
-        self._show(position, bid, vertex_data, texture_data)
+        self._show(position, bid, block_shape(water_vertices, bid, th, 0.6 * self.fluids.drop(position)))
 
     def _show_grass_block(self, position, bid):
         th = self.rots[position]*90
-        
-        x, y, z = position
-        vertex_data = plant_verts(x, y, z, 0.5, th)
-        texture_data = list(bids[bid])
-        # create vertex list
-        # FIXME Maybe `add_indexed()` should be used instead
-        self._show(position, bid, vertex_data, texture_data)
+        self._show(position, bid, block_shape(plant_verts, bid, th))
 
     def _show_slab(self, position, bid):
         """ Private implementation of the `show_block()` method.
@@ -988,13 +757,7 @@ class Model(object):
             generate.
         """
         th = self.rots[position]*90
-        
-        x, y, z = position
-        vertex_data = slab_vertices(x, y, z, 0.5, th)
-        texture_data = list(bids[bid])
-        # create vertex list
-        # FIXME Maybe `add_indexed()` should be used instead
-        self._show(position, bid, vertex_data, texture_data)
+        self._show(position, bid, block_shape(slab_vertices, bid, th))
 
     def _show_inv_slab(self, position, bid):
         """ Private implementation of the `show_block()` method.
@@ -1007,156 +770,87 @@ class Model(object):
             generate.
         """
         th = self.rots[position]*90
-        
-        x, y, z = position
-        vertex_data = slab_inv_vertices(x, y, z, 0.5, th)
-        texture_data = list(bids[bid])
-        # create vertex list
-        # FIXME Maybe `add_indexed()` should be used instead
-        self._show(position, bid, vertex_data, texture_data)
-
-    def hide_block(self, position, immediate=True):
-        """ Hide the block at the given `position`. Hiding does not remove the
-        block from the world.
-        Parameters
-        ----------
-        position : tuple of len 3
-            The (x, y, z) position of the block to hide.
-        immediate : bool
-            Whether or not to immediately remove the block from the canvas.
-        """
-        self.shown.pop(position)
-        if immediate:
-            self._hide_block(position)
-        else:
-            self._enqueue(self._hide_block, position)
+        self._show(position, bid, block_shape(slab_inv_vertices, bid, th))
 
-    def _hide_block(self, position):
-        """ Private implementation of the 'hide_block()` method.
+    def _show_far(self, sector, step):
+        """ Have the simplified mesh of `sector` built, or built again, by
+        the next `update_meshes()`, so any number of edits to it cost one
+        rebuild.
         """
-        self._shown.pop(position).delete()
+        self._far_stale.add(sector)
 
-    def show_sector(self, sector):
-        """ Ensure all blocks in the given sector that should be shown are
-        drawn to the canvas.
-        """
-        for position in self.sectors.get(sector, []):
-            if position not in self.shown and self.exposed(position):
-                self.show_block(position, False)
-
-    def hide_sector(self, sector):
-        """ Ensure all blocks in the given sector that should be hidden are
-        removed from the canvas.
-        """
-        for position in self.sectors.get(sector, []):
-            if position in self.shown:
-                self.hide_block(position, False)
-
-    def change_sectors(self, before, after):
-        """ Move from sector `before` to sector `after`. A sector is a
-        contiguous x, y sub-region of world. Sectors are used to speed up
-        world rendering.
+    def _far_mesh(self, sector, step):
+        """ Build the simplified mesh of `sector`: the top of each cell of
+        `step` x `step` columns of `heightmap()`, with its sides down to the
+        cells around it, or `step` blocks down on the edges of the sector.
         """
-        before_set = set()
-        after_set = set()
-        pad = 4
-        for dx in xrange(-pad, pad + 1):
-            for dy in [0]:  # xrange(-pad, pad + 1):
-                for dz in xrange(-pad, pad + 1):
-                    if dx ** 2 + dy ** 2 + dz ** 2 > (pad + 1) ** 2:
-                        continue
-                    if before:
-                        x, y, z = before
-                        before_set.add((x + dx, y + dy, z + dz))
-                    if after:
-                        x, y, z = after
-                        after_set.add((x + dx, y + dy, z + dz))
-        show = after_set - before_set
-        hide = before_set - after_set
-        for sector in show:
-            self.show_sector(sector)
-        for sector in hide:
-            self.hide_sector(sector)
-
-    def _enqueue(self, func, *args):
-        """ Add `func` to the internal queue.
-        """
-        self.queue.append((func, args))
-
-    def _dequeue(self):
-        """ Pop the top function from the internal queue and call it.
-        """
-        func, args = self.queue.popleft()
-        func(*args)
-
-    def process_queue(self):
-        """ Process the entire queue while taking periodic breaks. This allows
-        the game loop to run smoothly. The queue contains calls to
-        _show_block() and _hide_block() so this method should be called if
-        add_block() or remove_block() was called with immediate=False
-        """
-        start = time.process_time()
-        while self.queue and time.process_time() - start < 1.0 / TICKS_PER_SEC:
-            self._dequeue()
+        mesh = self._far_meshes.pop(sector, None)
+        if mesh is not None:
+            mesh.delete()
+        cells = self.heightmap(sector, step)
+        heights = dict(((x, z), y) for x, z, y, bid in cells)
+        shade = LIGHT_SHADES[-1]
+        vtx = array('f')
+        tex = array('f')
+        for x, z, y, bid in cells:
+            texture = bids.get(bid)
+            if texture is None:
+                continue
+            x0, x1 = x - 0.5, x + step - 0.5
+            z0, z1 = z - 0.5, z + step - 0.5
+            top = y + 0.5
+            vtx.extend((x0, top, z0, x0, top, z1, x1, top, z1, x1, top, z0))
+            tex.extend(texture[0:8])
+            for dx, dz, quad in ((-1, 0, (x0, z0, x0, z1)), (1, 0, (x1, z1, x1, z0)),
+                                 (0, 1, (x0, z1, x1, z1)), (0, -1, (x1, z0, x0, z0))):
+                below = heights.get((x + dx * step, z + dz * step), y - step) + 0.5
+                if below >= top:
+                    continue
+                ax, az, bx, bz = quad
+                vtx.extend((ax, below, az, bx, below, bz, bx, top, bz, ax, top, az))
+                tex.extend(texture[16:24])
+        if vtx:
+            self._far_meshes[sector] = self.pool.add(vertex_data(*pack_quads(
+                vtx, tex, [shade] * (len(vtx) // 3), TEXIMGCOUNT)))
+
+    def _hide_far(self, sector):
+        self._far_stale.discard(sector)
+        mesh = self._far_meshes.pop(sector, None)
+        if mesh is not None:
+            mesh.delete()
 
-    def process_entire_queue(self):
-        """ Process the entire queue with no breaks.
+    def _hide_block(self, position):
+        """ Private implementation of the 'hide_block()` method.
         """
-        while self.queue:
-            self._dequeue()
+        section = sectionize(position)
+        faces = self._faces[section]
+        del faces[position]
+        if not faces:
+            del self._faces[section]
+        self._stale.add(section)
 
 
 class Window(pyglet.window.Window):
 
     def __init__(self, *args, **kwargs):
-        super(Window, self).__init__(*args, **kwargs)
+        # Connection to a multiplayer server, or None to play locally.
+        self.client = kwargs.pop('client', None)
 
-        # Whether or not the window exclusively captures the mouse.
-        self.exclusive = False
-
-        # When flying gravity has no effect and speed is increased.
-        self.flying = False
-
-        # Used for constant jumping. If the space bar is held down,
-        # this is true, otherwise, it's false
-        self.jumping = False
-
-        # If the player actually jumped, this is true
-        self.jumped = False
+        # Instance of the model that handles the world, generated a little
+        # each frame, nearest the spawn first, if not given.
+        self.model = kwargs.pop('model', None) or Model(spawn=SPAWN)
 
-        # If this is true, a crouch offset is added to the final glTranslate
-        self.crouch = False
+        # Raises or lowers the render distance to hold `target_fps`, if given.
+        target_fps = kwargs.pop('target_fps', None)
+        self.governor = Governor(1.0 / target_fps) if target_fps else None
 
-        # Player sprint
-        self.sprinting = False
+        # Seconds spent in `update()` and `on_draw()` since the last update.
+        self.frame_cost = 0.0
 
-        # Player swimming
-        self.swimming = False
-
-        # This is an offset value so stuff like speed potions can also be easily added
-        self.fov_offset = 0
-
-        self.collision_types = {"top": False, "bottom": False, "right": False, "left": False}
-
-        # Strafing is moving lateral to the direction you are facing,
-        # e.g. moving to the left or right while continuing to face forward.
-        #
-        # First element is -1 when moving forward, 1 when moving back, and 0
-        # otherwise. The second element is -1 when moving left, 1 when moving
-        # right, and 0 otherwise.
-        self.strafe = [0, 0]
-
-        # Current (x, y, z) position in the world, specified with floats. Note
-        # that, perhaps unlike in math class, the y-axis is the vertical axis.
-        self.position = (30, 80, 80)
+        super(Window, self).__init__(*args, **kwargs)
 
-        # First element is rotation of the player in the x-z plane (ground
-        # plane) measured from the z-axis down. The second is the rotation
-        # angle from the ground plane up. Rotation is in degrees.
-        #
-        # The vertical plane rotation ranges from -90 (looking straight down) to
-        # 90 (looking straight up). The horizontal rotation range is unbounded.
-        self.rotation = (0, 0)
+        # Whether or not the window exclusively captures the mouse.
+        self.exclusive = False
 
         # Which sector the player is currently in.
         self.sector = None
@@ -1164,9 +858,6 @@ class Window(pyglet.window.Window):
         # The crosshairs at the center of the screen.
         self.reticle = None
 
-        # Velocity in the y (upward) direction.
-        self.dy = 0
-
         # A list of blocks the player can place. Hit num keys to cycle.
         self.inventory = ["stone","stone_slab","cobble","cobble_slab","mossy_cobble","mossy_cobble_slab",
                           "coal_ore","iron_ore","gold_ore","diamond_ore","emerald_ore","obsidian",
@@ -1215,17 +906,20 @@ class Window(pyglet.window.Window):
             key._1, key._2, key._3, key._4, key._5,
             key._6, key._7, key._8, key._9, key._0]
 
-        # Instance of the model that handles the world.
-        self.model = Model()
+        # The player, with the physics that moves it through the world.
+        self.player = Player(self.model)
 
         # The label that is displayed in the top left of the canvas.
         self.label = pyglet.text.Label('', font_name='Arial', font_size=18,
             x=10, y=self.height - 10, anchor_x='left', anchor_y='top',
             color=(0, 0, 0, 255))
 
-        # This call schedules the `update()` method to be called
-        # TICKS_PER_SEC. This is the main game event loop.
-        pyglet.clock.schedule_interval(self.update, 1.0 / TICKS_PER_SEC)
+        # This call schedules the `update()` method to be called once per
+        # frame. `update()` then advances the simulation in fixed ticks of
+        # 1 / TICKS_PER_SEC. This is the main game event loop.
+        pyglet.clock.schedule(self.update)
+        if self.model.store:
+            pyglet.clock.schedule_interval(self.autosave, AUTOSAVE_INTERVAL)
 
     def set_exclusive_mouse(self, exclusive):
         """ If `exclusive` is True, the game will capture the mouse, if False
@@ -1234,188 +928,39 @@ class Window(pyglet.window.Window):
         super(Window, self).set_exclusive_mouse(exclusive)
         self.exclusive = exclusive
 
-    def get_sight_vector(self):
-        """ Returns the current line of sight vector indicating the direction
-        the player is looking.
+    def autosave(self, dt):
+        """ Queue the sectors changed since the last save to be written in the
+        background.
         """
-        x, y = self.rotation
-        # y ranges from -90 to 90, or -pi/2 to pi/2, so m ranges from 0 to 1 and
-        # is 1 when looking ahead parallel to the ground and 0 when looking
-        # straight up or down.
-        m = math.cos(math.radians(y))
-        # dy ranges from -1 to 1 and is -1 when looking straight down and 1 when
-        # looking straight up.
-        dy = math.sin(math.radians(y))
-        dx = math.cos(math.radians(x - 90)) * m
-        dz = math.sin(math.radians(x - 90)) * m
-        return (dx, dy, dz)
-
-    def get_motion_vector(self):
-        """ Returns the current motion vector indicating the velocity of the
-        player.
-        Returns
-        -------
-        vector : tuple of len 3
-            Tuple containing the velocity in x, y, and z respectively.
-        """
-        if any(self.strafe):
-            x, y = self.rotation
-            strafe = math.degrees(math.atan2(*self.strafe))
-            y_angle = math.radians(y)
-            x_angle = math.radians(x + strafe)
-            if self.flying:
-                m = math.cos(y_angle)
-                dy = math.sin(y_angle)
-                if self.strafe[1]:
-                    # Moving left or right.
-                    dy = 0.0
-                    m = 1
-                if self.strafe[0] > 0:
-                    # Moving backwards.
-                    dy *= -1
-                # When you are flying up or down, you have less left and right
-                # motion.
-                dx = math.cos(x_angle) * m
-                dz = math.sin(x_angle) * m
-            else:
-                dy = 0.0
-                dx = math.cos(x_angle)
-                dz = math.sin(x_angle)
-        else:
-            dy = 0.0
-            dx = 0.0
-            dz = 0.0
-        return (dx, dy, dz)
+        self.model.save(replayed=False)
 
     def update(self, dt):
-        """ This method is scheduled to be called repeatedly by the pyglet
-        clock.
+        """ This method is scheduled to be called once per frame by the
+        pyglet clock.
         Parameters
         ----------
         dt : float
             The change in time since the last call.
         """
-        self.model.process_queue()
-        sector = sectorize(self.position)
+        start = time.perf_counter()
+        if self.governor is not None:
+            change = self.governor.sample(dt, self.frame_cost)
+            if change:
+                self.model.set_render_distance(self.model.render_distance + change)
+        self.frame_cost = 0.0
+        if self.client:
+            self.client.apply(self.model)
+        self.model.process_queue(dt)
+        sector = sectorize(self.player.position)
         if sector != self.sector:
             self.model.change_sectors(self.sector, sector)
-            if self.sector is None:
+            if self.sector is None and self.model.generator is None:
                 self.model.process_entire_queue()
             self.sector = sector
-        m = 8
-        dt = min(dt, 0.2)
-        for _ in xrange(m):
-            self._update(dt / m)
-
-    def _update(self, dt):
-        """ Private implementation of the `update()` method. This is where most
-        of the motion logic lives, along with gravity and collision detection.
-        Parameters
-        ----------
-        dt : float
-            The change in time since the last call.
-        """
-        # walking
-        if self.flying:
-            speed = FLYING_SPEED
-        elif self.sprinting:
-            speed = SPRINT_SPEED
-        elif self.crouch:
-            speed = CROUCH_SPEED
-        else:
-            speed = WALKING_SPEED
-
-        if self.jumping:
-            if self.collision_types["top"]:
-                self.dy = JUMP_SPEED
-                self.jumped = True
-        else:
-            if self.collision_types["top"]:
-                self.jumped = False
-        if self.jumped:
-            speed += 0.7
-
-        d = dt * speed # distance covered this tick.
-        dx, dy, dz = self.get_motion_vector()
-        # New position in space, before accounting for gravity.
-        dx, dy, dz = dx * d, dy * d, dz * d
-        # gravity
-        if not self.flying:
-            # Update your vertical speed: if you are falling, speed up until you
-            # hit terminal velocity; if you are jumping, slow down until you
-            # start falling.
-            self.dy -= dt * GRAVITY
-            self.dy = max(self.dy, -TERMINAL_VELOCITY)
-            dy += self.dy * dt
-        # collisions
-        old_pos = self.position
-        x, y, z = old_pos
-        x, y, z = self.collide((x + dx, y + dy, z + dz), PLAYER_HEIGHT)
-        self.position = (x, y, z)
-
-        # Sptinting stuff. If the player stops moving in the x and z direction, the player stops sprinting
-        # and the sprint fov is subtracted from the fov offset
-        if old_pos[0]-self.position[0] == 0 and old_pos[2]-self.position[2] == 0:
-            disablefov = False
-            if self.sprinting:
-                disablefov = True
-            self.sprinting = False
-            if disablefov:
-                self.fov_offset -= SPRINT_FOV
-
-    def collide(self, position, height):
-        """ Checks to see if the player at the given `position` and `height`
-        is colliding with any blocks in the world.
-        Parameters
-        ----------
-        position : tuple of len 3
-            The (x, y, z) position to check for collisions at.
-        height : int or float
-            The height of the player.
-        Returns
-        -------
-        position : tuple of len 3
-            The new position of the player taking into account collisions.
-        """
-        # How much overlap with a dimension of a surrounding block you need to
-        # have to count as a collision. If 0, touching terrain at all counts as
-        # a collision. If .49, you sink into the ground, as if walking through
-        # tall grass. If >= .5, you'll fall through the ground.
-        pad = 0.25
-        p = list(position)
-        np = normalize(position)
-        self.collision_types = {"top":False,"bottom":False,"right":False,"left":False}
-        for face in FACES:  # check all surrounding blocks
-            for i in xrange(3):  # check each dimension independently
-                if not face[i]:
-                    continue
-                # How much overlap you have with this dimension.
-                d = (p[i] - np[i]) * face[i]
-                if d < pad:
-                    continue
-                for dy in xrange(height):  # check each height
-                    op = list(np)
-                    op[1] -= dy
-                    op[i] += face[i]
-                    if np[1] < 1:
-                        self.collision_types["top"] = True
-                        self.dy = 1
-                        break
-                    if tuple(op) not in self.model.world:
-                        continue
-                    if self.model.world[tuple(op)] in THRU:
-                        continue
-                    p[i] -= (d - pad) * face[i]
-                    # If you are colliding with the ground or ceiling, stop
-                    # falling / rising.
-                    if face == (0, -1, 0):
-                        self.collision_types["top"] = True
-                        self.dy = 0
-                    if face == (0, 1, 0):
-                        self.collision_types["bottom"] = True
-                        self.dy = 0
-                    break
-        return tuple(p)
+        # Hold the player still until there is ground to stand on.
+        if self.model.area_loaded(sector):
+            self.player.update(dt)
+        self.frame_cost += time.perf_counter() - start
 
     def on_mouse_press(self, x, y, button, modifiers):
         """ Called when a mouse button is pressed. See pyglet docs for button
@@ -1433,57 +978,22 @@ class Window(pyglet.window.Window):
             mouse button was clicked.
         """
         if self.exclusive:
-            vector = self.get_sight_vector()
-            block, previous = self.model.hit_test(self.position, vector)
+            vector = self.player.get_sight_vector()
+            block, previous = self.model.hit_test(self.player.position, vector)
             if (button == mouse.RIGHT) or \
                     ((button == mouse.LEFT) and (modifiers & key.MOD_CTRL)):
                 # ON OSX, control + left click = right click.
-                bid = self.model.world[block]
-                bid = bid.replace("_inv","")
-                # replace blocks
-                if bid in REPLACE:
-                    self.model.remove_block(block)
-                    self.model.add_block(block, self.block, True, self.rotation)
-                # stacking slabs
-                elif bid in SLAB and self.block == bid:
-                    full = bid + "_full"
-                    self.model.remove_block(block)
-                    self.model.add_block(block, full, True, self.rotation)
-                # tnt exploding
-                elif bid == "tnt":
-                    bx, by, bz = block
-                    for tx in xrange(-4,4):
-                        for ty in xrange(-4,4):
-                            for tz in xrange(-4,4):
-                                poss = (bx + tx, by + ty, bz + tz)
-                                if poss in self.model.world and self.model.world[poss] not in TNTRESIST:
-                                    self.model.remove_block(poss)
+                if self.client:
+                    self.client.place(block, previous, self.block,
+                        self.player.rotation)
                 else:
-                    if previous:
-                        # sponge code
-                        if self.block == "sponge":
-                            bx, by, bz = block
-                            abso = False
-                            for tx in xrange(-4,4):
-                                for ty in xrange(-4,4):
-                                    for tz in xrange(-4,4):
-                                        poss = (bx + tx, by + ty, bz + tz)
-                                        if poss in self.model.world and self.model.world[poss] == "water":
-                                            self.model.remove_block(poss)
-                                            abso = True
-                            if abso == True:
-                                self.model.add_block(previous, "wet_sponge")
-                            else:
-                                self.model.add_block(previous, self.block)
-                        # inverted slabs
-                        elif self.block in SLAB and self.rotation[1] > 0:
-                            self.model.add_block(previous, self.block + "_inv")
-                        #regular block placement
-                        else:
-                            self.model.add_block(previous, self.block, True, self.rotation)
+                    self.model.place_block(block, previous, self.block,
+                        self.player.rotation)
             elif button == pyglet.window.mouse.LEFT and block:
-                bid = self.model.world[block]
-                self.model.remove_block(block)
+                if self.client:
+                    self.client.dig(block)
+                else:
+                    self.model.break_block(block)
         else:
             self.set_exclusive_mouse(True)
 
@@ -1499,10 +1009,10 @@ class Window(pyglet.window.Window):
         """
         if self.exclusive:
             m = 0.15
-            x, y = self.rotation
+            x, y = self.player.rotation
             x, y = x + dx * m, y + dy * m
             y = max(-90, min(90, y))
-            self.rotation = (x, y)
+            self.player.rotation = (x, y)
 
     def on_mouse_scroll(self, x, y, scroll_x, scroll_y):
         if scroll_y == -1:
@@ -1529,31 +1039,36 @@ class Window(pyglet.window.Window):
             Number representing any modifying keys that were pressed.
         """
         if symbol == key.W:
-            self.strafe[0] -= 1
+            self.player.strafe[0] -= 1
         elif symbol == key.S:
-            self.strafe[0] += 1
+            self.player.strafe[0] += 1
         elif symbol == key.A:
-            self.strafe[1] -= 1
+            self.player.strafe[1] -= 1
         elif symbol == key.D:
-            self.strafe[1] += 1
+            self.player.strafe[1] += 1
         elif symbol == key.C:
-            self.fov_offset -= 60.0
+            self.player.fov_offset -= 60.0
         elif symbol == key.SPACE:
-            self.jumping = True
+            self.player.jumping = True
         elif symbol == key.ESCAPE:
             self.set_exclusive_mouse(False)
         elif symbol == key.LSHIFT:
-            self.crouch = True
-            if self.sprinting:
-                self.fov_offset -= SPRINT_FOV
-                self.sprinting = False
+            self.player.crouch = True
+            if self.player.sprinting:
+                self.player.fov_offset -= SPRINT_FOV
+                self.player.sprinting = False
         elif symbol == key.R:
-            if not self.crouch:
-                if not self.sprinting:
-                    self.fov_offset += SPRINT_FOV
-                self.sprinting = True
+            if not self.player.crouch:
+                if not self.player.sprinting:
+                    self.player.fov_offset += SPRINT_FOV
+                self.player.sprinting = True
         elif symbol == key.TAB:
-            self.flying = not self.flying
+            self.player.flying = not self.player.flying
+        elif symbol in (key.MINUS, key.EQUAL):
+            # Choosing the render distance by hand turns the governor off.
+            self.governor = None
+            self.model.set_render_distance(
+                self.model.render_distance + (1 if symbol == key.EQUAL else -1))
         elif symbol in self.num_keys:
             self.bindx = (symbol - self.num_keys[0]) % len(self.inventory)
             self.block = self.inventory[self.bindx]
@@ -1582,19 +1097,19 @@ class Window(pyglet.window.Window):
             Number representing any modifying keys that were pressed.
         """
         if symbol == key.W:
-            self.strafe[0] += 1
+            self.player.strafe[0] += 1
         elif symbol == key.S:
-            self.strafe[0] -= 1
+            self.player.strafe[0] -= 1
         elif symbol == key.A:
-            self.strafe[1] += 1
+            self.player.strafe[1] += 1
         elif symbol == key.D:
-            self.strafe[1] -= 1
+            self.player.strafe[1] -= 1
         elif symbol == key.SPACE:
-            self.jumping = False
+            self.player.jumping = False
         elif symbol == key.LSHIFT:
-            self.crouch = False
+            self.player.crouch = False
         elif symbol == key.C:
-            self.fov_offset += 60.0
+            self.player.fov_offset += 60.0
 
     def on_resize(self, width, height):
         """ Called when the window is resized to a new `width` and `height`.
@@ -1632,14 +1147,15 @@ class Window(pyglet.window.Window):
         glViewport(0, 0, max(1, viewport[0]), max(1, viewport[1]))
         glMatrixMode(GL_PROJECTION)
         glLoadIdentity()
-        gluPerspective(PLAYER_FOV + self.fov_offset, width / float(height), 0.1, 60.0)
+        distance = self.model.view_distance()
+        gluPerspective(PLAYER_FOV + self.player.fov_offset, width / float(height), 0.1, distance)
         glMatrixMode(GL_MODELVIEW)
         glLoadIdentity()
-        x, y = self.rotation
+        x, y = self.player.rotation
         glRotatef(x, 0, 1, 0)
         glRotatef(-y, math.cos(math.radians(x)), 0, math.sin(math.radians(x)))
-        x, y, z = self.position
-        if self.crouch:
+        x, y, z = self.player.get_render_position()
+        if self.player.crouch:
             glTranslatef(-x, -y+0.2, -z)
         else:
             glTranslatef(-x, -y, -z)
@@ -1647,27 +1163,25 @@ class Window(pyglet.window.Window):
     def on_draw(self):
         """ Called by pyglet to draw the canvas.
         """
+        start = time.perf_counter()
         self.clear()
         self.set_3d()
         glColor3d(1, 1, 1)
-        self.model.batch.draw()
-        #blending????
-        glEnable(GL_BLEND)
-        self.model.batch2.draw()
-        glDisable(GL_BLEND)
-        
+        self.model.draw(self.player.get_render_position())
+
         self.draw_focused_block()
         self.set_2d()
         self.draw_label()
         self.draw_blabel()
         self.draw_reticle()
+        self.frame_cost += time.perf_counter() - start
 
     def draw_focused_block(self):
         """ Draw black edges around the block that is currently under the
         crosshairs.
         """
-        vector = self.get_sight_vector()
-        block = self.model.hit_test(self.position, vector)[0]
+        vector = self.player.get_sight_vector()
+        block = self.model.hit_test(self.player.position, vector)[0]
         if block:
             x, y, z = block
             bid = self.model.world[block]
@@ -1678,23 +1192,29 @@ class Window(pyglet.window.Window):
             else:
                 vertex_data = cube_vertices(x, y, z, 0.51, 0)
             glColor3d(0, 0, 0)
-            glPolygonMode(GL_FRONT_AND_BACK, GL_LINE)
-            pyglet.graphics.draw(24, GL_QUADS, ('v3f/static', vertex_data))
-            glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
+            pyglet.graphics.draw_indexed(24, GL_LINES, OUTLINE_INDICES, ('v3f/static', vertex_data))
 
     def draw_label(self):
         """ Draw the label in the top left of the screen.
         """
-        x, y, z = self.position
-        self.label.text = '%02d (%.2f, %.2f, %.2f) %d / %d' % (
+        x, y, z = self.player.position
+        pools = [pool.stats() for pool in (self.model.pool, self.model.translucent_pool)]
+        self.label.text = ('%02d (%.2f, %.2f, %.2f) %d / %d, %d draws in %d calls, %d sectors, '
+                           '%.1f of %.1f MB' % (
             pyglet.clock.get_fps(), x, y, z,
-            len(self.model._shown), len(self.model.world))
+            len(self.model.shown), len(self.model.world), self.model.draws,
+            self.model.calls, self.model.render_distance,
+            sum(stats["bytes_used"] for stats in pools) / 2 ** 20,
+            sum(stats["bytes_reserved"] for stats in pools) / 2 ** 20))
+        if self.model.generator is not None:
+            self.label.text += ' generating %d%%' % (
+                100 * self.model.generation_progress())
         self.label.draw()
 
     def draw_blabel(self):
         """ Draw the label in the top left of the screen.
         """
-        x, y, z = self.position
+        x, y, z = self.player.position
         self.blabel.text = '<-F- %s -G->' % (
             self.invstr[self.bindx])
         self.blabel.draw()
@@ -1706,35 +1226,16 @@ class Window(pyglet.window.Window):
         self.reticle.draw(GL_LINES)
 
 
-def setup_fog():
-    """ Configure the OpenGL fog properties.
-    """
-    # Enable fog. Fog "blends a fog color with each rasterized pixel fragment's
-    # post-texturing color."
-    glEnable(GL_FOG)
-    # Set the fog color.
-    glFogfv(GL_FOG_COLOR, (GLfloat * 4)(0.5, 0.69, 1.0, 1))
-    # Say we have no preference between rendering speed and quality.
-    glHint(GL_FOG_HINT, GL_DONT_CARE)
-    # Specify the equation used to compute the blending factor.
-    glFogi(GL_FOG_MODE, GL_LINEAR)
-    # How close and far away fog starts and ends. The closer the start and end,
-    # the denser the fog in the fog range.
-    glFogf(GL_FOG_START, 40.0)
-    glFogf(GL_FOG_END, 60.0)
-
-
 def setup():
     """ Basic OpenGL configuration.
     """
     # Set the color of "clear", i.e. the sky, in rgba.
-    glClearColor(0.5, 0.69, 1.0, 1)
+    glClearColor(*(SKY_COLOR + (1,)))
     # Enable culling (not rendering) of back-facing facets -- facets that aren't
     # visible to you.
     glEnable(GL_CULL_FACE)
-    # Enable Alpha for cutout transparency
-    glEnable(GL_ALPHA_TEST)
-    glAlphaFunc(GL_GREATER, .1)
+    # Cutout transparency and fog are done by the world's shaders; see
+    # `shaders`.
     # Set the texture minification/magnification function to GL_NEAREST (nearest
     # in Manhattan distance) to the specified texture coordinates. GL_NEAREST
     # "is generally faster than GL_LINEAR, but it can produce textured images
@@ -1742,7 +1243,6 @@ def setup():
     # as smooth."
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-    setup_fog()
 
 
 def main():
@@ -1750,11 +1250,71 @@ def main():
                        "more moddable than minecraft", "funni title", "man", "i may be stupid", "glEnable(GL_BLEND)", "eef freef", "I'm in a nailt in brurg",
                        "More text than ever!!", "this code won't work.", "cool slabs", "removed herobrine", "Deja vu."]
     Splash_text = splashtext_list[random.randint(0,len(splashtext_list)-1)]
-    window = Window(width=1280, height=720, caption='pyCraft - '+ Splash_text, resizable=True)
+    parser = argparse.ArgumentParser(description="Play pyCraft.")
+    parser.add_argument("--size", type=int, default=512,
+                        help="world size in blocks for new worlds (default: 512)")
+    parser.add_argument("--step", type=int, default=1,
+                        help="generation step size for new worlds (default: 1)")
+    parser.add_argument("--seed", type=int, default=88960,
+                        help="world seed for new worlds (default: 88960)")
+    parser.add_argument("--sector-size", type=int, default=world.SECTOR_SIZE,
+                        help="sector size for new worlds (default: %d)" % world.SECTOR_SIZE)
+    parser.add_argument("--render-distance", type=int, default=world.RENDER_DISTANCE,
+                        help="sectors drawn around the player (default: %d)" % world.RENDER_DISTANCE)
+    parser.add_argument("--target-fps", type=float, default=0,
+                        help="adjust the render distance to hold this frame rate (default: off)")
+    args = parser.parse_args()
+    world.SECTOR_SIZE = args.sector_size
+    # Terrain heights are cached in PYCRAFT_CACHE, cache by default.
+    heights = HeightCache(os.path.join(os.environ.get('PYCRAFT_CACHE', 'cache'), 'heights'))
+    # Set PYCRAFT_SERVER=host:port to play on a server started with server.py
+    client = None
+    store = None
+    io = None
+    journal = None
+    address = os.environ.get('PYCRAFT_SERVER')
+    if address:
+        host, _, port = address.rpartition(':')
+        client = GameClient(host, int(port))
+        world.SECTOR_SIZE = client.connect()[3]
+        # Clients generate the server's world around the spawn a little
+        # each frame, as for local worlds, applying the server's edits to
+        # each sector once it is generated and leaving block updates to the
+        # server.
+        model = Model(*client.hello[:3], spawn=SPAWN, heights=heights)
+        model.simulated = False
+    else:
+        # Local worlds are saved to PYCRAFT_WORLD, saves/world by default.
+        # New worlds save only their differences from the generated terrain
+        # unless PYCRAFT_SAVE_MODE=full.
+        store = RegionStore(os.environ.get('PYCRAFT_WORLD', os.path.join('saves', 'world')),
+                            os.environ.get('PYCRAFT_SAVE_MODE', 'delta'))
+        if store.level:
+            world.SECTOR_SIZE = store.level['sector_size']
+        io = SectorIO(store)
+        journal = Journal(store)
+        model = Model(args.size, args.step, args.seed, store, SPAWN, heights)
+        model.io = io
+        journal.attach(model)
+        pyglet.clock.schedule_interval(journal.update, journal.interval)
+    model.set_render_distance(args.render_distance)
+    window = Window(width=1280, height=720, caption='pyCraft - '+ Splash_text, resizable=True, client=client, model=model,
+                    target_fps=args.target_fps)
     window.set_icon(pyglet.image.load("./icon.ico"))
     # Hide the mouse cursor and prevent the mouse from leaving the window.
     window.set_exclusive_mouse(True)
     setup()
     pyglet.app.run()
-
-main()
+    if client:
+        client.close()
+    if store:
+        journal.close()
+        window.model.save()
+        io.close()
+        journal.clear()
+        store.close()
+    heights.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import struct
+
+# Wire protocol shared by `server.GameServer` and `client.GameClient`.
+#
+# Every message is a frame: a big-endian uint16 payload length followed by
+# the payload, whose first byte is the message type.
+
+# client -> server
+PLACE = 1       # right click: block, previous, held block, rotation
+BREAK = 2       # left click: block
+
+# server -> client
+HELLO = 3       # world parameters: n, s, seed, sector size
+PALETTE = 4     # binds a one-byte block id to a block name
+DELTA = 5       # block changes: (x, y, z, block id, turn) entries
+SECTOR = 6      # a whole sector in `codec` format
+
+MAX_FRAME = 0xFFFF
+
+# Block id sent in a DELTA entry for a position that became empty.
+REMOVED = 0xFF
+
+_HEADER = struct.Struct("!H")
+_POSITION = struct.Struct("!iii")
+_HELLO = struct.Struct("!Biiii")
+_DELTA_ENTRY = struct.Struct("!iiiBb")
+_ROTATION = struct.Struct("!ff")
+
+# Most DELTA entries that fit in one frame.
+DELTAS_PER_FRAME = (MAX_FRAME - 3) // _DELTA_ENTRY.size
+
+# Bytes per DELTA entry.
+DELTA_SIZE = _DELTA_ENTRY.size
+
+
+class ProtocolError(Exception):
+    """ Raised for malformed or unexpected messages.
+    """
+
+
+def frame(payload):
+    """ Prefix `payload` with its length.
+    """
+    return _HEADER.pack(len(payload)) + payload
+
+
+async def read_frame(reader):
+    """ Read one frame from the asyncio stream `reader` and return its
+    payload. Raises `asyncio.IncompleteReadError` at end of stream.
+    """
+    size, = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return await reader.readexactly(size)
+
+
+def _pack_name(bid):
+    name = bid.encode("ascii")
+    return struct.pack("!B", len(name)) + name
+
+
+def _unpack_name(payload, offset):
+    size = payload[offset]
+    return payload[offset + 1:offset + 1 + size].decode("ascii"), offset + 1 + size
+
+
+def encode_place(block, previous, bid, rotation):
+    """ Encode a right click on `block` with `bid` in hand.
+    """
+    if previous is None:
+        tail = struct.pack("!B", 0) + _POSITION.pack(0, 0, 0)
+    else:
+        tail = struct.pack("!B", 1) + _POSITION.pack(*previous)
+    return frame(struct.pack("!B", PLACE) + _POSITION.pack(*block) + tail +
+                 _ROTATION.pack(*rotation) + _pack_name(bid))
+
+
+def decode_place(payload):
+    """ Returns (block, previous, bid, rotation) from a PLACE payload.
+    """
+    try:
+        block = _POSITION.unpack_from(payload, 1)
+        has_previous = payload[13]
+        previous = _POSITION.unpack_from(payload, 14) if has_previous else None
+        rotation = _ROTATION.unpack_from(payload, 26)
+        bid, _ = _unpack_name(payload, 34)
+    except (IndexError, struct.error, UnicodeDecodeError):
+        raise ProtocolError("malformed PLACE message")
+    return block, previous, bid, rotation
+
+
+def encode_break(block):
+    """ Encode a left click on `block`.
+    """
+    return frame(struct.pack("!B", BREAK) + _POSITION.pack(*block))
+
+
+def decode_break(payload):
+    """ Returns the block from a BREAK payload.
+    """
+    try:
+        return _POSITION.unpack_from(payload, 1)
+    except struct.error:
+        raise ProtocolError("malformed BREAK message")
+
+
+def encode_hello(n, s, seed, sector_size):
+    """ Encode the parameters a client needs to generate the server's world.
+    """
+    return frame(_HELLO.pack(HELLO, n, s, seed, sector_size))
+
+
+def decode_hello(payload):
+    """ Returns (n, s, seed, sector_size) from a HELLO payload.
+    """
+    try:
+        return _HELLO.unpack(payload)[1:]
+    except struct.error:
+        raise ProtocolError("malformed HELLO message")
+
+
+def encode_palette(index, bid):
+    """ Encode the binding of block id `index` to the block name `bid`.
+    """
+    return frame(struct.pack("!BB", PALETTE, index) + _pack_name(bid))
+
+
+def decode_palette(payload):
+    """ Returns (index, bid) from a PALETTE payload.
+    """
+    try:
+        bid, _ = _unpack_name(payload, 2)
+        return payload[1], bid
+    except (IndexError, UnicodeDecodeError):
+        raise ProtocolError("malformed PALETTE message")
+
+
+def encode_deltas(entries):
+    """ Encode (x, y, z, block id, turn) `entries` as DELTA frames of at most
+    DELTAS_PER_FRAME entries each.
+    """
+    frames = []
+    for start in range(0, len(entries), DELTAS_PER_FRAME):
+        chunk = entries[start:start + DELTAS_PER_FRAME]
+        body = b"".join(_DELTA_ENTRY.pack(*entry) for entry in chunk)
+        frames.append(frame(struct.pack("!BH", DELTA, len(chunk)) + body))
+    return b"".join(frames)
+
+
+def decode_deltas(payload):
+    """ Returns the list of (x, y, z, block id, turn) entries in a DELTA
+    payload.
+    """
+    try:
+        count, = struct.unpack_from("!H", payload, 1)
+        return [_DELTA_ENTRY.unpack_from(payload, 3 + i * _DELTA_ENTRY.size)
+                for i in range(count)]
+    except struct.error:
+        raise ProtocolError("malformed DELTA message")
+
+
+def encode_sector(data):
+    """ Wrap a sector encoded by `codec.encode_sector()` in a frame. Returns
+    None if it does not fit in one.
+    """
+    if len(data) + 1 > MAX_FRAME:
+        return None
+    return frame(struct.pack("!B", SECTOR) + data)
+
+
+def decode_sector(payload):
+    """ Returns the `codec` bytes from a SECTOR payload.
+    """
+    return payload[1:]
@@ -0,0 +1,301 @@
+from __future__ import division
+
+import math
+import sys
+
+from world import FACES, MAX_FRAME_TIME, TICKS_PER_SEC, normalize
+
+# The simulation advances in fixed ticks of 1 / TICKS_PER_SEC seconds, each
+# split into SIM_SUBSTEPS collision steps. Frames longer than MAX_FRAME_TIME
+# are clamped so a stall can't queue an unbounded number of catch-up ticks.
+SIM_SUBSTEPS = 8
+
+# Movement variables
+WALKING_SPEED = 5
+FLYING_SPEED = 15
+CROUCH_SPEED = 2
+SPRINT_SPEED = 7
+SPRINT_FOV = SPRINT_SPEED / 2
+
+GRAVITY = 20.0
+MAX_JUMP_HEIGHT = 1.0 # About the height of a block.
+# To derive the formula for calculating jump speed, first solve
+#    v_t = v_0 + a * t
+# for the time at which you achieve maximum height, where a is the acceleration
+# due to gravity and v_t = 0. This gives:
+#    t = - v_0 / a
+# Use t and the desired MAX_JUMP_HEIGHT to solve for v_0 (jump speed) in
+#    s = s_0 + v_0 * t + (a * t^2) / 2
+JUMP_SPEED = math.sqrt(2 * GRAVITY * MAX_JUMP_HEIGHT)
+TERMINAL_VELOCITY = 50
+
+# Player variables
+PLAYER_HEIGHT = 2
+
+# Where the player starts.
+SPAWN = (30, 80, 80)
+
+if sys.version_info[0] >= 3:
+    xrange = range
+
+
+class Player(object):
+    """ The player's position, orientation and movement state, together with
+    the fixed-timestep physics that moves it through a `World`. Used by the
+    game window and by headless clients alike.
+    """
+
+    def __init__(self, model, position=SPAWN):
+
+        # The world the player moves through.
+        self.model = model
+
+        # When flying gravity has no effect and speed is increased.
+        self.flying = False
+
+        # Used for constant jumping. If the space bar is held down,
+        # this is true, otherwise, it's false
+        self.jumping = False
+
+        # If the player actually jumped, this is true
+        self.jumped = False
+
+        # If this is true, a crouch offset is added to the final glTranslate
+        self.crouch = False
+
+        # Player sprint
+        self.sprinting = False
+
+        # Player swimming
+        self.swimming = False
+
+        # This is an offset value so stuff like speed potions can also be easily added
+        self.fov_offset = 0
+
+        self.collision_types = {"top": False, "bottom": False, "right": False, "left": False}
+
+        # Strafing is moving lateral to the direction you are facing,
+        # e.g. moving to the left or right while continuing to face forward.
+        #
+        # First element is -1 when moving forward, 1 when moving back, and 0
+        # otherwise. The second element is -1 when moving left, 1 when moving
+        # right, and 0 otherwise.
+        self.strafe = [0, 0]
+
+        # Current (x, y, z) position in the world, specified with floats. Note
+        # that, perhaps unlike in math class, the y-axis is the vertical axis.
+        self.position = position
+
+        # Position at the start of the current simulation tick. Rendering
+        # interpolates between this and `position`.
+        self.previous_position = self.position
+
+        # Frame time not yet consumed by fixed simulation ticks.
+        self.accumulator = 0.0
+
+        # First element is rotation of the player in the x-z plane (ground
+        # plane) measured from the z-axis down. The second is the rotation
+        # angle from the ground plane up. Rotation is in degrees.
+        #
+        # The vertical plane rotation ranges from -90 (looking straight down) to
+        # 90 (looking straight up). The horizontal rotation range is unbounded.
+        self.rotation = (0, 0)
+
+        # Velocity in the y (upward) direction.
+        self.dy = 0
+
+    def get_sight_vector(self):
+        """ Returns the current line of sight vector indicating the direction
+        the player is looking.
+        """
+        x, y = self.rotation
+        # y ranges from -90 to 90, or -pi/2 to pi/2, so m ranges from 0 to 1 and
+        # is 1 when looking ahead parallel to the ground and 0 when looking
+        # straight up or down.
+        m = math.cos(math.radians(y))
+        # dy ranges from -1 to 1 and is -1 when looking straight down and 1 when
+        # looking straight up.
+        dy = math.sin(math.radians(y))
+        dx = math.cos(math.radians(x - 90)) * m
+        dz = math.sin(math.radians(x - 90)) * m
+        return (dx, dy, dz)
+
+    def get_motion_vector(self):
+        """ Returns the current motion vector indicating the velocity of the
+        player.
+        Returns
+        -------
+        vector : tuple of len 3
+            Tuple containing the velocity in x, y, and z respectively.
+        """
+        if any(self.strafe):
+            x, y = self.rotation
+            strafe = math.degrees(math.atan2(*self.strafe))
+            y_angle = math.radians(y)
+            x_angle = math.radians(x + strafe)
+            if self.flying:
+                m = math.cos(y_angle)
+                dy = math.sin(y_angle)
+                if self.strafe[1]:
+                    # Moving left or right.
+                    dy = 0.0
+                    m = 1
+                if self.strafe[0] > 0:
+                    # Moving backwards.
+                    dy *= -1
+                # When you are flying up or down, you have less left and right
+                # motion.
+                dx = math.cos(x_angle) * m
+                dz = math.sin(x_angle) * m
+            else:
+                dy = 0.0
+                dx = math.cos(x_angle)
+                dz = math.sin(x_angle)
+        else:
+            dy = 0.0
+            dx = 0.0
+            dz = 0.0
+        return (dx, dy, dz)
+
+    def update(self, dt):
+        """ Add the frame time `dt` to the accumulator and advance the
+        simulation in fixed ticks, so the outcome does not depend on the
+        frame rate.
+        Parameters
+        ----------
+        dt : float
+            The change in time since the last call.
+        """
+        tick = 1.0 / TICKS_PER_SEC
+        self.accumulator += min(dt, MAX_FRAME_TIME)
+        while self.accumulator >= tick:
+            self.accumulator -= tick
+            self.tick(tick)
+
+    def tick(self, dt):
+        """ Advance the simulation by one fixed tick of length `dt`.
+        """
+        self.previous_position = self.position
+        m = SIM_SUBSTEPS
+        for _ in xrange(m):
+            self._update(dt / m)
+
+    def get_render_position(self):
+        """ Returns the camera position for the current frame, interpolated
+        between the last two simulation ticks by the unconsumed frame time.
+        """
+        alpha = self.accumulator * TICKS_PER_SEC
+        px, py, pz = self.previous_position
+        x, y, z = self.position
+        return (px + (x - px) * alpha,
+                py + (y - py) * alpha,
+                pz + (z - pz) * alpha)
+
+    def _update(self, dt):
+        """ Private implementation of the `update()` method. This is where most
+        of the motion logic lives, along with gravity and collision detection.
+        Parameters
+        ----------
+        dt : float
+            The change in time since the last call.
+        """
+        # walking
+        if self.flying:
+            speed = FLYING_SPEED
+        elif self.sprinting:
+            speed = SPRINT_SPEED
+        elif self.crouch:
+            speed = CROUCH_SPEED
+        else:
+            speed = WALKING_SPEED
+
+        if self.jumping:
+            if self.collision_types["top"]:
+                self.dy = JUMP_SPEED
+                self.jumped = True
+        else:
+            if self.collision_types["top"]:
+                self.jumped = False
+        if self.jumped:
+            speed += 0.7
+
+        d = dt * speed # distance covered this tick.
+        dx, dy, dz = self.get_motion_vector()
+        # New position in space, before accounting for gravity.
+        dx, dy, dz = dx * d, dy * d, dz * d
+        # gravity
+        if not self.flying:
+            # Update your vertical speed: if you are falling, speed up until you
+            # hit terminal velocity; if you are jumping, slow down until you
+            # start falling.
+            self.dy -= dt * GRAVITY
+            self.dy = max(self.dy, -TERMINAL_VELOCITY)
+            dy += self.dy * dt
+        # collisions
+        old_pos = self.position
+        x, y, z = old_pos
+        x, y, z = self.collide((x + dx, y + dy, z + dz), PLAYER_HEIGHT)
+        self.position = (x, y, z)
+
+        # Sptinting stuff. If the player stops moving in the x and z direction, the player stops sprinting
+        # and the sprint fov is subtracted from the fov offset
+        if old_pos[0]-self.position[0] == 0 and old_pos[2]-self.position[2] == 0:
+            disablefov = False
+            if self.sprinting:
+                disablefov = True
+            self.sprinting = False
+            if disablefov:
+                self.fov_offset -= SPRINT_FOV
+
+    def collide(self, position, height):
+        """ Checks to see if the player at the given `position` and `height`
+        is colliding with any blocks in the world.
+        Parameters
+        ----------
+        position : tuple of len 3
+            The (x, y, z) position to check for collisions at.
+        height : int or float
+            The height of the player.
+        Returns
+        -------
+        position : tuple of len 3
+            The new position of the player taking into account collisions.
+        """
+        # How much overlap with a dimension of a surrounding block you need to
+        # have to count as a collision. If 0, touching terrain at all counts as
+        # a collision. If .49, you sink into the ground, as if walking through
+        # tall grass. If >= .5, you'll fall through the ground.
+        pad = 0.25
+        p = list(position)
+        np = normalize(position)
+        is_solid = self.model.mask.is_solid
+        self.collision_types = {"top":False,"bottom":False,"right":False,"left":False}
+        for face in FACES:  # check all surrounding blocks
+            for i in xrange(3):  # check each dimension independently
+                if not face[i]:
+                    continue
+                # How much overlap you have with this dimension.
+                d = (p[i] - np[i]) * face[i]
+                if d < pad:
+                    continue
+                for dy in xrange(height):  # check each height
+                    op = list(np)
+                    op[1] -= dy
+                    op[i] += face[i]
+                    if np[1] < 1:
+                        self.collision_types["top"] = True
+                        self.dy = 1
+                        break
+                    if not is_solid(*op):
+                        continue
+                    p[i] -= (d - pad) * face[i]
+                    # If you are colliding with the ground or ceiling, stop
+                    # falling / rising.
+                    if face == (0, -1, 0):
+                        self.collision_types["top"] = True
+                        self.dy = 0
+                    if face == (0, 1, 0):
+                        self.collision_types["bottom"] = True
+                        self.dy = 0
+                    break
+        return tuple(p)
@@ -0,0 +1,256 @@
+import json
+import mmap
+import os
+import struct
+import threading
+
+import codec
+import world
+
+# Sectors are saved in region files of REGION_SIZE x REGION_SIZE sectors.
+#
+#   header   magic "PREG", version, region size
+#   table    (offset, length) per sector, row-major by z then x; length 0
+#            means the sector was never saved
+#   data     sectors in `codec` format, each at its table offset
+#
+# Files are read through a read-only mmap, so opening a world costs the
+# same whatever its size and a sector is only decoded when it is asked for.
+#
+# Sectors are never written over: new bytes are appended and synced before
+# the table points at them, so a write cut short leaves the old copy in
+# place. The space they leave behind is reclaimed by `compact()`, which
+# writes a new file and swaps it in.
+
+REGION_SIZE = 8
+VERSION = 1
+
+MODES = ("full", "delta")
+
+_HEADER = struct.Struct("!4sBH")
+_ENTRY = struct.Struct("!II")
+_TABLE_SIZE = REGION_SIZE * REGION_SIZE * _ENTRY.size
+
+
+class RegionFile(object):
+    """ One region file holding up to REGION_SIZE x REGION_SIZE sectors.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(_HEADER.pack(b"PREG", VERSION, REGION_SIZE))
+                f.write(b"\0" * _TABLE_SIZE)
+        self._map = None
+        self._open()
+
+    def _open(self):
+        self.file = open(self.path, "r+b")
+        magic, version, size = _HEADER.unpack(self.file.read(_HEADER.size))
+        if magic != b"PREG" or version != VERSION or size != REGION_SIZE:
+            self.file.close()
+            raise ValueError("%s is not a version %d region file" % (self.path, VERSION))
+
+    def _mapped(self):
+        # Mapped lazily and dropped before every write, since some platforms
+        # can't extend a file while it is mapped.
+        if self._map is None:
+            self._map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _entry(self, index):
+        return _ENTRY.unpack_from(self._mapped(), _HEADER.size + index * _ENTRY.size)
+
+    def read(self, index):
+        """ Returns the bytes stored for sector `index`, or None.
+        """
+        offset, length = self._entry(index)
+        if not length:
+            return None
+        return self._mapped()[offset:offset + length]
+
+    def indices(self):
+        """ Returns the indices of the sectors stored in this file.
+        """
+        return [i for i in range(REGION_SIZE * REGION_SIZE) if self._entry(i)[1]]
+
+    def write(self, index, data):
+        """ Store `data` for sector `index` at the end of the file.
+        """
+        self._unmap()
+        self.file.seek(0, os.SEEK_END)
+        offset = self.file.tell()
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.seek(_HEADER.size + index * _ENTRY.size)
+        self.file.write(_ENTRY.pack(offset, len(data)))
+        # Through to the file, for the map to see.
+        self.file.flush()
+
+    def waste(self):
+        """ Returns the number of bytes not referenced by the offset table.
+        """
+        live = sum(self._entry(i)[1] for i in range(REGION_SIZE * REGION_SIZE))
+        return os.path.getsize(self.path) - _HEADER.size - _TABLE_SIZE - live
+
+    def compact(self):
+        """ Replace the file with one without the space left behind by
+        sectors written again.
+        """
+        sectors = [(i, bytes(self.read(i))) for i in self.indices()]
+        table = bytearray(_TABLE_SIZE)
+        offset = _HEADER.size + _TABLE_SIZE
+        for i, data in sectors:
+            _ENTRY.pack_into(table, i * _ENTRY.size, offset, len(data))
+            offset += len(data)
+        with open(self.path + ".tmp", "wb") as f:
+            f.write(_HEADER.pack(b"PREG", VERSION, REGION_SIZE))
+            f.write(table)
+            for _, data in sectors:
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.close()
+        os.replace(self.path + ".tmp", self.path)
+        self._open()
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self._unmap()
+        self.file.close()
+
+
+class RegionStore(object):
+    """ A saved world: a directory of region files plus `level.json` with the
+    parameters the world was generated with.
+    """
+
+    def __init__(self, path, mode="delta"):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        # Mapping from region to its open `RegionFile`.
+        self.regions = {}
+
+        # Held while reading or writing, so a background thread can write
+        # sectors while the game thread loads others.
+        self.lock = threading.RLock()
+
+        # Contents of level.json, or None for a new world.
+        self.level = None
+        level = os.path.join(path, "level.json")
+        if os.path.exists(level):
+            with open(level) as f:
+                self.level = json.load(f)
+
+        # "full" to store every block of a sector, "delta" to store only the
+        # blocks that differ from the generated terrain. Worlds keep the mode
+        # they were created with.
+        if self.level is not None:
+            mode = self.level.get("mode", "full")
+        if mode not in MODES:
+            raise ValueError("unknown save mode %r" % mode)
+        self.mode = mode
+
+    def has_sectors(self):
+        """ Returns True if any sector has been saved.
+        """
+        return any(name.endswith(".region") for name in os.listdir(self.path))
+
+    def _region(self, sector, create):
+        sx, _, sz = sector
+        key = (sx // REGION_SIZE, sz // REGION_SIZE)
+        region = self.regions.get(key)
+        if region is None:
+            path = os.path.join(self.path, "r.%d.%d.region" % key)
+            if not create and not os.path.exists(path):
+                return None, 0
+            region = self.regions[key] = RegionFile(path)
+        index = (sz % REGION_SIZE) * REGION_SIZE + sx % REGION_SIZE
+        return region, index
+
+    def read(self, sector):
+        """ Returns the `codec` bytes stored for `sector`, or None.
+        """
+        with self.lock:
+            region, index = self._region(sector, False)
+            if region is None:
+                return None
+            return region.read(index)
+
+    def load(self, sector):
+        """ Returns the (position, bid, turn) blocks stored for `sector`, or
+        None if it was never saved.
+        """
+        data = self.read(sector)
+        if data is None:
+            return None
+        return codec.decode_sector(data)[1]
+
+    def write(self, sector, data):
+        """ Store `codec` bytes for `sector`.
+        """
+        with self.lock:
+            region, index = self._region(sector, True)
+            region.write(index, data)
+
+    def encode(self, model, sector):
+        """ Returns the bytes this store saves for `sector` of `model`.
+        """
+        if self.mode == "delta":
+            return codec.encode_blocks(sector, model.diff(sector), size=model.mask.size)
+        return codec.encode_sector(model, sector)
+
+    def save(self, model, sectors):
+        """ Encode and store `sectors` of `model`, then write level.json.
+        """
+        with self.lock:
+            for sector in sectors:
+                self.write(sector, self.encode(model, sector))
+            self.save_level(model)
+            self.flush()
+
+    def save_level(self, model):
+        self.level = {
+            "version": VERSION,
+            "n": model.n,
+            "s": model.s,
+            "seed": model.seed,
+            "sector_size": model.mask.size,
+            "mode": self.mode,
+            "generator": world.GENERATOR_VERSION,
+            # True once the world is generated, the (x, z) of the sectors
+            # generated so far until then.
+            "generated": (True if model.generator is None
+                          else sorted([x, z] for x, _, z in model.generated)),
+        }
+        path = os.path.join(self.path, "level.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.level, f)
+        os.replace(path + ".tmp", path)
+
+    def flush(self):
+        """ Flush every region file, compacting those that are mostly
+        unreferenced space.
+        """
+        with self.lock:
+            for region in self.regions.values():
+                if region.waste() > os.path.getsize(region.path) // 2:
+                    region.compact()
+                region.flush()
+
+    def close(self):
+        with self.lock:
+            for region in self.regions.values():
+                region.close()
+            self.regions = {}
@@ -0,0 +1,124 @@
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import codec
+
+
+class SectorIO(object):
+    """ Reads and writes the sectors of a `region.RegionStore` on a thread
+    pool, so the frame loop never waits on the disk.
+
+    `read()` returns a future of the sector's blocks, shared by every caller
+    until `discard()`, `keep()` or, past `max_reads`, until it is the least
+    recently read. `write()` queues bytes for a sector; writes to a
+    sector that has not been written yet replace the queued bytes instead of
+    adding a second write, and reads see queued bytes before the store.
+    """
+
+    def __init__(self, store, workers=2, max_reads=1024):
+        self.store = store
+        self.executor = ThreadPoolExecutor(workers)
+        # Reads kept at most, more than the sectors in view at the greatest
+        # render distance.
+        self.max_reads = max_reads
+
+        # Mapping from sector to the future of its blocks, least recently
+        # read first.
+        self.reads = OrderedDict()
+
+        # Mapping from sector to bytes waiting to be written, and the sectors
+        # a worker is writing.
+        self._writes = {}
+        self._busy = set()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+        self.read_count = 0
+        self.write_count = 0
+        self.coalesced = 0
+
+    def read(self, sector):
+        """ Returns a future of the (position, bid, turn) blocks stored for
+        `sector`, or of None if it was never saved.
+        """
+        future = self.reads.get(sector)
+        if future is None:
+            future = self.reads[sector] = self.executor.submit(self.load, sector)
+            self.read_count += 1
+            while len(self.reads) > self.max_reads:
+                self.reads.popitem(last=False)[1].cancel()
+        else:
+            self.reads.move_to_end(sector)
+        return future
+
+    def discard(self, sector):
+        """ Forget the read of `sector` once its blocks have been used.
+        """
+        self.reads.pop(sector, None)
+
+    def keep(self, sectors):
+        """ Forget the reads of sectors not in `sectors`, cancelling those
+        not started yet.
+        """
+        for sector in [sector for sector in self.reads if sector not in sectors]:
+            self.reads.pop(sector).cancel()
+
+    def prefetch(self, sectors):
+        """ Start reading `sectors` that are not being read yet.
+        """
+        for sector in sectors:
+            self.read(sector)
+
+    def load(self, sector):
+        """ Read and decode `sector` on the calling thread, seeing writes that
+        are still queued.
+        """
+        with self._lock:
+            data = self._writes.get(sector)
+        if data is None:
+            data = self.store.read(sector)
+            if data is None:
+                return None
+        return codec.decode_sector(data)[1]
+
+    def write(self, sector, data):
+        """ Queue `codec` bytes to be stored for `sector`.
+        """
+        with self._lock:
+            if sector in self._writes:
+                self.coalesced += 1
+            self._writes[sector] = data
+            if sector in self._busy:
+                return
+            self._busy.add(sector)
+        self.executor.submit(self._drain, sector)
+
+    def _drain(self, sector):
+        # One worker per sector writes until no newer bytes are queued, so
+        # writes to a sector never overtake each other.
+        while True:
+            with self._lock:
+                data = self._writes.get(sector)
+                if data is None:
+                    self._busy.discard(sector)
+                    self._idle.notify_all()
+                    return
+            self.store.write(sector, data)
+            with self._lock:
+                if self._writes.get(sector) is data:
+                    del self._writes[sector]
+                self.write_count += 1
+
+    def flush(self):
+        """ Wait for queued writes to reach the store and flush it.
+        """
+        with self._lock:
+            while self._busy:
+                self._idle.wait()
+        self.store.flush()
+
+    def close(self):
+        self.flush()
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,313 @@
+from __future__ import division
+
+import argparse
+import asyncio
+import math
+import random
+import time
+
+import codec
+import net
+import world
+from blocks import BLOCKS
+from world import World, sectorize
+
+
+class ClientConnection(object):
+    """ A client connected to the server: its stream writer, the block ids
+    bound on this connection and its traffic counters.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+
+        # Mapping from block name to the one-byte id used on this connection.
+        self.palette = {}
+
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def send(self, data):
+        self.writer.write(data)
+        self.bytes_sent += len(data)
+
+    def encode(self, changes):
+        """ Returns the frames describing `changes`, a list of
+        (position, (bid, turn)) pairs, preceded by PALETTE frames for any
+        block name not yet bound on this connection.
+        """
+        frames = []
+        entries = []
+        for (x, y, z), (bid, turn) in changes:
+            if bid is None:
+                entries.append((x, y, z, net.REMOVED, 0))
+                continue
+            index = self.palette.get(bid)
+            if index is None:
+                index = len(self.palette)
+                if index >= net.REMOVED:
+                    raise net.ProtocolError("too many block types")
+                self.palette[bid] = index
+                frames.append(net.encode_palette(index, bid))
+            entries.append((x, y, z, index, turn))
+        frames.append(net.encode_deltas(entries))
+        return b"".join(frames)
+
+
+class GameServer(object):
+    """ Authoritative multiplayer server. It owns the `World`, applies the
+    clicks clients send with the same semantics as `Window.on_mouse_press()`
+    and broadcasts the resulting block changes to every client.
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+        # Connected clients.
+        self.clients = []
+
+        # Latest state of every position changed since the world was
+        # generated, as (bid, turn), with bid None for removed blocks. New
+        # clients generate the world from the seed and then receive these.
+        self.edits = {}
+
+        # Changes made while applying the current message.
+        self.pending = {}
+
+        # Number of client messages applied.
+        self.edits_applied = 0
+
+        model.listeners.append(self._on_change)
+
+    def _on_change(self, position, bid):
+        if bid is None:
+            self.pending[position] = (None, 0)
+        else:
+            self.pending[position] = (bid, self.model.rots[position])
+
+    async def serve(self, host, port):
+        """ Start accepting clients on `host`:`port` and return the
+        `asyncio.Server`.
+        """
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def _handle(self, reader, writer):
+        client = ClientConnection(writer)
+        client.send(net.encode_hello(self.model.n, self.model.s,
+                                     self.model.seed, world.SECTOR_SIZE))
+        self._send_edits(client)
+        self.clients.append(client)
+        try:
+            while True:
+                payload = await net.read_frame(reader)
+                client.bytes_received += len(payload) + 2
+                self.apply(payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, net.ProtocolError):
+            pass
+        finally:
+            self.clients.remove(client)
+            writer.close()
+
+    def _send_edits(self, client):
+        """ Bring a newly connected `client` from the generated world up to
+        date: heavily edited sectors are sent whole in `codec` format, the
+        rest as DELTA entries, whichever is smaller.
+        """
+        by_sector = {}
+        for position, change in self.edits.items():
+            by_sector.setdefault(sectorize(position), []).append((position, change))
+        changes = []
+        for sector, edits in by_sector.items():
+            data = None
+            if len(edits) * net.DELTA_SIZE > 1024:
+                data = net.encode_sector(codec.encode_sector(self.model, sector))
+            if data is not None and len(data) < len(edits) * net.DELTA_SIZE:
+                client.send(data)
+            else:
+                changes.extend(edits)
+        if changes:
+            client.send(client.encode(changes))
+
+    def _valid_target(self, block, previous):
+        """ Returns True if `block` exists and `previous` is None or touches
+        it, as `World.hit_test()` guarantees for honest clients.
+        """
+        if block not in self.model.world:
+            return False
+        if previous is None:
+            return True
+        return all(abs(a - b) <= 1 for a, b in zip(block, previous))
+
+    def apply(self, payload):
+        """ Apply one client message to the world and broadcast the changes
+        it caused.
+        """
+        kind = payload[0] if payload else None
+        if kind == net.PLACE:
+            block, previous, bid, rotation = net.decode_place(payload)
+            if (self._valid_target(block, previous) and bid in BLOCKS and
+                    all(math.isfinite(angle) for angle in rotation)):
+                self.model.place_block(block, previous, bid, rotation)
+        elif kind == net.BREAK:
+            block = net.decode_break(payload)
+            if self._valid_target(block, None):
+                self.model.break_block(block)
+        else:
+            raise net.ProtocolError("unexpected message type %r" % kind)
+        self.edits_applied += 1
+        self.flush()
+
+    async def tick(self):
+        """ Advance the world every tick and broadcast what changes.
+        """
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(1.0 / world.TICKS_PER_SEC)
+            now = time.perf_counter()
+            # The ticks the time slept, which may be more than one.
+            self.model.advance(now - last, 0.25 / world.TICKS_PER_SEC)
+            last = now
+            self.flush()
+
+    def flush(self):
+        """ Send the pending changes to every client.
+        """
+        if not self.pending:
+            return
+        changes = list(self.pending.items())
+        self.edits.update(self.pending)
+        self.pending = {}
+        for client in self.clients:
+            client.send(client.encode(changes))
+
+
+class _BenchClient(object):
+    """ A loopback client for `benchmark()` that counts what it receives.
+    """
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.task = asyncio.ensure_future(self._read())
+
+    async def _read(self):
+        try:
+            while True:
+                payload = await net.read_frame(self.reader)
+                self.bytes_received += len(payload) + 2
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    def send(self, data):
+        self.writer.write(data)
+        self.bytes_sent += len(data)
+
+
+async def benchmark(server, clients=4, edits=2000):
+    """ Connect `clients` loopback clients to `server`, have them send
+    `edits` alternating place / break messages and wait until every change
+    has reached every client. Returns a dict of measurements.
+    """
+    listener = await server.serve("127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    bots = []
+    for _ in range(clients):
+        bot = _BenchClient()
+        await bot.connect("127.0.0.1", port)
+        bots.append(bot)
+    while len(server.clients) < clients:
+        await asyncio.sleep(0.01)
+    model = server.model
+    rng = random.Random(model.seed)
+    tops = {}
+    for (x, y, z) in model.world:
+        if y > tops.get((x, z), -1):
+            tops[(x, z)] = y
+    columns = rng.sample(sorted(tops), min(len(tops), edits // 2 + 1))
+    received = [bot.bytes_received for bot in bots]
+    start = time.perf_counter()
+    for i in range(edits):
+        x, z = columns[i // 2]
+        y = tops[(x, z)]
+        bot = bots[(i // 2) % clients]
+        if i % 2 == 0:
+            bot.send(net.encode_place((x, y, z), (x, y + 1, z), "stone", (0, 0)))
+        else:
+            bot.send(net.encode_break((x, y + 1, z)))
+        if i % 64 == 63:
+            await asyncio.sleep(0)
+    while server.edits_applied < edits or (
+            sum(bot.bytes_received for bot in bots) <
+            sum(conn.bytes_sent for conn in server.clients)):
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    down = [bot.bytes_received - r for bot, r in zip(bots, received)]
+    for bot in bots:
+        bot.writer.close()
+    await asyncio.gather(*(bot.task for bot in bots))
+    while server.clients:
+        await asyncio.sleep(0.01)
+    listener.close()
+    await listener.wait_closed()
+    return {
+        "edits": edits,
+        "clients": clients,
+        "seconds": elapsed,
+        "edits_per_second": edits / elapsed,
+        "bytes_down_per_client": sum(down) / clients,
+        "bytes_down_per_client_per_second": sum(down) / clients / elapsed,
+        "bytes_up_per_edit": sum(bot.bytes_sent for bot in bots) / edits,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run an authoritative multiplayer server.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=25565)
+    parser.add_argument("--size", type=int, default=512,
+                        help="world size in blocks (default: 512)")
+    parser.add_argument("--step", type=int, default=1,
+                        help="generation step size (default: 1)")
+    parser.add_argument("--seed", type=int, default=88960,
+                        help="world seed (default: 88960)")
+    parser.add_argument("--sector-size", type=int, default=world.SECTOR_SIZE,
+                        help="sector size (default: %d)" % world.SECTOR_SIZE)
+    parser.add_argument("--bench", action="store_true",
+                        help="measure edits per second and per-client "
+                             "bandwidth over loopback, then exit")
+    parser.add_argument("--clients", type=int, default=4,
+                        help="loopback clients for --bench (default: 4)")
+    parser.add_argument("--edits", type=int, default=2000,
+                        help="edits sent by --bench (default: 2000)")
+    args = parser.parse_args()
+
+    world.SECTOR_SIZE = args.sector_size
+    start = time.perf_counter()
+    server = GameServer(World(args.size, args.step, args.seed))
+    print("generated %d blocks in %.1f s" % (
+        len(server.model.world), time.perf_counter() - start))
+
+    if args.bench:
+        result = asyncio.run(benchmark(server, args.clients, args.edits))
+        print("%(edits)d edits, %(clients)d clients: %(edits_per_second).0f "
+              "edits/s" % result)
+        print("per client: %(bytes_down_per_client).0f bytes down "
+              "(%(bytes_down_per_client_per_second).0f B/s), "
+              "%(bytes_up_per_edit).1f bytes up per edit" % result)
+        return
+
+    async def run():
+        listener = await server.serve(args.host, args.port)
+        print("listening on %s:%d" % (args.host, args.port))
+        asyncio.ensure_future(server.tick())
+        async with listener:
+            await listener.serve_forever()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
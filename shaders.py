@@ -0,0 +1,329 @@
+from __future__ import division
+
+import ctypes
+import math
+
+from array import array
+
+# The shader pipeline the world is drawn with.
+#
+# Meshes are lists of quads, four vertices each, drawn as indexed triangles
+# rather than GL_QUADS, which drivers split into triangles on every draw.
+# The indices are the same for every mesh, so they are kept once in a
+# shared element buffer, `QuadIndices`, and `draw_quads()` draws the meshes
+# in a buffer of a `meshpool.MeshPool` with one glMultiDrawElementsBaseVertex
+# call, or one glDrawElements per mesh where base vertices are not
+# supported.
+#
+# Vertices are packed into 8 bytes, which the vertex shader unpacks:
+#
+#   vertex  2 shorts  x and z of the block corner the vertex is at, that is
+#                     its coordinates + 0.5, which are whole numbers
+#   colour  4 bytes   its height + 0.5 in 1/HEIGHT_STEPS of a block, in the
+#                     first byte and the low 5 bits of the second; the
+#                     texture corner in the top 3 bits of the second, the
+#                     right edge of the tile in bit 0 and the halves of its
+#                     height up in bits 1-2; the atlas tile, row major; and
+#                     the shade of the vertex, 0 to 255
+#
+# They are given as the fixed-function vertex and colour arrays, which
+# need no attribute locations bound to the program. The shaders are
+# GLSL 1.20, reading the fixed-function matrices, and do the fog and alpha
+# test themselves, so they run on any OpenGL 2.1 driver, Mesa's software
+# rasteriser included.
+#
+# pyglet.gl is imported by the functions that call OpenGL, not here: it opens
+# a window as it is imported, and the packing of vertices needs no display.
+
+HEIGHT_STEPS = 16
+HEIGHT_BITS = 13
+
+VERTEX_BYTES = 8
+
+VERTEX_SOURCE = ("""
+#version 120
+
+uniform float tiles;
+
+varying vec2 tex_coord;
+varying vec4 shade;
+varying float distance;
+
+void main() {
+    vec2 corner = gl_Vertex.xy;
+    vec4 code = floor(gl_Color * 255.0 + 0.5);
+    float high = code.y;
+    float height = code.x + mod(high, 32.0) * 256.0;
+    vec4 position = gl_ModelViewMatrix * vec4(corner.x - 0.5, height / %d.0 - 0.5, corner.y - 0.5, 1.0);
+    gl_Position = gl_ProjectionMatrix * position;
+    float texture_corner = floor(high / 32.0);
+    tex_coord = vec2(mod(code.z, tiles) + mod(texture_corner, 2.0),
+                     floor(code.z / tiles) + floor(texture_corner / 2.0) * 0.5) / tiles;
+    shade = vec4(vec3(code.w / 255.0), 1.0);
+    distance = length(position.xyz);
+}
+""" % HEIGHT_STEPS).encode("ascii")
+
+FRAGMENT_SOURCE = b"""
+#version 120
+
+uniform sampler2D atlas;
+uniform vec3 fog_color;
+uniform float fog_start;
+uniform float fog_end;
+uniform float alpha_cutoff;
+
+varying vec2 tex_coord;
+varying vec4 shade;
+varying float distance;
+
+void main() {
+    vec4 color = texture2D(atlas, tex_coord) * shade;
+    if (color.a <= alpha_cutoff)
+        discard;
+    float fog = clamp((fog_end - distance) / (fog_end - fog_start), 0.0, 1.0);
+    gl_FragColor = vec4(mix(fog_color, color.rgb, fog), color.a);
+}
+"""
+
+# Indices of the two triangles of a quad, keeping its winding.
+QUAD_TRIANGLES = (0, 1, 2, 0, 2, 3)
+
+# Least number of quads `QuadIndices` makes room for.
+MIN_QUADS = 4096
+
+
+class ShaderError(Exception):
+    """ Raised when a shader fails to compile or link.
+    """
+
+
+def _log(get_value, get_log, name):
+    from pyglet import gl
+    length = gl.GLint()
+    get_value(name, gl.GL_INFO_LOG_LENGTH, ctypes.byref(length))
+    buffer = ctypes.create_string_buffer(max(1, length.value))
+    get_log(name, len(buffer), None, buffer)
+    return buffer.value.decode("utf-8", "replace")
+
+
+def _compile(kind, source):
+    from pyglet import gl
+    shader = gl.glCreateShader(kind)
+    text = ctypes.create_string_buffer(source)
+    pointer = ctypes.cast(ctypes.pointer(ctypes.pointer(text)),
+                          ctypes.POINTER(ctypes.POINTER(gl.GLchar)))
+    gl.glShaderSource(shader, 1, pointer, None)
+    gl.glCompileShader(shader)
+    status = gl.GLint()
+    gl.glGetShaderiv(shader, gl.GL_COMPILE_STATUS, ctypes.byref(status))
+    if not status.value:
+        log = _log(gl.glGetShaderiv, gl.glGetShaderInfoLog, shader)
+        gl.glDeleteShader(shader)
+        raise ShaderError("shader failed to compile: %s" % log)
+    return shader
+
+
+def pack_shape(vtx, tex, tiles):
+    """ Returns the parts of the packed vertices of quads that do not depend
+    on where they are moved to or how they are shaded, given their vertices
+    and texture coordinates in an atlas of `tiles` x `tiles` tiles. Quads
+    with no area are left out. See `place_shape()`.
+    """
+    count = len(vtx) // 3
+    keep = [vertex for quad in range(0, count, 4)
+            if not vtx[quad * 3:quad * 3 + 3] == vtx[quad * 3 + 3:quad * 3 + 6] == vtx[quad * 3 + 6:quad * 3 + 9]
+            for vertex in range(quad, quad + 4)]
+    tile_list = []
+    texture_corners = []
+    for quad in range(0, len(tex), 8):
+        us = [u * tiles for u in tex[quad:quad + 8:2]]
+        vs = [v * tiles for v in tex[quad + 1:quad + 8:2]]
+        column = int(math.floor(min(us) + 0.001))
+        row = int(math.floor(min(vs) + 0.001))
+        for u, v in zip(us, vs):
+            tile_list.append(row * tiles + column)
+            texture_corners.append((int(round(u - column)) | int(round((v - row) * 2)) << 1) << 5)
+    # Adding 32769 rather than 1 keeps the numbers positive, so int() rounds
+    # them down.
+    return (keep if len(keep) < count else None,
+            [int(vtx[vertex * 3] + 32769.0) - 32768 for vertex in keep],
+            [int(vtx[vertex * 3 + 2] + 32769.0) - 32768 for vertex in keep],
+            [int((vtx[vertex * 3 + 1] + 0.5) * HEIGHT_STEPS + 0.5) for vertex in keep],
+            [texture_corners[vertex] for vertex in keep],
+            array('B', [tile_list[vertex] for vertex in keep]))
+
+
+def place_shape(shape, shades, offset=(0, 0, 0)):
+    """ Returns the packed vertices, as arrays of corners and packed bytes,
+    of `shape` from `pack_shape()` moved by whole blocks `offset`, given
+    the shade of every vertex of the quads it was made from.
+    """
+    keep, xs, zs, heights, texture_corners, tile_list = shape
+    if keep is not None:
+        shades = [shades[vertex] for vertex in keep]
+    x, y, z = offset
+    if x or z:
+        xs = [c + x for c in xs]
+        zs = [c + z for c in zs]
+    if y:
+        y *= HEIGHT_STEPS
+        heights = [height + y for height in heights]
+    if heights and (min(heights) < 0 or max(heights) >= 1 << HEIGHT_BITS):
+        top = (1 << HEIGHT_BITS) - 1
+        heights = [min(max(height, 0), top) for height in heights]
+    count = len(heights)
+    corners = array('h', bytes(4 * count))
+    corners[0::2] = array('h', xs)
+    corners[1::2] = array('h', zs)
+    packed = array('B', bytes(4 * count))
+    packed[0::4] = array('B', [height & 0xFF for height in heights])
+    packed[1::4] = array('B', [height >> 8 | corner for height, corner in zip(heights, texture_corners)])
+    packed[2::4] = tile_list
+    packed[3::4] = array('B', shades)
+    return corners, packed
+
+
+def pack_quads(vtx, tex, shades, tiles):
+    """ Returns the packed vertices, as arrays of corners and packed bytes,
+    of quads given by their vertices, texture coordinates in an atlas of
+    `tiles` x `tiles` tiles and the shade of each vertex. Quads with no
+    area are left out.
+    """
+    return place_shape(pack_shape(vtx, tex, tiles), shades)
+
+
+def vertex_data(corners, packed):
+    """ Returns the packed vertices given as arrays of corners and packed
+    bytes interleaved, `VERTEX_BYTES` each, as for `MeshPool.add()`.
+    """
+    data = array('I', bytes(len(corners) * 4))
+    data[0::2] = array('I', corners.tobytes())
+    data[1::2] = array('I', packed.tobytes())
+    return data
+
+
+class Program(object):
+    """ A linked shader program. Needs a current OpenGL context.
+    """
+
+    def __init__(self, vertex_source=VERTEX_SOURCE, fragment_source=FRAGMENT_SOURCE):
+        from pyglet import gl
+        shaders = [_compile(gl.GL_VERTEX_SHADER, vertex_source),
+                   _compile(gl.GL_FRAGMENT_SHADER, fragment_source)]
+        self.id = gl.glCreateProgram()
+        for shader in shaders:
+            gl.glAttachShader(self.id, shader)
+        gl.glLinkProgram(self.id)
+        for shader in shaders:
+            # Freed with the program.
+            gl.glDeleteShader(shader)
+        status = gl.GLint()
+        gl.glGetProgramiv(self.id, gl.GL_LINK_STATUS, ctypes.byref(status))
+        if not status.value:
+            raise ShaderError("shader program failed to link: %s" % _log(gl.glGetProgramiv, gl.glGetProgramInfoLog, self.id))
+
+        # Mapping from uniform name to its location.
+        self._locations = {}
+
+    def use(self):
+        from pyglet import gl
+        gl.glUseProgram(self.id)
+
+    @staticmethod
+    def stop():
+        """ Go back to the fixed-function pipeline.
+        """
+        from pyglet import gl
+        gl.glUseProgram(0)
+
+    def uniform(self, name, *values):
+        """ Set the float, or vec2 to vec4, uniform `name` of the program,
+        which must be in use.
+        """
+        from pyglet import gl
+        location = self._locations.get(name)
+        if location is None:
+            location = self._locations[name] = gl.glGetUniformLocation(self.id, name.encode("ascii"))
+        (gl.glUniform1f, gl.glUniform2f, gl.glUniform3f, gl.glUniform4f)[len(values) - 1](location, *values)
+
+
+class QuadIndices(object):
+    """ The element buffer of the triangles of quads 0 to `quads` - 1,
+    grown as larger meshes are drawn. Needs a current OpenGL context.
+    """
+
+    def __init__(self):
+        from pyglet import gl
+        self.buffer = gl.GLuint()
+        gl.glGenBuffers(1, ctypes.byref(self.buffer))
+        self.quads = 0
+
+    def bind(self, quads=0):
+        """ Bind the buffer, with room for at least `quads` quads.
+        """
+        from pyglet import gl
+        gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, self.buffer)
+        if quads <= self.quads:
+            return
+        self.quads = max(quads, 2 * self.quads, MIN_QUADS)
+        indices = array('I', QUAD_TRIANGLES * self.quads)
+        for i in range(len(QUAD_TRIANGLES), len(indices)):
+            indices[i] += i // len(QUAD_TRIANGLES) * 4
+        address, length = indices.buffer_info()
+        gl.glBufferData(gl.GL_ELEMENT_ARRAY_BUFFER, length * indices.itemsize, address, gl.GL_STATIC_DRAW)
+
+
+def _set_pointers(offset):
+    from pyglet import gl
+    gl.glVertexPointer(2, gl.GL_SHORT, VERTEX_BYTES, offset)
+    gl.glColorPointer(4, gl.GL_UNSIGNED_BYTE, VERTEX_BYTES, offset + 4)
+
+
+def draw_quads(meshes, indices, ordered=False):
+    """ Draw the quads of `meshes`, from `meshpool.MeshPool.add()`, as
+    triangles with the `QuadIndices` `indices`, in the order given if
+    `ordered` is set. Returns the number of draw calls made.
+    """
+    from pyglet import gl
+    slabs = []
+    if ordered:
+        for mesh in meshes:
+            if slabs and slabs[-1][0] is mesh.slab:
+                slabs[-1][1].append(mesh)
+            else:
+                slabs.append((mesh.slab, [mesh]))
+    else:
+        by_slab = {}
+        for mesh in meshes:
+            by_slab.setdefault(mesh.slab, []).append(mesh)
+        slabs = by_slab.items()
+    base_vertex = gl.gl_info.have_version(3, 2)
+    calls = 0
+    gl.glPushClientAttrib(gl.GL_CLIENT_VERTEX_ARRAY_BIT)
+    gl.glEnableClientState(gl.GL_VERTEX_ARRAY)
+    gl.glEnableClientState(gl.GL_COLOR_ARRAY)
+    indices.bind(max(mesh.count for mesh in meshes) // 4 if meshes else 0)
+    for slab, slab_meshes in slabs:
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, slab.buffer)
+        if base_vertex:
+            _set_pointers(0)
+            count = len(slab_meshes)
+            gl.glMultiDrawElementsBaseVertex(
+                gl.GL_TRIANGLES,
+                (gl.GLsizei * count)(*(mesh.count // 4 * 6 for mesh in slab_meshes)),
+                gl.GL_UNSIGNED_INT,
+                (ctypes.c_void_p * count)(),
+                count,
+                (gl.GLint * count)(*(mesh.start for mesh in slab_meshes)))
+            calls += 1
+        else:
+            for mesh in slab_meshes:
+                # Point the arrays at the first vertex of the mesh instead.
+                _set_pointers(mesh.start * VERTEX_BYTES)
+                gl.glDrawElements(gl.GL_TRIANGLES, mesh.count // 4 * 6, gl.GL_UNSIGNED_INT, 0)
+                calls += 1
+    gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, 0)
+    gl.glBindBuffer(gl.GL_ARRAY_BUFFER, 0)
+    gl.glPopClientAttrib()
+    return calls
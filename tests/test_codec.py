@@ -0,0 +1,64 @@
+import zlib
+
+import pytest
+
+import codec
+import world
+from world import World
+
+
+@pytest.fixture(scope="module")
+def model():
+    return World(48, 1, 88960)
+
+
+def _blocks(model, sector):
+    return sorted((position, model.world[position], model.rots.get(position, 0) % 4)
+                  for position in model.sectors[sector])
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_sector_round_trip(model, compress):
+    for sector in model.sectors:
+        data = codec.encode_sector(model, sector, compress)
+        decoded, blocks = codec.decode_sector(data)
+        assert decoded == sector
+        assert sorted(blocks) == _blocks(model, sector)
+
+
+def test_blocks_round_trip():
+    size = world.SECTOR_SIZE
+    blocks = [((-size, 300, 2 - size), "stone", 0),
+              ((-1, -5, -1), "oak_log", 3),
+              ((-size + 4, 40, -size + 7), "stone_slab_inv", 1)]
+    sector, decoded = codec.decode_sector(codec.encode_blocks((-1, 0, -1), blocks))
+    assert sector == (-1, 0, -1)
+    assert sorted(decoded) == sorted(blocks)
+
+
+def test_empty_sector():
+    sector, blocks = codec.decode_sector(codec.encode_blocks((3, 0, 4), []))
+    assert (sector, blocks) == ((3, 0, 4), [])
+
+
+def test_other_sector_size():
+    blocks = [((17, 1, 18), "dirt", 2), ((31, 0, 16), "grass", 0)]
+    data = codec.encode_blocks((1, 0, 1), blocks, size=16)
+    assert sorted(codec.decode_sector(data)[1]) == sorted(blocks)
+
+
+def test_compression_shrinks_terrain(model):
+    sector = (0, 0, 0)
+    compressed = codec.encode_sector(model, sector, True)
+    raw = codec.encode_sector(model, sector, False)
+    assert len(compressed) < len(raw)
+
+
+def test_rejects_bad_data(model):
+    data = codec.encode_sector(model, (0, 0, 0))
+    with pytest.raises(ValueError):
+        codec.decode_sector(data[:10])
+    with pytest.raises(ValueError):
+        codec.decode_sector(b"XXXX" + data[4:])
+    with pytest.raises(ValueError):
+        codec.decode_sector(data[:codec._HEADER.size] + zlib.compress(b"x")[:-3])
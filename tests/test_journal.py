@@ -0,0 +1,145 @@
+import pytest
+
+import journal
+from journal import Journal, encode_records, read_journal
+from region import RegionStore
+from sector_io import SectorIO
+from world import World, sectorize
+
+SIZE = 48
+SEED = 88960
+
+
+def _open(path, mode="delta", io=False, compact_size=1 << 20):
+    """ Returns (store, journal, model) for the world saved in `path`, with
+    the journal attached. Its thread only writes when told to.
+    """
+    store = RegionStore(path, mode)
+    log = Journal(store, interval=3600, compact_size=compact_size)
+    model = World(SIZE, 1, SEED, store)
+    if io:
+        model.io = SectorIO(store)
+    log.attach(model)
+    return store, log, model
+
+
+def _crash(store, log, model):
+    """ Drop the world without saving or closing the journal.
+    """
+    log._stop.set()
+    log._thread.join()
+    log._file.close()
+    if model.io is not None:
+        model.io.executor.shutdown(wait=True)
+    store.close()
+
+
+def _above(model, x, z):
+    return (x, max(y for px, y, pz in model.world if (px, pz) == (x, z)) + 1, z)
+
+
+def _loaded(model, blocks):
+    """ Returns `model` with the sectors of every position in `blocks` read.
+    """
+    for sector in set(sectorize(position) for position in blocks):
+        model.load_sector(sector)
+    return model
+
+
+def test_records_round_trip(tmp_path):
+    edits = [((1, 2, 3), "stone", 0), ((-4, 70, 9), None, 0), ((5, 6, 7), "oak_log", 2)]
+    path = str(tmp_path / "journal.log")
+    with open(path, "wb") as f:
+        f.write(journal._HEADER.pack(journal.MAGIC, journal.VERSION))
+        f.write(encode_records(edits))
+        # A record cut short by a crash.
+        f.write(encode_records([((8, 8, 8), "bricks", 0)])[:-2])
+    assert read_journal(path) == edits
+    assert read_journal(str(tmp_path / "missing.log")) == []
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "journal.log"
+    path.write_bytes(b"JUNK\x01")
+    with pytest.raises(ValueError):
+        read_journal(str(path))
+
+
+@pytest.mark.parametrize("mode", ["full", "delta"])
+def test_replay_after_crash(tmp_path, mode):
+    path = str(tmp_path / "world")
+    store, log, model = _open(path, mode)
+    model.save()
+    placed = _above(model, 10, 10)
+    model.add_block(placed, "bricks")
+    dug = _above(model, 30, 30)
+    dug = (dug[0], dug[1] - 1, dug[2])
+    model.remove_block(dug)
+    log.flush()
+    expected = dict(model.world)
+    # Recorded but never written: lost with the crash.
+    lost = _above(model, 40, 40)
+    model.add_block(lost, "stone")
+    _crash(store, log, model)
+
+    store, log, model = _open(path, mode)
+    _loaded(model, expected)
+    assert model.world.get(placed) == "bricks"
+    assert dug not in model.world
+    assert lost not in model.world
+    assert model.world == expected
+    log.close()
+    model.save()
+    log.clear()
+    store.close()
+
+    store = RegionStore(path)
+    assert _loaded(World(store=store), expected).world == expected
+    store.close()
+
+
+@pytest.mark.parametrize("mode", ["full", "delta"])
+def test_compaction_folds_edits(tmp_path, mode):
+    path = str(tmp_path / "world")
+    store, log, model = _open(path, mode, compact_size=1)
+    model.save()
+    placed = [_above(model, x, 12) for x in range(5, 40, 5)]
+    for position in placed:
+        model.add_block(position, "bricks")
+    log.flush()
+    assert log.compact_due
+    log.update()
+    assert log.compactions == 1
+    assert read_journal(log.path) == []
+    expected = dict(model.world)
+    _crash(store, log, model)
+
+    store = RegionStore(path)
+    assert _loaded(World(store=store), expected).world == expected
+    store.close()
+
+
+@pytest.mark.parametrize("mode", ["full", "delta"])
+def test_compaction_keeps_newer_autosave(tmp_path, mode):
+    """ An edit written by a batch, a newer edit of the same block saved by
+    an autosave, then compaction: the newer edit must survive.
+    """
+    path = str(tmp_path / "world")
+    store, log, model = _open(path, mode, io=True, compact_size=1)
+    model.save()
+    position = _above(model, 20, 20)
+    model.add_block(position, "stone")
+    log.flush()
+    model.remove_block(position)
+    model.add_block(position, "bricks")
+    model.save(replayed=False)
+    log.update()
+    log.close()
+    model.save()
+    model.io.close()
+    log.clear()
+    store.close()
+
+    store = RegionStore(path)
+    assert _loaded(World(store=store), [position]).world[position] == "bricks"
+    store.close()
@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+import region
+from region import RegionFile, RegionStore
+from world import World
+
+
+def test_write_reopen_read(tmp_path):
+    path = str(tmp_path / "r.0.0.region")
+    f = RegionFile(path)
+    f.write(0, b"first")
+    f.write(63, b"last" * 100)
+    assert f.read(1) is None
+    f.close()
+    f = RegionFile(path)
+    assert bytes(f.read(0)) == b"first"
+    assert bytes(f.read(63)) == b"last" * 100
+    assert f.indices() == [0, 63]
+    f.close()
+
+
+def test_rewrite_shorter(tmp_path):
+    f = RegionFile(str(tmp_path / "r.0.0.region"))
+    f.write(5, b"a longer payload")
+    f.write(5, b"short")
+    assert bytes(f.read(5)) == b"short"
+    assert f.waste() == len(b"a longer payload")
+    f.close()
+
+
+def test_interrupted_write_keeps_old_copy(tmp_path, monkeypatch):
+    path = str(tmp_path / "r.0.0.region")
+    f = RegionFile(path)
+    f.write(7, b"saved")
+
+    def crash(fd):
+        raise OSError("power lost")
+
+    monkeypatch.setattr(region.os, "fsync", crash)
+    with pytest.raises(OSError):
+        f.write(7, b"never finished")
+    monkeypatch.undo()
+    f.file.close()
+    f = RegionFile(path)
+    assert bytes(f.read(7)) == b"saved"
+    f.close()
+
+
+def test_compact(tmp_path):
+    path = str(tmp_path / "r.0.0.region")
+    f = RegionFile(path)
+    for i in range(10):
+        f.write(i % 3, bytes([i]) * (100 + i))
+    f.compact()
+    assert f.waste() == 0
+    assert not os.path.exists(path + ".tmp")
+    assert [bytes(f.read(i)) for i in range(3)] == [
+        bytes([9]) * 109, bytes([7]) * 107, bytes([8]) * 108]
+    f.write(1, b"after")
+    f.close()
+    f = RegionFile(path)
+    assert bytes(f.read(1)) == b"after"
+    assert bytes(f.read(2)) == bytes([8]) * 108
+    f.close()
+
+
+def test_not_a_region_file(tmp_path):
+    path = tmp_path / "r.0.0.region"
+    path.write_bytes(b"JUNK" + b"\0" * 1000)
+    with pytest.raises(ValueError):
+        RegionFile(str(path))
+
+
+def test_store_round_trip(tmp_path):
+    path = str(tmp_path / "world")
+    store = RegionStore(path, "full")
+    model = World(48, 1, 88960, store)
+    top = max(y for x, y, z in model.world if (x, z) == (10, 10))
+    model.add_block((10, top + 1, 10), "bricks")
+    model.remove_block(max(p for p in model.world if (p[0], p[2]) == (12, 12)))
+    model.save()
+    store.close()
+
+    store = RegionStore(path, "delta")
+    assert store.mode == "full"
+    assert store.has_sectors()
+    reopened = World(store=store)
+    assert (reopened.n, reopened.s, reopened.seed) == (48, 1, 88960)
+    assert reopened.generator is None
+    for sector in model.sectors:
+        reopened.load_sector(sector)
+    assert reopened.world == model.world
+    assert all(reopened.rots[p] == model.rots[p] % 4 for p in model.world)
+    store.close()
+
+
+def test_store_compacts_on_flush(tmp_path):
+    store = RegionStore(str(tmp_path / "world"), "full")
+    model = World(48, 1, 88960, store)
+    model.save()
+    sector = (0, 0, 0)
+    for _ in range(3):
+        store.write(sector, store.encode(model, sector))
+    store.flush()
+    f = store.regions[(0, 0)]
+    assert f.waste() <= os.path.getsize(f.path) // 2
+    assert sorted(store.load(sector)) == sorted(
+        (p, model.world[p], model.rots[p] % 4) for p in model.sectors[sector])
+    store.close()
@@ -0,0 +1,107 @@
+import os
+
+import pytest
+
+import world
+from region import RegionStore
+from world import World, AIR
+
+SIZE = 48
+SEED = 88960
+
+
+def _top(model, x, z):
+    return max(p for p in model.world if (p[0], p[2]) == (x, z))
+
+
+def _reopen(path, spawn=None):
+    store = RegionStore(path)
+    model = World(store=store, spawn=spawn)
+    return store, model
+
+
+def _load_all(model):
+    for sector in list(model.sectors):
+        model.load_sector(sector)
+    return model
+
+
+def test_delta_round_trip(tmp_path):
+    path = str(tmp_path / "world")
+    store = RegionStore(path, "delta")
+    model = World(SIZE, 1, SEED, store)
+    top = _top(model, 10, 10)
+    model.add_block((10, top[1] + 1, 10), "bricks")
+    model.remove_block(_top(model, 20, 20))
+    # Changed and changed back: no difference left to save.
+    restored = _top(model, 30, 30)
+    bid = model.world[restored]
+    model.remove_block(restored)
+    model.add_block(restored, bid, turn=model.rots.get(restored, 0))
+    model.save()
+    store.close()
+
+    store, reopened = _reopen(path)
+    assert store.mode == "delta"
+    assert _load_all(reopened).world == model.world
+    diff = [block for sector in reopened.sectors for block in store.load(sector) or ()]
+    assert sorted(diff) == sorted([((10, top[1] + 1, 10), "bricks", 0),
+                                   (_top(World(SIZE, 1, SEED), 20, 20), AIR, 0)])
+    store.close()
+
+
+def test_delta_save_is_small(tmp_path):
+    sizes = {}
+    for mode in ("full", "delta"):
+        path = str(tmp_path / mode)
+        store = RegionStore(path, mode)
+        model = World(SIZE, 1, SEED, store)
+        model.add_block((10, _top(model, 10, 10)[1] + 1, 10), "bricks")
+        model.save()
+        store.close()
+        sizes[mode] = sum(os.path.getsize(os.path.join(path, name))
+                          for name in os.listdir(path) if name.endswith(".region"))
+    assert sizes["delta"] * 10 < sizes["full"]
+
+
+def test_delta_needs_same_generator(tmp_path, monkeypatch):
+    path = str(tmp_path / "world")
+    store = RegionStore(path, "delta")
+    World(SIZE, 1, SEED, store).save()
+    store.close()
+    monkeypatch.setattr(world, "GENERATOR_VERSION", world.GENERATOR_VERSION + 1)
+    with pytest.raises(ValueError):
+        _reopen(path)
+
+
+@pytest.mark.parametrize("spawn", [None, (10, 80, 10)])
+def test_full_save_resumes_generation(tmp_path, spawn):
+    """ A "full" world saved part way through progressive generation is
+    generated the rest of the way when reopened.
+    """
+    path = str(tmp_path / "world")
+    store = RegionStore(path, "full")
+    model = World(96, 1, SEED, store, spawn=(10, 80, 10))
+    while len(model.generated) < 3:
+        model.generate(0.01)
+    assert model.generator is not None
+    model.save()
+    store.close()
+
+    store, reopened = _reopen(path, spawn)
+    assert reopened.generator is not None or spawn is None
+    reopened.generate()
+    expected = World(96, 1, SEED)
+    for sector in expected.sectors:
+        reopened.load_sector(sector)
+    assert reopened.world == expected.world
+    assert reopened.rots == expected.rots
+    reopened.save()
+    store.close()
+
+    store, complete = _reopen(path)
+    assert complete.generator is None
+    for sector in expected.sectors:
+        complete.load_sector(sector)
+    assert complete.world == expected.world
+    store.close()
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import net
+import server
+from client import GameClient
+from world import World
+
+SIZE = 48
+SEED = 88960
+
+
+def _wait(condition, timeout=10.0):
+    """ Wait until `condition()` is true, failing after `timeout` seconds.
+    """
+    end = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < end, "timed out"
+        time.sleep(0.01)
+
+
+def _top(model, x, z):
+    return max(y for y in range(256) if (x, y, z) in model.world)
+
+
+@pytest.fixture
+def game():
+    """ A `server.GameServer` listening on a loopback port, its event loop
+    running on a background thread, and a function connecting a
+    `client.GameClient` to it. Yields (server, join), with join() returning
+    (client, model).
+    """
+    game = server.GameServer(World(SIZE, 1, SEED))
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    listener = asyncio.run_coroutine_threadsafe(
+        game.serve("127.0.0.1", 0), loop).result(10)
+    port = listener.sockets[0].getsockname()[1]
+    clients = []
+
+    def join():
+        client = GameClient("127.0.0.1", port)
+        n, s, seed, _ = client.connect()
+        clients.append(client)
+        _wait(lambda: len(game.clients) == len(clients))
+        model = World(n, s, seed)
+        model.simulated = False
+        return client, model
+
+    yield game, join
+    for client in clients:
+        client.close()
+    _wait(lambda: not game.clients)
+    loop.call_soon_threadsafe(listener.close)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(10)
+    loop.close()
+
+
+def _synced(client, model, game):
+    client.apply(model)
+    return model.world == game.model.world
+
+
+def test_edits_reach_every_client(game):
+    game, join = game
+    a, model_a = join()
+    b, model_b = join()
+    top = _top(game.model, 20, 20)
+    a.place((20, top, 20), (20, top + 1, 20), "stone", (0, 0))
+    other = _top(game.model, 21, 20)
+    b.dig((21, other, 20))
+    _wait(lambda: game.edits_applied == 2)
+    assert game.model.world[(20, top + 1, 20)] == "stone"
+    assert (21, other, 20) not in game.model.world
+    _wait(lambda: _synced(a, model_a, game))
+    _wait(lambda: _synced(b, model_b, game))
+
+
+def test_late_client_catches_up(game):
+    game, join = game
+    a, _ = join()
+    for x in range(10, 30):
+        top = _top(game.model, x, 10)
+        a.place((x, top, 10), (x, top + 1, 10), "bricks", (0, 0))
+    _wait(lambda: game.edits_applied == 20)
+    c, model_c = join()
+    _wait(lambda: _synced(c, model_c, game))
+
+
+def test_late_client_catches_up_with_whole_sectors(game, monkeypatch):
+    game, join = game
+    a, _ = join()
+    for x in range(10, 30):
+        top = _top(game.model, x, 10)
+        a.place((x, top, 10), (x, top + 1, 10), "bricks", (0, 0))
+    _wait(lambda: game.edits_applied == 20)
+    monkeypatch.setattr(net, "DELTA_SIZE", 1000)
+    c, model_c = join()
+    _wait(lambda: _synced(c, model_c, game))
+
+
+def test_rejects_unknown_blocks_and_rotations(game):
+    game, join = game
+    a, _ = join()
+    top = _top(game.model, 30, 30)
+    before = dict(game.model.world)
+    a.place((30, top, 30), (30, top + 1, 30), "zzz", (0, 0))
+    a.place((30, top, 30), (30, top + 1, 30), "stone", (float("nan"), 0))
+    a.place((30, top, 30), (30, top + 1, 30), "stone", (float("inf"), 0))
+    _wait(lambda: game.edits_applied == 3)
+    assert game.model.world == before
+    a.place((30, top, 30), (30, top + 1, 30), "stone", (0, 0))
+    _wait(lambda: game.edits_applied == 4)
+    assert game.model.world[(30, top + 1, 30)] == "stone"
+
+
+def test_benchmark():
+    result = asyncio.run(server.benchmark(server.GameServer(World(SIZE, 1, SEED)),
+                                          clients=2, edits=40))
+    assert result["edits"] == 40
+    assert result["bytes_down_per_client"] > 0
@@ -0,0 +1,188 @@
+from __future__ import division
+
+import heapq
+import random
+import time
+
+from blocks import FLUID, GROUPCULL, PLANTEE, PLANTER, SEETHR, THRU
+from fluids import FLOW_DELAY
+
+# Block updates, driven by changes rather than by scanning the world.
+#
+# Every block added or removed schedules an update of itself and its six
+# neighbours UPDATE_DELAY ticks later, or the flow delay of the fluid there
+# (see `fluids`). Updates re-check the rules of the block: fluids flow,
+# plants drop when nothing they can grow on is under them, grass
+# covered by an opaque block and bare dirt next to grass become "active".
+# Active blocks get random ticks, on average every RANDOM_TICK_INTERVAL
+# ticks each, which turn covered grass into dirt and spread grass onto dirt;
+# a block stops being active once its rule no longer applies.
+#
+# Ticks are counted at `world.TICKS_PER_SEC`.
+
+UPDATE_DELAY = 1
+RANDOM_TICK_INTERVAL = 1200
+
+
+def _covered(world, position):
+    x, y, z = position
+    above = world.get((x, y + 1, z))
+    return (above is not None and above not in SEETHR and above not in THRU
+            and above not in GROUPCULL)
+
+
+def _near_grass(world, position):
+    x, y, z = position
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                if world.get((x + dx, y + dy, z + dz)) == "grass":
+                    return True
+    return False
+
+
+class Scheduler(object):
+    """ The block updates of a `world.World`. It listens to the world's
+    changes and does its work from `tick()`, which `World.tick()` calls.
+    """
+
+    def __init__(self, model, seed=None):
+        self.model = model
+        self.rng = random.Random(seed)
+
+        # Heap of (tick, order, position) of scheduled updates, and the tick
+        # each position is scheduled for, so it is only queued once.
+        self.scheduled = []
+        self._due = {}
+        self._order = 0
+        self.ticks = 0
+
+        # Mapping from sector to the list of active positions in it, and
+        # from active position to its index in that list.
+        self.active = {}
+        self._index = {}
+
+        # Updates and random ticks run by the last tick, and in total.
+        self.last_updates = 0
+        self.last_random = 0
+        self.updates = 0
+        self.random_ticks = 0
+
+        model.listeners.append(self._on_change)
+
+    def _sector(self, position):
+        # Same as `world.sectorize()`; `world` imports this module.
+        size = self.model.mask.size
+        return (position[0] // size, 0, position[2] // size)
+
+    def _on_change(self, position, bid):
+        if not self.model.simulated:
+            return
+        world = self.model.world
+        x, y, z = position
+        for dx, dy, dz in ((0, 0, 0), (0, 1, 0), (0, -1, 0), (-1, 0, 0), (1, 0, 0), (0, 0, 1), (0, 0, -1)):
+            other = (x + dx, y + dy, z + dz)
+            source = FLUID.get(world.get(other))
+            self.schedule(other, FLOW_DELAY[source] if source else UPDATE_DELAY)
+
+    def schedule(self, position, delay=UPDATE_DELAY):
+        """ Update the block at `position` after `delay` ticks, unless it is
+        already scheduled.
+        """
+        if position in self._due:
+            return
+        due = self._due[position] = self.ticks + delay
+        self._order += 1
+        heapq.heappush(self.scheduled, (due, self._order, position))
+
+    def activate(self, position):
+        """ Give the block at `position` random ticks.
+        """
+        if position in self._index:
+            return
+        positions = self.active.setdefault(self._sector(position), [])
+        self._index[position] = len(positions)
+        positions.append(position)
+
+    def deactivate(self, position):
+        """ Stop the random ticks of the block at `position`.
+        """
+        index = self._index.pop(position, None)
+        if index is None:
+            return
+        sector = self._sector(position)
+        positions = self.active[sector]
+        last = positions.pop()
+        if last != position:
+            positions[index] = last
+            self._index[last] = index
+        if not positions:
+            del self.active[sector]
+
+    def update(self, position):
+        """ Re-check the rules of the block at `position`.
+        """
+        world = self.model.world
+        bid = world.get(position)
+        if bid is None:
+            self.deactivate(position)
+        elif bid in FLUID:
+            self.model.fluids.update(position)
+        elif bid in PLANTEE:
+            x, y, z = position
+            if world.get((x, y - 1, z)) not in PLANTER:
+                self.model.remove_block(position)
+        elif bid == "grass" and _covered(world, position):
+            self.activate(position)
+        elif bid == "dirt" and not _covered(world, position) and _near_grass(world, position):
+            self.activate(position)
+
+    def random_tick(self, position):
+        """ Apply the slow changes of the active block at `position`.
+        """
+        world = self.model.world
+        bid = world.get(position)
+        if bid == "grass" and _covered(world, position):
+            self.deactivate(position)
+            self.model.add_block(position, "dirt")
+        elif bid == "dirt" and not _covered(world, position) and _near_grass(world, position):
+            self.deactivate(position)
+            self.model.add_block(position, "grass")
+        else:
+            self.deactivate(position)
+
+    def tick(self, budget=None):
+        """ Advance one tick: run the updates that are due, then the random
+        ticks, stopping after `budget` seconds, if given. Updates left over
+        run first on the next tick.
+        """
+        self.ticks += 1
+        start = time.process_time()
+        updates = 0
+        while self.scheduled and self.scheduled[0][0] <= self.ticks:
+            if budget is not None and time.process_time() - start > budget:
+                break
+            position = heapq.heappop(self.scheduled)[2]
+            del self._due[position]
+            self.update(position)
+            updates += 1
+        hits = []
+        rate = 1.0 / RANDOM_TICK_INTERVAL
+        for positions in self.active.values():
+            # Each active block is ticked with the same chance, whatever the
+            # number of blocks in its sector.
+            expected = len(positions) * rate
+            count = int(expected) + (self.rng.random() < expected % 1)
+            for _ in range(count):
+                hits.append(self.rng.choice(positions))
+        random_ticks = 0
+        for position in hits:
+            if budget is not None and time.process_time() - start > budget:
+                break
+            if position in self._index:
+                self.random_tick(position)
+                random_ticks += 1
+        self.last_updates = updates
+        self.last_random = random_ticks
+        self.updates += updates
+        self.random_ticks += random_ticks
@@ -0,0 +1,220 @@
+from __future__ import division
+
+import time
+
+from collections import deque
+
+from lighting import clear
+
+# Which sections can be seen from where, for culling what is hidden behind
+# hills and inside caves.
+#
+# A section is the cube of a sector one sector high. For every section the
+# faces that connect to each other through blocks light passes through are
+# found by flood fill, so a section can be walked through from one face to
+# another only if there is a way through it. The cells of a section are the
+# bits of one int laid out like the `world.OccupancyMask` bits, so the fill
+# grows a whole region by a block in every direction with a few shifts.
+#
+# `visible()` walks the sections outwards from the eye's, crossing a face
+# only where the section was entered through a face connected to it and
+# never back towards the eye, as a line of sight could not either.
+
+# Directions of the faces of a section; face f is opposite face f ^ 1.
+FACES = ((-1, 0, 0), (1, 0, 0), (0, -1, 0), (0, 1, 0), (0, 0, -1), (0, 0, 1))
+
+# Bitmask of all the faces.
+ALL = (1 << len(FACES)) - 1
+
+
+class Visibility(object):
+    """ The connections between the faces of the sections of a
+    `world.World`, which calls `update()` after every block it adds or
+    removes and `invalidate()` when it places many blocks at once.
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+        # Mapping from section to the int with a bit set for each of its
+        # cells light passes through.
+        self.open = {}
+
+        # Mapping from section to the bitmask of the faces each of its faces
+        # connects to.
+        self.connections = {}
+
+        # Incremented whenever connections may have changed, so walks can be
+        # cached until then.
+        self.version = 0
+
+        # Whether the last walk knew the connections of every section it
+        # crossed, rather than running out of time to compute some.
+        self.complete = True
+
+        # Section size the masks in `_layout` were made for, and the masks.
+        self._size = None
+        self._layout = None
+
+    def section(self, position):
+        """ Returns the section containing block `position`.
+        """
+        size = self.model.mask.size
+        x, y, z = position
+        return (x // size, y // size, z // size)
+
+    def _masks(self):
+        size = self.model.mask.size
+        if size == self._size:
+            return self._layout
+        area = size * size
+        full = (1 << (area * size)) - 1
+        low_x = sum(1 << (row * size) for row in range(area))
+        high_x = low_x << (size - 1)
+        low_z = sum(1 << (y * area + x) for y in range(size) for x in range(size))
+        high_z = low_z << (area - size)
+        low_y = (1 << area) - 1
+        high_y = low_y << (area * (size - 1))
+        faces = (low_x, high_x, low_y, high_y, low_z, high_z)
+        self._size = size
+        self._layout = (full, faces, full & ~low_x, full & ~high_x,
+                        full & ~low_z, full & ~high_z)
+        return self._layout
+
+    def _sections(self):
+        mask = self.model.mask
+        return (mask.height - 1) // mask.size + 1
+
+    def invalidate(self, sector):
+        """ Forget the sections of `sector`, to be computed again from its
+        blocks when next asked for.
+        """
+        x, _, z = sector
+        for y in range(self._sections()):
+            self.open.pop((x, y, z), None)
+            self.connections.pop((x, y, z), None)
+        self.version += 1
+
+    def update(self, position):
+        """ Update the section of `position` after its block changed.
+        """
+        section = self.section(position)
+        cells = self.open.get(section)
+        if cells is None:
+            # Computed from the world when first asked for.
+            return
+        size = self.model.mask.size
+        x, y, z = position
+        bit = 1 << ((y % size * size + z % size) * size + x % size)
+        if clear(self.model.world.get(position)):
+            cells |= bit
+        else:
+            cells &= ~bit
+        self.open[section] = cells
+        self.connections.pop(section, None)
+        self.version += 1
+
+    def _compute(self, sector):
+        mask = self.model.mask
+        size = mask.size
+        cube = size * size * size
+        full = self._masks()[0]
+        # Every cell with no block, then those whose block light passes
+        # through.
+        occupied = int.from_bytes(bytes(mask.occupied.get(sector, b"")), "little")
+        cells = [full & ~(occupied >> (y * cube)) for y in range(self._sections())]
+        world = self.model.world
+        opaque = {}
+        for position in self.model.sectors.get(sector, ()):
+            bid = world[position]
+            blocks = opaque.get(bid)
+            if blocks is None:
+                blocks = opaque[bid] = not clear(bid)
+            if blocks:
+                continue
+            x, y, z = position
+            if 0 <= y < mask.height:
+                cells[y // size] |= 1 << ((y % size * size + z % size) * size + x % size)
+        x, _, z = sector
+        for y, section in enumerate(cells):
+            self.open[x, y, z] = section
+
+    def connected(self, section):
+        """ Returns, for each face of `section`, the bitmask of the faces it
+        connects to.
+        """
+        connections = self.connections.get(section)
+        if connections is not None:
+            return connections
+        cells = self.open.get(section)
+        if cells is None:
+            self._compute((section[0], 0, section[2]))
+            cells = self.open[section]
+        full, faces, not_low_x, not_high_x, not_low_z, not_high_z = self._masks()
+        size = self.model.mask.size
+        area = size * size
+        if cells == full:
+            connections = [ALL] * len(FACES)
+        else:
+            connections = [0] * len(FACES)
+            filled = 0
+            for face_cells in faces:
+                remaining = cells & face_cells & ~filled
+                while remaining:
+                    region = remaining & -remaining
+                    while True:
+                        grown = (region | region << 1 & not_low_x | region >> 1 & not_high_x |
+                                 region << size & not_low_z | region >> size & not_high_z |
+                                 region << area | region >> area) & cells
+                        if grown == region:
+                            break
+                        region = grown
+                    touched = 0
+                    for face, other in enumerate(faces):
+                        if region & other:
+                            touched |= 1 << face
+                    for face in range(len(FACES)):
+                        if touched >> face & 1:
+                            connections[face] |= touched
+                    filled |= region
+                    remaining &= ~region
+        self.connections[section] = connections
+        return connections
+
+    def visible(self, section, radius, budget=None):
+        """ Returns the sections that may be seen from `section`, no more
+        than `radius` sections away sideways, nearest first. Sections whose
+        connections are not computed after `budget` seconds, if given, are
+        taken to connect every face, and `complete` is cleared.
+        """
+        start_time = time.process_time()
+        self.complete = True
+        top = self._sections() - 1
+        sx, sy, sz = section
+        start = (sx, min(max(sy, 0), top), sz)
+        seen = set([start])
+        result = [start]
+        queue = deque([(start, None, 0)])
+        while queue:
+            current, entry, moved = queue.popleft()
+            if entry is None:
+                exits = ALL
+            elif (current not in self.open and budget is not None and
+                    time.process_time() - start_time > budget):
+                exits = ALL
+                self.complete = False
+            else:
+                exits = self.connected(current)[entry]
+            x, y, z = current
+            for face, (dx, dy, dz) in enumerate(FACES):
+                if not exits >> face & 1 or moved >> (face ^ 1) & 1:
+                    continue
+                other = (x + dx, y + dy, z + dz)
+                if other in seen or not 0 <= other[1] <= top:
+                    continue
+                if (other[0] - sx) ** 2 + (other[2] - sz) ** 2 > radius ** 2:
+                    continue
+                seen.add(other)
+                result.append(other)
+                queue.append((other, face ^ 1, moved | 1 << face))
+        return result
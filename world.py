@@ -0,0 +1,1348 @@
+from __future__ import division
+
+import random
+import sys
+import time
+
+from collections import deque
+from contextlib import contextmanager
+
+from blocks import *
+from explosion import Explosions
+from fluids import Fluids
+from lighting import Lighting
+from noise_gen import NoiseGen
+from ticks import Scheduler
+from visibility import Visibility
+
+TICKS_PER_SEC = 60
+
+# Frame time counted towards ticks, by `World.advance()` and the player's
+# physics, is clamped to MAX_FRAME_TIME per frame so a stall can't queue an
+# unbounded number of catch-up ticks.
+MAX_FRAME_TIME = 0.25
+
+# Seconds of work `World.process_queue()` does per frame, shared by ticks,
+# generation, loading sectors and showing blocks, in that order. Ticks and
+# generation each take at most their share of it, so the rest always has
+# time left.
+FRAME_BUDGET = 1.0 / TICKS_PER_SEC
+TICK_SHARE = 0.25
+GENERATE_SHARE = 0.25
+
+# Height of the world covered by the per-sector collision bitmasks.
+WORLD_HEIGHT = 256
+
+SECTOR_SIZE = 24 # Size of sectors used to ease block loading.
+
+# Radius, in sectors, of the sectors around the player drawn block by block.
+DETAIL_RADIUS = 4
+
+# Rings of sectors beyond those drawn from their column heights instead, one
+# quad per `step` x `step` columns, as (outer radius in sectors, step). The
+# last step is used out to the render distance.
+LOD_RINGS = ((6, 2), (8, 4))
+
+# Default, least and greatest radius, in sectors, of the sectors drawn.
+RENDER_DISTANCE = 8
+MIN_RENDER_DISTANCE = 2
+MAX_RENDER_DISTANCE = 16
+
+# Version of the terrain generator, saved with worlds. Bump it whenever the
+# generated terrain changes, since "delta" saves rely on regenerating the
+# same terrain.
+GENERATOR_VERSION = 2
+
+# Block name stored in "delta" saves for a generated block that was removed.
+AIR = "air"
+
+if sys.version_info[0] >= 3:
+    xrange = range
+
+
+FACES = [
+    ( 0, 1, 0), #top
+    ( 0,-1, 0), #bottom
+    (-1, 0, 0), #left
+    ( 1, 0, 0), #right
+    ( 0, 0, 1), #front
+    ( 0, 0,-1), #back
+]
+
+
+def normalize(position):
+    """ Accepts `position` of arbitrary precision and returns the block
+    containing that position.
+    Parameters
+    ----------
+    position : tuple of len 3
+    Returns
+    -------
+    block_position : tuple of ints of len 3
+    """
+    x, y, z = position
+    x, y, z = (int(round(x)), int(round(y)), int(round(z)))
+    return (x, y, z)
+
+
+def sectorize(position):
+    """ Returns a tuple representing the sector for the given `position`.
+    Parameters
+    ----------
+    position : tuple of len 3
+    Returns
+    -------
+    sector : tuple of len 3
+    """
+    x, y, z = normalize(position)
+    x, y, z = x // SECTOR_SIZE, y // SECTOR_SIZE, z // SECTOR_SIZE
+    return (x, 0, z)
+
+
+def sectionize(position):
+    """ Returns a tuple representing the section, the cube of its sector one
+    sector high, for the given `position`.
+    Parameters
+    ----------
+    position : tuple of len 3
+    Returns
+    -------
+    section : tuple of len 3
+    """
+    x, y, z = normalize(position)
+    return (x // SECTOR_SIZE, y // SECTOR_SIZE, z // SECTOR_SIZE)
+
+
+def _column_hash(seed, x, z, salt=0):
+    """ Returns a 32 bit hash of a world seed and column, used to seed the
+    random numbers of each column.
+    """
+    h = (seed * 83492791) ^ (x * 73856093) ^ (z * 19349663) ^ (salt * 2654435761)
+    h = ((h ^ (h >> 16)) * 0x45d9f3b) & 0xFFFFFFFF
+    h = ((h ^ (h >> 16)) * 0x45d9f3b) & 0xFFFFFFFF
+    return h ^ (h >> 16)
+
+
+def _precedence(bid):
+    """ Rank of generated blocks that may overlap: terrain over logs over
+    leaves over plants, and leaves by name.
+    """
+    if bid.endswith("_log"):
+        return (2, "")
+    if bid.endswith("_leaves"):
+        return (1, bid)
+    if bid in PLANTEE or bid == "pumpkin":
+        return (0, "")
+    return (3, "")
+
+
+class OccupancyMask(object):
+    """ Per-sector bitmasks of which positions hold a block (`occupied`) and
+    which of those blocks the player collides with (`solid`). Kept in step
+    with `Model.add_block()` and `Model.remove_block()` so collision and
+    picking can test a bit instead of hashing into `Model.world`.
+
+    Bits are laid out as ((y * size) + lz) * size + lx for 0 <= y < height.
+    Blocks outside that height range are rare and are kept in sets instead.
+    """
+
+    def __init__(self, sector_size, height=WORLD_HEIGHT):
+        self.size = sector_size
+        self.height = height
+        # Mapping from sector to a bytearray of occupied / solid bits.
+        self.occupied = {}
+        self.solid = {}
+        # Positions outside the bitmask height range.
+        self.occupied_overflow = set()
+        self.solid_overflow = set()
+
+    def add(self, position, solid):
+        """ Mark `position` as holding a block, solid or not.
+        """
+        x, y, z = position
+        if not 0 <= y < self.height:
+            self.occupied_overflow.add(position)
+            if solid:
+                self.solid_overflow.add(position)
+            else:
+                self.solid_overflow.discard(position)
+            return
+        size = self.size
+        sector = (x // size, 0, z // size)
+        occupied = self.occupied.get(sector)
+        if occupied is None:
+            nbytes = (size * size * self.height + 7) >> 3
+            occupied = self.occupied[sector] = bytearray(nbytes)
+            self.solid[sector] = bytearray(nbytes)
+        i = (y * size + z % size) * size + x % size
+        bit = 1 << (i & 7)
+        occupied[i >> 3] |= bit
+        if solid:
+            self.solid[sector][i >> 3] |= bit
+        else:
+            self.solid[sector][i >> 3] &= ~bit
+
+    def remove(self, position):
+        """ Mark `position` as empty.
+        """
+        x, y, z = position
+        if not 0 <= y < self.height:
+            self.occupied_overflow.discard(position)
+            self.solid_overflow.discard(position)
+            return
+        size = self.size
+        sector = (x // size, 0, z // size)
+        occupied = self.occupied.get(sector)
+        if occupied is None:
+            return
+        i = (y * size + z % size) * size + x % size
+        bit = ~(1 << (i & 7))
+        occupied[i >> 3] &= bit
+        self.solid[sector][i >> 3] &= bit
+
+    def is_occupied(self, x, y, z):
+        """ Returns True if there is a block of any kind at x, y, z.
+        """
+        if not 0 <= y < self.height:
+            return (x, y, z) in self.occupied_overflow
+        size = self.size
+        bits = self.occupied.get((x // size, 0, z // size))
+        if bits is None:
+            return False
+        i = (y * size + z % size) * size + x % size
+        return bits[i >> 3] >> (i & 7) & 1 == 1
+
+    def is_solid(self, x, y, z):
+        """ Returns True if there is a block at x, y, z that the player
+        collides with.
+        """
+        if not 0 <= y < self.height:
+            return (x, y, z) in self.solid_overflow
+        size = self.size
+        bits = self.solid.get((x // size, 0, z // size))
+        if bits is None:
+            return False
+        i = (y * size + z % size) * size + x % size
+        return bits[i >> 3] >> (i & 7) & 1 == 1
+
+class World(object):
+    """ The block world: storage, terrain generation, picking and the
+    bookkeeping of which blocks are shown. It has no dependency on pyglet or
+    OpenGL, so it can run headless; `minecraft.Model` subclasses it and
+    implements `_show_block_typed()` and `_hide_block()` to draw.
+    """
+
+    def __init__(self, n=512, s=1, seed=88960, store=None, spawn=None, heights=None):
+
+        # World size, generation step size and seed used by `_initialize()`.
+        self.n = n
+        self.s = s
+        self.seed = seed
+
+        # The `region.RegionStore` the world is saved to, or None. A saved
+        # world takes its parameters from the store. In "full" mode it is not
+        # generated and its sectors are loaded as they come into view; in
+        # "delta" mode the terrain is generated and the per-sector
+        # differences from it are applied as sectors come into view.
+        self.store = store
+        delta = store is not None and store.mode == "delta"
+        saved = False
+        resumed = ()
+        if store is not None and store.level is not None:
+            if store.level["sector_size"] != SECTOR_SIZE:
+                raise ValueError("%s was saved with sector size %d, not %d" % (
+                    store.path, store.level["sector_size"], SECTOR_SIZE))
+            self.n = store.level["n"]
+            self.s = store.level["s"]
+            self.seed = store.level["seed"]
+            if not delta and store.has_sectors():
+                # Saved before generation was complete, with the sectors
+                # generated so far; see `save()`.
+                resumed = store.level.get("generated", True)
+                saved = resumed is True
+            version = store.level.get("generator", 1)
+            if delta and version != GENERATOR_VERSION:
+                raise ValueError("%s was generated by terrain generator %d, not %d" % (
+                    store.path, version, GENERATOR_VERSION))
+
+        # Sectors read from `store`, or found not to be in it.
+        self.loaded = set()
+
+        # A `sector_io.SectorIO` to read and write `store` on a thread pool,
+        # or None to use it directly.
+        self.io = None
+
+        # Sectors in view waiting for their own or a neighbour's blocks to be
+        # read before they are shown.
+        self.waiting = set()
+
+        # Mapping from sector to the step of the simplified mesh it is drawn
+        # with, for the sectors in the `LOD_RINGS`, and the same for those
+        # waiting for their blocks to be read first.
+        self.far = {}
+        self.far_waiting = {}
+
+        # Radius, in sectors, of the sectors drawn around `center`, the
+        # sector of the player; see `set_render_distance()`.
+        self.render_distance = RENDER_DISTANCE
+        self.center = None
+
+        # Sectors changed since the last `save()`.
+        self.dirty = set()
+
+        # Mapping from sector to edits from an earlier session, replayed on
+        # top of the stored blocks when the sector loads.
+        self.replay = {}
+
+        # In "delta" mode, mapping from sector to {position: (bid, turn)} of
+        # generated blocks as they were before their first edit, None for
+        # positions that were empty. None when not tracking.
+        self.pristine = None
+
+        # A mapping from position to the texture of the block at that position.
+        # This defines all the blocks that are currently in the world.
+        self.world = {}
+
+        # Rotation
+        self.rots = {}
+
+        # Same mapping as `world` but only contains blocks that are shown.
+        self.shown = {}
+
+        # Mapping from sector to the set of positions inside that sector.
+        self.sectors = {}
+
+        # Occupied / solid bits for every block in `world`, used by collision
+        # and picking.
+        self.mask = OccupancyMask(SECTOR_SIZE)
+
+        # Simple function queue implementation. The queue is populated with
+        # _show_block() and _hide_block() calls
+        self.queue = deque()
+
+        # Callables invoked as listener(position, bid) after every block is
+        # added, and as listener(position, None) after every block is removed.
+        self.listeners = []
+
+        # Positions edited inside `bulk()`, whose visibility is brought up to
+        # date when it ends, or None outside of it.
+        self.touched = None
+
+        # TNT going off, and primed to go off, in this world.
+        self.explosions = Explosions(self)
+
+        # Flowing water and lava, stepped by `updates`.
+        self.fluids = Fluids(self)
+
+        # Updates of blocks around the blocks that change.
+        self.updates = Scheduler(self)
+
+        # Frame time not yet consumed by ticks; see `advance()`.
+        self.tick_time = 0.0
+
+        # Whether blocks update and TNT goes off in this world. Cleared for
+        # a client's copy of a server's world, which only changes as the
+        # server says; see `client.GameClient`.
+        self.simulated = True
+
+        # Sky and block light, baked into the meshes by renderers.
+        self.light = Lighting(self)
+
+        # Which sections can be seen through which, for renderers to cull.
+        self.visibility = Visibility(self)
+
+        # Sectors whose columns have all been generated.
+        self.generated = set()
+
+        # A `heightcache.HeightCache` to read terrain heights from instead of
+        # evaluating the noise, or None.
+        self.heights = heights
+
+        # The generator placing the blocks of the world, or None once it is
+        # complete. With a `spawn` position it is advanced by `generate()`
+        # from `process_queue()`, nearest sectors first; otherwise the world
+        # is generated here. A "full" save made before it was complete
+        # resumes it, leaving the sectors generated already to the store.
+        self.generator = None
+
+        if not saved:
+            if delta:
+                self.pristine = {}
+            self.generated.update((x, 0, z) for x, z in resumed)
+            self.generator = self._generate(spawn or (0, 0, 0))
+            if spawn is None:
+                self._initialize()
+                if not delta and not resumed:
+                    self.loaded.update(self.sectors)
+            if store is not None and store.level is None:
+                store.save_level(self)
+
+    def _initialize(self):
+        """ Initialize the world by placing all the blocks.
+        """
+        for _ in self.generator:
+            pass
+        self.generator = None
+
+    def generate(self, budget=None):
+        """ Continue progressive generation for up to `budget` seconds, or
+        until the world is complete if `budget` is None. Returns True once the
+        world is complete.
+        """
+        if self.generator is None:
+            return True
+        start = time.process_time()
+        for _ in self.generator:
+            if budget is not None and time.process_time() - start > budget:
+                return False
+        self.generator = None
+        return True
+
+    def _generate(self, spawn):
+        """ Generator that places the blocks of the world one column at a
+        time, sector by sector outward from the sector holding `spawn`.
+        Every column draws from its own seeded random numbers and blocks that
+        overlap are resolved by `_place()`, so the result does not depend on
+        the order.
+        """
+        gen = NoiseGen(self.seed)
+        if self.heights is not None:
+            height = self.heights.heights(gen, self.n)
+        else:
+            height = lambda x, z: int(gen.getHeight(x, z))
+        last = (self.n - 1) // SECTOR_SIZE
+        cx, _, cz = sectorize(spawn)
+        cx = min(max(cx, 0), last)
+        cz = min(max(cz, 0), last)
+        for r in xrange(0, last + 1):
+            ring = [(x, 0, z)
+                    for x in xrange(max(cx - r, 0), min(cx + r, last) + 1)
+                    for z in xrange(max(cz - r, 0), min(cz + r, last) + 1)
+                    if max(abs(x - cx), abs(z - cz)) == r]
+            ring.sort(key=lambda sector: (sector[0] - cx) ** 2 + (sector[2] - cz) ** 2)
+            for sector in ring:
+                if sector in self.generated:
+                    continue
+                for _ in self._generate_sector(sector, height):
+                    yield
+                self.generated.add(sector)
+                self._forget(sector)
+                if self.pristine is None:
+                    x, _, z = sector
+                    for dx in xrange(-1, 2):
+                        for dz in xrange(-1, 2):
+                            self.dirty.add((x + dx, 0, z + dz))
+
+    def _generate_sector(self, sector, height):
+        """ Generator that places the columns of `sector` one at a time.
+        """
+        n = self.n
+        s = self.s
+        seed = self.seed
+        sx, _, sz = sector
+        ox, oz = sx * SECTOR_SIZE, sz * SECTOR_SIZE
+        columns_x = xrange(-(-ox // s) * s, min(ox + SECTOR_SIZE, n), s)
+        columns_z = xrange(-(-oz // s) * s, min(oz + SECTOR_SIZE, n), s)
+
+        # Podzol patches cover the 8 x 8 columns around rare centers, which
+        # may lie in a neighbouring sector.
+        podzols = set()
+        for x in xrange(-(-max(ox - 4, 0) // s) * s, min(ox + SECTOR_SIZE + 4, n), s):
+            for z in xrange(-(-max(oz - 4, 0) // s) * s, min(oz + SECTOR_SIZE + 4, n), s):
+                if _column_hash(seed, x, z, 1) % 1000 > 998:
+                    for px in xrange(-4, 4):
+                        for pz in xrange(-4, 4):
+                            podzols.add((x + px, z + pz))
+
+        for x in columns_x:
+            for z in columns_z:
+                self._generate_column(x, z, height(x, z), random.Random(_column_hash(seed, x, z)),
+                                      (x, z) in podzols)
+                yield
+
+    def _generate_column(self, x, z, h, rng, podzol):
+        """ Place the blocks of the column at `x`, `z` with terrain height
+        `h`, and the trees rooted in it.
+        """
+        put = self._put
+        place = self._place
+        stone = set()
+
+        if (h < 33):
+            #water
+            for y in xrange(h, 31):
+                put((x, y, z), "water", rng)
+            #sand
+            put((x, h, z), "sand", rng)
+            for y in xrange(h - 1, 0, -1):
+                if y > h-rng.randrange(2,4):
+                    put((x, y, z), "sand", rng)
+                elif y > h-rng.randrange(3,7):
+                    put((x, y, z), "sandstone", rng)
+                else:
+                    put((x, y, z), "stone", rng)
+                    stone.add(y)
+        else:
+            #grass
+            if podzol:
+                put((x, h, z), "podzol", rng)
+            else:
+                put((x, h, z), "grass", rng)
+            for y in xrange(h - 1, 0, -1):
+                if y > h-rng.randrange(2,6):
+                    put((x, y, z), "dirt", rng)
+                else:
+                    put((x, y, z), "stone", rng)
+                    stone.add(y)
+            #Maybe add tree at this (x, z)
+            if (h > 20):
+                #plants
+                if rng.randrange(0, 1000) > 995:
+                    place((x, h+1, z), "fern", rng)
+                if rng.randrange(0, 1000) > 880:
+                    place((x, h+1, z), "tall_grass", rng)
+                if rng.randrange(0, 1000) > 950:
+                    place((x, h+1, z), "dandelion", rng)
+                if rng.randrange(0, 1000) > 950:
+                    flist = ["poppy", "azure", "orchid", "allium", "cornflower"]
+                    place((x, h+1, z), flist[(x+z)%(len(flist))], rng)
+                if rng.randrange(0, 1000) > 998:
+                    place((x, h+1, z), "pumpkin", rng)
+                if rng.randrange(0, 1000) > 990:
+                    treeHeight = rng.randrange(4, 9)
+                    typs = ["oak","birch","spruce","jungle","acacia","doak"]
+                    typ = typs[rng.randrange(0,5)]
+                    #Tree leaves
+                    leafh = h + treeHeight - 2
+                    leaft = 3
+                    leafw = 3
+                    if typ=="acacia":
+                        treeHeight -= 2
+                        leaft = 1
+                        leafw = 4
+                    for lz in xrange(z + 1 - leafw, z + leafw):
+                        for lx in xrange(x + 1 - leafw, x + leafw):
+                            for ly in xrange(leaft):
+                                place((lx, leafh + ly, lz), (typ+"_leaves"), rng)
+                    #Tree trunk
+                    for y in xrange(h + 1, h + treeHeight):
+                        place((x, y, z), (typ+"_log"), rng)
+        #ores
+        #coal
+        ry = rng.randrange(1,100)
+        rh = rng.randrange(1,8)
+        for gh in xrange(ry, ry+rh, 1):
+            if gh in stone:
+                put((x, gh, z), "coal_ore", rng)
+        #iron
+        if rng.randrange(0, 1000) > 100:
+            ry = rng.randrange(1,100)
+            rh = rng.randrange(1,8)
+            for gh in xrange(ry, ry+rh, 1):
+                if gh in stone:
+                    put((x, gh, z), "iron_ore", rng)
+        #gold
+        if rng.randrange(0, 1000) > 990:
+            ry = rng.randrange(1,20)
+            if ry in stone:
+                put((x, ry, z), "gold_ore", rng)
+        #diamond
+        if rng.randrange(0, 1000) > 997:
+            ry = rng.randrange(1,12)
+            rh = rng.randrange(1,3)
+            for gh in xrange(ry, ry+rh, 1):
+                if gh in stone:
+                    put((x, gh, z), "diamond_ore", rng)
+        #emerald
+        if rng.randrange(0, 1000) > 998:
+            ry = rng.randrange(1,80)
+            if ry in stone:
+                put((x, ry, z), "emerald_ore", rng)
+        #bedrock
+        put((x,0,z), "bedrock", rng)
+        if (x*z)%8<(x+z)%3:
+            put((x,1,z), "bedrock", rng)
+        if (x*z)%6<(x+z*2)%5:
+            put((x,2,z), "bedrock", rng)
+
+    def _put(self, position, bid, rng):
+        """ Place a generated block without reporting it to `listeners`,
+        replacing whatever is there.
+        """
+        if position not in self.world:
+            x, y, z = position
+            self.sectors.setdefault((x // SECTOR_SIZE, 0, z // SECTOR_SIZE), set()).add(position)
+        self.world[position] = bid
+        self.rots[position] = rng.randrange(0, 3) if bid in RYROT else 0
+        self.mask.add(position, bid not in THRU)
+
+    def _place(self, position, bid, rng):
+        """ Place a generated plant or tree block unless a block that takes
+        precedence is there: terrain over logs over leaves over plants, and
+        leaves in name order, whatever order columns are generated in.
+        """
+        bid_below = self.world.get((position[0], position[1] - 1, position[2]))
+        if bid in PLANTEE and bid_below not in PLANTER:
+            return
+        other = self.world.get(position)
+        if other is None or _precedence(bid) >= _precedence(other):
+            self._put(position, bid, rng)
+
+    def generation_progress(self):
+        """ Returns the fraction of sectors generated so far.
+        """
+        if self.generator is None:
+            return 1.0
+        return len(self.generated) / (((self.n - 1) // SECTOR_SIZE + 1) ** 2)
+
+    def generated_around(self, sector):
+        """ Returns True if no more blocks will be generated in `sector`: it
+        and every sector around it with columns in the world are generated.
+        """
+        if self.generator is None:
+            return True
+        last = (self.n - 1) // SECTOR_SIZE
+        x, y, z = sector
+        for dx in xrange(-1, 2):
+            for dz in xrange(-1, 2):
+                if (0 <= x + dx <= last and 0 <= z + dz <= last and
+                        (x + dx, y, z + dz) not in self.generated):
+                    return False
+        return True
+
+    def hit_test(self, position, vector, max_distance=8):
+        """ Line of sight search from current position. If a block is
+        intersected it is returned, along with the block previously in the line
+        of sight. If no block is found, return None, None.
+        Parameters
+        ----------
+        position : tuple of len 3
+            The (x, y, z) position to check visibility from.
+        vector : tuple of len 3
+            The line of sight vector.
+        max_distance : int
+            How many blocks away to search for a hit.
+        """
+        m = 8
+        x, y, z = position
+        dx, dy, dz = vector
+        previous = None
+        is_occupied = self.mask.is_occupied
+        for _ in xrange(max_distance * m):
+            key = normalize((x, y, z))
+            if key != previous and is_occupied(*key):
+                return key, previous
+            previous = key
+            x, y, z = x + dx / m, y + dy / m, z + dz / m
+        return None, None
+
+    def contains(self, position):
+        """ Returns True if `position` is in the columns of the world, 0 to
+        `n` - 1 along x and z, and below the height of `mask`.
+        """
+        x, y, z = position
+        return 0 <= x < self.n and 0 <= z < self.n and 0 <= y < self.mask.height
+
+    def exposed(self, position):
+        """ Returns False is given `position` is surrounded on all 6 sides by
+        blocks, True otherwise.
+        """
+        x, y, z = position
+        for dx, dy, dz in FACES:
+            key = x + dx, y + dy, z + dz
+            if key not in self.world:
+                return True
+            bid = self.world[key]
+            bid = bid.replace("_inv","")
+            if bid in SEETHR:
+                return True
+            if bid in GROUPCULL:
+                if FLUID.get(bid, bid) != FLUID.get(self.world[position], self.world[position]):
+                    return True
+        return False
+
+    def add_block(self, position, bid, immediate=True, rot=(0,0), turn=None):
+        """ Add a block with the given `texture` and `position` to the world.
+        Parameters
+        ----------
+        position : tuple of len 3
+            The (x, y, z) position of the block to add.
+        texture : list of len 3
+            The coordinates of the texture squares. Use `tex_coords()` to
+            generate.
+        immediate : bool
+            Whether or not to draw the block immediately.
+        turn : int or None
+            Quarter turns around y to store for the block, overriding the
+            ones derived from `rot`. Used to replay edits made elsewhere.
+        """
+        x, y, z = position
+
+        rx, ry = rot
+
+        if self.pristine is not None:
+            self._remember(position)
+
+        if turn is not None:
+            self.rots[position] = turn
+        elif bid in YROT:
+            self.rots[position] = round(-rx/90) % 4
+        elif bid in RYROT:
+            self.rots[position] = random.randrange(0,3)
+        else:
+            self.rots[position] = 0
+        
+        if not (bid in PLANTEE and ((x, y-1, z) not in self.world or self.world[x, y-1, z] not in PLANTER)):
+            if position in self.world:
+                self.remove_block(position, immediate)
+            self.world[position] = bid
+            sector = sectorize(position)
+            self.sectors.setdefault(sector, set()).add(position)
+            self.dirty.add(sector)
+            self.mask.add(position, bid not in THRU)
+            self._relight(position, immediate)
+            self.visibility.update(position)
+            self._redraw_far(sector)
+            for listener in self.listeners:
+                listener(position, bid)
+            if immediate and self.touched is not None:
+                self.touched.add(position)
+            elif immediate:
+                if self.exposed(position):
+                    self.show_block(position)
+                #if bid not in SEETHR:
+                self.check_neighbors(position)
+
+    def remove_block(self, position, immediate=True):
+        """ Remove the block at the given `position`.
+        Parameters
+        ----------
+        position : tuple of len 3
+            The (x, y, z) position of the block to remove.
+        immediate : bool
+            Whether or not to immediately remove block from canvas.
+        """
+        if self.pristine is not None:
+            self._remember(position)
+        del self.world[position]
+        sector = sectorize(position)
+        self.sectors[sector].discard(position)
+        self.dirty.add(sector)
+        self.mask.remove(position)
+        self._relight(position, immediate)
+        self.visibility.update(position)
+        self._redraw_far(sector)
+        for listener in self.listeners:
+            listener(position, None)
+        if immediate and self.touched is not None:
+            self.touched.add(position)
+        elif immediate:
+            if position in self.shown:
+                self.hide_block(position)
+            self.check_neighbors(position)
+
+    def place_block(self, block, previous, bid, rotation=(0, 0)):
+        """ Use the block `bid` on the targeted `block`, as a right click
+        does: replace plants, stack slabs, prime tnt, soak up water with a
+        sponge or place `bid` at `previous`.
+        Parameters
+        ----------
+        block : tuple of len 3 or None
+            The block under the crosshairs, as returned by `hit_test()`.
+        previous : tuple of len 3 or None
+            The empty position in front of `block`.
+        bid : str
+            The block the player is holding.
+        rotation : tuple of len 2
+            The player rotation, used to orient rotating blocks.
+        """
+        if block is None:
+            return
+        target = self.world[block]
+        target = target.replace("_inv","")
+        # replace blocks
+        if target in REPLACE:
+            self.remove_block(block)
+            self.add_block(block, bid, True, rotation)
+        # stacking slabs
+        elif target in SLAB and bid == target:
+            full = target + "_full"
+            self.remove_block(block)
+            self.add_block(block, full, True, rotation)
+        # tnt exploding, on the next tick
+        elif target == "tnt":
+            self.explosions.prime(block)
+        elif previous:
+            # sponge code
+            if bid == "sponge":
+                with self.bulk():
+                    if self.fluids.absorb(previous):
+                        self.add_block(previous, "wet_sponge")
+                    else:
+                        self.add_block(previous, bid)
+            # inverted slabs
+            elif bid in SLAB and rotation[1] > 0:
+                self.add_block(previous, bid + "_inv")
+            #regular block placement
+            else:
+                self.add_block(previous, bid, True, rotation)
+
+    def break_block(self, block):
+        """ Remove the targeted `block`, as a left click does.
+        """
+        if block is None:
+            return
+        self.remove_block(block)
+
+    def _relight(self, position, immediate):
+        """ Update the light after the block at `position` changed and, if
+        `immediate`, redraw the other shown blocks whose shading it changed.
+        """
+        changed = self.light.update(position)
+        if not immediate:
+            return
+        # The blocks around it, whose corners it may shade, and those next
+        # to the cells its light reached.
+        x, y, z = position
+        redraw = set()
+        for dx in xrange(-1, 2):
+            for dy in xrange(-1, 2):
+                for dz in xrange(-1, 2):
+                    key = (x + dx, y + dy, z + dz)
+                    if key in self.shown and key != position:
+                        redraw.add(key)
+        for x, y, z in changed:
+            for dx, dy, dz in FACES + [(0, 0, 0)]:
+                key = (x + dx, y + dy, z + dz)
+                if key in self.shown and key != position:
+                    redraw.add(key)
+        if self.touched is not None:
+            self.touched.update(redraw)
+            return
+        for key in redraw:
+            self.hide_block(key)
+            self.show_block(key)
+
+    def _forget(self, sector):
+        """ Drop the light around `sector`, and its visibility, after placing
+        its blocks, to be computed again when it is drawn.
+        """
+        self.visibility.invalidate(sector)
+        x, _, z = sector
+        for dx in xrange(-1, 2):
+            for dz in xrange(-1, 2):
+                self.light.invalidate((x + dx, 0, z + dz))
+
+    @contextmanager
+    def bulk(self):
+        """ Context manager batching the blocks added and removed inside it.
+        The world changes at once, but what is shown is brought up to date
+        when the outermost `bulk()` ends, once for each edited block and its
+        neighbours, so renderers rebuild each touched sector once.
+
+            with model.bulk():
+                for position in crater:
+                    model.remove_block(position)
+        """
+        if self.touched is not None:
+            yield
+            return
+        self.touched = set()
+        try:
+            yield
+        finally:
+            touched, self.touched = self.touched, None
+            self.refresh(touched)
+
+    def refresh(self, positions):
+        """ Show or hide the blocks at `positions` and around them so what
+        is shown matches the world again after they were edited.
+        """
+        check = set(positions)
+        for x, y, z in positions:
+            for dx, dy, dz in FACES:
+                check.add((x + dx, y + dy, z + dz))
+        for position in positions:
+            # The block may have been replaced by another one.
+            if position in self.shown:
+                self.hide_block(position)
+        for position in check:
+            if position in self.world and self.exposed(position):
+                if position not in self.shown:
+                    self.show_block(position)
+            elif position in self.shown:
+                self.hide_block(position)
+
+    def check_neighbors(self, position):
+        """ Check all blocks surrounding `position` and ensure their visual
+        state is current. This means hiding blocks that are not exposed and
+        ensuring that all exposed blocks are shown. Usually used after a block
+        is added or removed.
+        """
+        
+        x, y, z = position
+        for dx, dy, dz in FACES:
+            key = (x + dx, y + dy, z + dz)
+            if key not in self.world:
+                continue
+            if self.exposed(key):
+                if key not in self.shown:
+                    self.show_block(key)
+            else:
+                if key in self.shown:
+                    self.hide_block(key)
+
+    def show_block(self, position, immediate=True):
+        """ Show the block at the given `position`. This method assumes the
+        block has already been added with add_block()
+        Parameters
+        ----------
+        position : tuple of len 3
+            The (x, y, z) position of the block to show.
+        immediate : bool
+            Whether or not to show the block immediately.
+        """
+        
+        bid = self.world[position]
+        self.shown[position] = bid
+        
+        if immediate:
+            self._show_block_typed(position, bid)
+        else:
+            self._enqueue(self._show_block_typed, position, bid)
+
+    def _show_block_typed(self, position, bid):
+        """ Draw the block at `position`. The world model has nothing to draw;
+        renderers override this.
+        """
+        pass
+
+    def hide_block(self, position, immediate=True):
+        """ Hide the block at the given `position`. Hiding does not remove the
+        block from the world.
+        Parameters
+        ----------
+        position : tuple of len 3
+            The (x, y, z) position of the block to hide.
+        immediate : bool
+            Whether or not to immediately remove the block from the canvas.
+        """
+        self.shown.pop(position)
+        if immediate:
+            self._hide_block(position)
+        else:
+            self._enqueue(self._hide_block, position)
+
+    def _hide_block(self, position):
+        """ Remove the block at `position` from the canvas. The world model
+        has nothing to draw; renderers override this.
+        """
+        pass
+
+    def load_sector(self, sector, wait=True):
+        """ Read `sector` from the store if it has not been read yet. Loaded
+        blocks are not reported to `listeners` and do not make the sector
+        dirty. Returns True once the sector is loaded; with `wait` False and
+        `io` set, returns False instead of waiting for the read.
+        """
+        if sector in self.loaded:
+            return True
+        if not self.generated_around(sector):
+            if not wait:
+                return False
+            while not self.generated_around(sector):
+                self.generate(0)
+        if self.store is not None:
+            if self.io is not None:
+                future = self.io.read(sector)
+                if not wait and not future.done():
+                    return False
+                blocks = future.result()
+                self.io.discard(sector)
+            else:
+                blocks = self.store.load(sector)
+            if blocks and self.pristine is not None:
+                self._apply_edits(sector, [(position, None if bid == AIR else bid, turn)
+                                           for position, bid, turn in blocks])
+            elif blocks:
+                positions = self.sectors.setdefault(sector, set())
+                for position, bid, turn in blocks:
+                    # Generated since a save made before the sectors around
+                    # were generated; see `_place()`.
+                    other = self.world.get(position)
+                    if other is not None and _precedence(other) > _precedence(bid):
+                        continue
+                    self.world[position] = bid
+                    self.rots[position] = turn
+                    positions.add(position)
+                    self.mask.add(position, bid not in THRU)
+        self.loaded.add(sector)
+        self._replay(sector)
+        self._forget(sector)
+        return True
+
+    def replay_edits(self, edits):
+        """ Apply `edits` made in an earlier session, such as those read back
+        from a `journal.Journal`. Edits to loaded sectors apply now, the rest
+        when their sector loads.
+        Parameters
+        ----------
+        edits : list of (position, bid, turn)
+            Block changes in the order they were made, with bid None for
+            removed blocks.
+        """
+        for edit in edits:
+            self.replay.setdefault(sectorize(edit[0]), []).append(edit)
+        for sector in list(self.replay):
+            if sector in self.loaded:
+                self._replay(sector)
+
+    def _replay(self, sector):
+        edits = self.replay.pop(sector, None)
+        if edits:
+            self._apply_edits(sector, edits)
+            self.dirty.add(sector)
+
+    def _apply_edits(self, sector, edits):
+        """ Apply (position, bid, turn) `edits` inside `sector` without
+        reporting them to `listeners` or updating what is shown.
+        """
+        positions = self.sectors.setdefault(sector, set())
+        for position, bid, turn in edits:
+            if self.pristine is not None:
+                self._remember(position)
+            if position in self.world:
+                del self.world[position]
+                positions.discard(position)
+                self.mask.remove(position)
+            if bid is not None:
+                self.world[position] = bid
+                self.rots[position] = turn
+                positions.add(position)
+                self.mask.add(position, bid not in THRU)
+
+    def _state(self, position):
+        if position not in self.world:
+            return None
+        return self.world[position], self.rots.get(position, 0)
+
+    def _remember(self, position):
+        pristine = self.pristine.setdefault(sectorize(position), {})
+        if position not in pristine:
+            pristine[position] = self._state(position)
+
+    def diff(self, sector):
+        """ Returns the (position, bid, turn) blocks of `sector` that differ
+        from the generated terrain, with bid AIR for removed blocks. Only
+        available in "delta" mode.
+        """
+        blocks = []
+        for position, before in self.pristine.get(sector, {}).items():
+            after = self._state(position)
+            if after == before:
+                continue
+            if after is None:
+                blocks.append((position, AIR, 0))
+            else:
+                blocks.append((position, after[0], after[1]))
+        return blocks
+
+    def save(self, replayed=True):
+        """ Write the sectors changed since the last save to the store. With
+        `io` set the writes are queued on its thread pool.
+        Parameters
+        ----------
+        replayed : bool
+            Whether to first load the sectors that still have edits to
+            replay, so that every journaled edit is saved.
+        """
+        if self.store is None:
+            return
+        if replayed:
+            for sector in list(self.replay):
+                self.load_sector(sector)
+        if self.io is not None:
+            for sector in sorted(self.dirty):
+                self.io.write(sector, self.store.encode(self, sector))
+            if self.generator is not None:
+                # Not recording sectors as generated before they are stored.
+                self.io.flush()
+            self.store.save_level(self)
+        else:
+            self.store.save(self, sorted(self.dirty))
+        self.dirty.clear()
+
+    def show_sector(self, sector):
+        """ Ensure all blocks in the given sector that should be shown are
+        drawn to the canvas.
+        """
+        for position in self.sectors.get(sector, ()):
+            if position not in self.shown and self.exposed(position):
+                self.show_block(position, False)
+
+    def hide_sector(self, sector):
+        """ Ensure all blocks in the given sector that should be hidden are
+        removed from the canvas.
+        """
+        for position in self.sectors.get(sector, ()):
+            if position in self.shown:
+                self.hide_block(position, False)
+
+    def change_sectors(self, before, after):
+        """ Move from sector `before` to sector `after`. A sector is a
+        contiguous x, y sub-region of world. Sectors are used to speed up
+        world rendering.
+        """
+        self.center = after
+        self._change_view(before, self._view(before), after, self._view(after))
+
+    def set_render_distance(self, distance):
+        """ Draw the sectors up to `distance` sectors away, within
+        MIN_RENDER_DISTANCE and MAX_RENDER_DISTANCE, showing and hiding
+        sectors at once. Returns the distance set.
+        """
+        distance = max(MIN_RENDER_DISTANCE, min(MAX_RENDER_DISTANCE, int(distance)))
+        if distance != self.render_distance:
+            before_view = self._view(self.center)
+            self.render_distance = distance
+            self._change_view(self.center, before_view, self.center, self._view(self.center))
+        return distance
+
+    def detail_radius(self):
+        """ Returns the radius, in sectors, of the sectors drawn block by
+        block.
+        """
+        return min(DETAIL_RADIUS, self.render_distance)
+
+    def view_distance(self):
+        """ Returns how far the player sees, in blocks.
+        """
+        return float(self.render_distance * self.mask.size)
+
+    def _change_view(self, before, before_view, after, after_view):
+        """ Show and hide sectors to go from `before_view` around sector
+        `before` to `after_view` around sector `after`; see `_view()`.
+        """
+        show = set(sector for sector, step in after_view.items()
+                   if step == 1 and before_view.get(sector) != 1)
+        hide = set(sector for sector, step in before_view.items()
+                   if step == 1 and after_view.get(sector) != 1)
+        for sector, step in before_view.items():
+            if step > 1 and after_view.get(sector) != step:
+                self.far_waiting.pop(sector, None)
+                if after_view.get(sector) != 1:
+                    # Sectors coming into detail keep their simplified mesh
+                    # until they are shown.
+                    self.hide_far(sector)
+        x, _, z = after or (0, 0, 0)
+        for sector, step in sorted(after_view.items(),
+                                   key=lambda item: (item[0][0] - x) ** 2 + (item[0][2] - z) ** 2):
+            # Nearest first.
+            if step > 1 and before_view.get(sector) != step:
+                self.far_waiting[sector] = step
+        if after:
+            # The sectors around the player are needed for collision; see
+            # `area_loaded()`.
+            x, y, z = after
+            for dx in xrange(-1, 2):
+                for dz in xrange(-1, 2):
+                    self.load_sector((x + dx, y, z + dz), wait=False)
+        if self.io is not None:
+            ahead = set()
+            if before and after and before != after:
+                # Read ahead two sectors in the direction of travel.
+                dx = (after[0] > before[0]) - (after[0] < before[0])
+                dz = (after[2] > before[2]) - (after[2] < before[2])
+                ahead = set((x + 2 * dx, y, z + 2 * dz) for x, y, z in show
+                            if (x + 2 * dx, y, z + 2 * dz) not in self.loaded)
+                self.io.prefetch(ahead)
+            # Reads of sectors left behind would be kept until they are shown.
+            self.io.keep(ahead.union(after_view))
+        for sector in hide:
+            self.waiting.discard(sector)
+            self.hide_sector(sector)
+        self.waiting.update(show)
+        self.show_loaded()
+
+    def _view(self, sector):
+        """ Returns a mapping from each sector in view from `sector` to 1 for
+        the sectors drawn block by block and to the step of their simplified
+        mesh for the others.
+        """
+        view = {}
+        if not sector:
+            return view
+        x, y, z = sector
+        detail = self.detail_radius()
+        outer = self.render_distance
+        for dx in xrange(-outer, outer + 1):
+            for dz in xrange(-outer, outer + 1):
+                distance = dx ** 2 + dz ** 2
+                if distance <= (detail + 1) ** 2:
+                    view[x + dx, y, z + dz] = 1
+                elif distance <= (outer + 1) ** 2 and LOD_RINGS:
+                    for radius, step in LOD_RINGS:
+                        if distance <= (radius + 1) ** 2:
+                            break
+                    view[x + dx, y, z + dz] = step
+        return view
+
+    def area_loaded(self, sector):
+        """ Returns True if `sector` and the sectors around it are loaded, so
+        the player can collide with them.
+        """
+        x, y, z = sector
+        for dx in xrange(-1, 2):
+            for dz in xrange(-1, 2):
+                if not self.load_sector((x + dx, y, z + dz), wait=False):
+                    return False
+        return True
+
+    def show_loaded(self, wait=False, budget=None):
+        """ Show the `waiting` sectors whose blocks, and their neighbours'
+        blocks, have been read, so blocks on their edges know their
+        neighbours before being shown, then the `far_waiting` sectors whose
+        own blocks have been read already. With `wait`, wait for the reads of
+        the `waiting` sectors and show them all; otherwise stop after `budget`
+        seconds, if given.
+        """
+        start = time.process_time()
+        for sector in list(self.waiting):
+            if budget is not None and time.process_time() - start > budget:
+                break
+            x, y, z = sector
+            ready = True
+            for dx in xrange(-1, 2):
+                for dz in xrange(-1, 2):
+                    if not self.load_sector((x + dx, y, z + dz), wait):
+                        ready = False
+            if ready:
+                self.waiting.discard(sector)
+                self.show_sector(sector)
+                self.hide_far(sector)
+        for sector, step in list(self.far_waiting.items()):
+            if budget is not None and time.process_time() - start > budget:
+                break
+            # Never waited for: the view is complete without them.
+            if self.load_sector(sector, False):
+                del self.far_waiting[sector]
+                self.hide_far(sector)
+                self.far[sector] = step
+                self._show_far(sector, step)
+
+    def hide_far(self, sector):
+        """ Stop drawing the simplified mesh of `sector`, if it has one.
+        """
+        if self.far.pop(sector, None) is not None:
+            self._hide_far(sector)
+
+    def heightmap(self, sector, step):
+        """ Returns the (x, z, y, bid) of the highest block, plants left out,
+        of each `step` x `step` cell of columns of `sector`, where x and z are
+        the least of the cell.
+        """
+        size = self.mask.size
+        ox, oz = sector[0] * size, sector[2] * size
+        cells = -(-size // step)
+        plants = frozenset(PLANTEE)
+        world = self.world
+        tops = {}
+        for position in self.sectors.get(sector, ()):
+            bid = world[position]
+            if bid in plants:
+                continue
+            x, y, z = position
+            i = (z - oz) // step * cells + (x - ox) // step
+            top = tops.get(i)
+            if top is None or y > top[0]:
+                tops[i] = (y, bid)
+        return [(ox + i % cells * step, oz + i // cells * step, y, bid)
+                for i, (y, bid) in sorted(tops.items())]
+
+    def _redraw_far(self, sector):
+        """ Draw `sector` again after one of its blocks changed, if it is
+        drawn simplified.
+        """
+        step = self.far.get(sector)
+        if step is not None:
+            self._show_far(sector, step)
+
+    def _show_far(self, sector, step):
+        """ Draw `sector` simplified to one quad per `step` x `step` columns,
+        or draw it again after its blocks changed. The world model has
+        nothing to draw; renderers override this.
+        """
+        pass
+
+    def _hide_far(self, sector):
+        """ Stop drawing the simplified mesh of `sector`; see `_show_far()`.
+        """
+        pass
+
+    def _enqueue(self, func, *args):
+        """ Add `func` to the internal queue.
+        """
+        self.queue.append((func, args))
+
+    def _dequeue(self):
+        """ Pop the top function from the internal queue and call it.
+        """
+        func, args = self.queue.popleft()
+        func(*args)
+
+    def tick(self, budget=None):
+        """ Advance the simulation by one tick: set off primed TNT, then
+        update blocks, sharing `budget` seconds, if given, between them.
+        """
+        start = time.process_time()
+        self.explosions.tick(budget)
+        if budget is not None:
+            budget = max(0, budget - (time.process_time() - start))
+        self.updates.tick(budget)
+
+    def advance(self, dt, budget=None):
+        """ Add `dt` seconds of frame time and run a `tick()` for every
+        1 / TICKS_PER_SEC seconds of it, so the world runs at TICKS_PER_SEC
+        whatever the frame rate, sharing `budget` seconds, if given, between
+        the ticks. Returns the number of ticks run.
+        """
+        if not self.simulated:
+            return 0
+        tick = 1.0 / TICKS_PER_SEC
+        self.tick_time += min(dt, MAX_FRAME_TIME)
+        start = time.process_time()
+        ticks = 0
+        while self.tick_time >= tick:
+            self.tick_time -= tick
+            if budget is None:
+                self.tick()
+            else:
+                self.tick(max(0, budget - (time.process_time() - start)))
+            ticks += 1
+        return ticks
+
+    def process_queue(self, dt=0.0, budget=FRAME_BUDGET):
+        """ Process the entire queue while taking periodic breaks. This allows
+        the game loop to run smoothly. The queue contains calls to
+        _show_block() and _hide_block() so this method should be called if
+        add_block() or remove_block() was called with immediate=False.
+        `dt` is the frame time since the last call, run as ticks by
+        `advance()`. All the work shares `budget` seconds.
+        """
+        start = time.process_time()
+        self.advance(dt, TICK_SHARE * budget)
+        if self.generator is not None:
+            self.generate(min(GENERATE_SHARE * budget,
+                              max(0, budget - (time.process_time() - start))))
+        if self.waiting:
+            self.show_loaded(budget=max(0, budget - (time.process_time() - start)))
+        while self.queue and time.process_time() - start < budget:
+            self._dequeue()
+
+    def process_entire_queue(self):
+        """ Process the entire queue with no breaks.
+        """
+        if self.waiting:
+            self.show_loaded(wait=True)
+        while self.queue:
+            self._dequeue()